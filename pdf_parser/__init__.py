@@ -1 +1,7 @@
 from .parser import Parser, ParserBackend
+from .cache import ResultCache
+from .manifest import JobManifest
+from .pipeline import Pipeline
+from .store import ResultStore
+from .normalize import Document, DocumentWriter, normalize
+from .preflight import Preflight
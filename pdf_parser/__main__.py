@@ -1,15 +1,100 @@
+import sys
 import argparse
 from .parser import Parser
+from .autoscale import threads_arg
+from .cache import ResultCache
+from .metrics import MetricsReporter, profiled
+from .pipeline import Pipeline
+from .preflight import Preflight
+from .store import ResultStore
+from .normalize import DocumentWriter
 
-if __name__ == '__main__':
+
+def main():
     arg_parser = argparse.ArgumentParser()
 
     arg_parser.add_argument('-b', '--backend', default='grobid', help='Backend to use. (Default: grobid)')
     arg_parser.add_argument('-t', '--type', default='text', help='Type of content. (Default: text)')
-    arg_parser.add_argument('-n', '--thread', default=0, help='Number of thread. (Default: 0)')
+    arg_parser.add_argument('-n', '--thread', type=threads_arg, default=0,
+                            help='Number of thread, or auto to size it from the cpus, memory and latency. (Default: 0)')
+    arg_parser.add_argument('-s', '--stage', action='append', default=None, metavar='BACKEND:TYPE',
+                            help='Run several backends over one scan of the input, e.g. -s grobid:text -s '
+                                 'pdffigures2:figure. Overrides -b and -t.')
+    arg_parser.add_argument('-r', '--recursive', action='store_true', help='Also parse PDF files in sub directories.')
+    arg_parser.add_argument('--resume', action='store_true',
+                            help='Keep a job manifest in the output directory, and skip PDF files done by a previous run.')
+    arg_parser.add_argument('--cache-dir', default=None, help='Directory of the result cache. (Default: disabled)')
+    arg_parser.add_argument('--cache-size', type=int, default=100000,
+                            help='Max number of entries in the result cache. (Default: 100000)')
+    arg_parser.add_argument('--store', default=None,
+                            help='Append the results into zip shards in this directory, instead of leaving them as '
+                                 'files in the output directory. (Default: disabled)')
+    arg_parser.add_argument('--normalize', default=None,
+                            help='Also append the results as normalized documents to this JSON Lines file.')
+    arg_parser.add_argument('--dedup', default=None, metavar='METHODS',
+                            help='Parse one copy of duplicate PDF files, found by comma separated methods out of hash, '
+                                 'id and text, e.g. hash,id. (Default: disabled)')
+    arg_parser.add_argument('--preflight', action='store_true',
+                            help='Reject empty, truncated, encrypted and non-PDF files before they reach the backend.')
+    arg_parser.add_argument('--max-pages', type=int, default=None,
+                            help='With --preflight, also reject PDF files with more pages. (Default: no limit)')
+    arg_parser.add_argument('--metrics-jsonl', default=None, help='Append a metrics snapshot to this JSONL file.')
+    arg_parser.add_argument('--metrics-prom', default=None, help='Write the metrics in Prometheus text format to this file.')
+    arg_parser.add_argument('--metrics-interval', type=float, default=10,
+                            help='Seconds between two metrics exports. (Default: 10)')
+    arg_parser.add_argument('--profile', default=None, help='Run under cProfile and dump the stats to this file.')
     arg_parser.add_argument('input_path', help='Input directory or Input PDF file')
     arg_parser.add_argument('output_path', help='Output directory')
 
     args = arg_parser.parse_args()
-    parser = Parser(args.backend)
-    parser.parse(args.type, args.input_path, args.output_path, args.thread)
+    cache = ResultCache(args.cache_dir, max_entries=args.cache_size) if args.cache_dir else None
+    store = ResultStore(args.store) if args.store else None
+    normalize = DocumentWriter(args.normalize) if args.normalize else None
+    dedup = tuple(args.dedup.split(',')) if args.dedup else None
+    preflight = Preflight(max_pages=args.max_pages) if args.preflight else None
+    if args.stage:
+        pipeline = Pipeline([stage.split(':', 1) for stage in args.stage], cache=cache, manifest=args.resume,
+                            store=store, normalize=normalize, dedup=dedup, preflight=preflight)
+        pipeline.parse(args.input_path, args.output_path, args.thread, recursive=args.recursive)
+        pipeline.close()
+        for output in (store, normalize):
+            if output is not None:
+                output.close()
+        return
+    parser = Parser(args.backend, cache=cache, manifest=args.resume, store=store, normalize=normalize, dedup=dedup,
+                    preflight=preflight)
+    reporter = None
+    if args.metrics_jsonl or args.metrics_prom:
+        reporter = MetricsReporter(parser.metrics, args.metrics_jsonl, args.metrics_prom, args.metrics_interval).start()
+    try:
+        if args.profile:
+            with profiled(args.profile):
+                parser.parse(args.type, args.input_path, args.output_path, args.thread, recursive=args.recursive)
+        else:
+            parser.parse(args.type, args.input_path, args.output_path, args.thread, recursive=args.recursive)
+    finally:
+        if reporter is not None:
+            reporter.stop()
+        for output in (store, normalize):
+            if output is not None:
+                output.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'bench':
+        from .benchmark import main as bench_main
+        bench_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] in ('coordinator', 'worker'):
+        from .distributed import main as distributed_main
+        distributed_main(sys.argv[1:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'export':
+        from .store import main as export_main
+        export_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'normalize':
+        from .normalize import main as normalize_main
+        normalize_main(sys.argv[2:])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        from .server import main as serve_main
+        serve_main(sys.argv[2:])
+    else:
+        main()
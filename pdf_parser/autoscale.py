@@ -0,0 +1,227 @@
+import os
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+GB = 1 << 30
+
+
+def cpu_count():
+    """Cpus this process may run on, which is less than os.cpu_count() in a container or under taskset"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def threads_arg(value):
+    """argparse type of a number of threads, or 'auto'"""
+    return value if value == 'auto' else int(value)
+
+
+def mem_available():
+    """Bytes of memory available to new processes without swapping, or None if unknown"""
+    try:
+        with open('/proc/meminfo') as fp:
+            for line in fp:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _cpu_times():
+    try:
+        with open('/proc/stat') as fp:
+            values = [int(value) for value in fp.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    idle = values[3] + (values[4] if len(values) > 4 else 0)  # idle + iowait
+    return sum(values), idle
+
+
+def child_rss(pid=None):
+    """Total RSS in bytes of all descendants of a process (e.g. the JVMs of a backend), or None if unknown"""
+    pid = pid or os.getpid()
+    parents = {}
+    try:
+        pids = [int(name) for name in os.listdir('/proc') if name.isdigit()]
+    except OSError:
+        return None
+    for child in pids:
+        try:
+            with open(f'/proc/{child}/stat') as fp:
+                # the command name may contain spaces, the fields after it are space separated
+                parents[child] = int(fp.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    descendants, frontier = [], [pid]
+    while frontier:
+        parent = frontier.pop()
+        children = [child for child, ppid in parents.items() if ppid == parent]
+        descendants.extend(children)
+        frontier.extend(children)
+
+    total = 0
+    for child in descendants:
+        try:
+            with open(f'/proc/{child}/status') as fp:
+                for line in fp:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except (OSError, ValueError, IndexError):
+            continue
+    return total
+
+
+class AutoScaler:
+    """Concurrency limit sized from the host, and adjusted every `interval` seconds while parsing.
+
+    Workers take a slot before each job. The limit never exceeds `maximum`, nor the number of workers
+    which fit in the available memory minus `mem_reserve`, where the memory of a worker is measured from
+    the RSS of the child processes, or `mem_per_worker` until any is running. If the backend reports a
+    latency stage (e.g. 'http' of a server backend), the limit is cut by a quarter once the mean latency
+    rises over `latency_factor` times the lowest seen, since the server is then queueing; otherwise it
+    grows while the cpus are busy less than `target_cpu`, and shrinks when they are saturated.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, mem_per_worker=None, mem_reserve=GB, target_cpu=0.85,
+                 metrics=None, latency_stage=None, latency_factor=2.0, interval=5.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.mem_per_worker = mem_per_worker
+        self.mem_reserve = mem_reserve
+        self.target_cpu = target_cpu
+        self.metrics = metrics
+        self.latency_stage = latency_stage
+        self.latency_factor = latency_factor
+        self.interval = interval
+
+        self.active = 0
+        self.limit = self._clamp(initial if initial is not None else self.maximum, self._memory_cap(0))
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._cpu = _cpu_times()
+        self._latency_mark = None
+        self._latency_floor = None
+
+    @classmethod
+    def for_processes(cls, cpu_per_worker, mem_per_worker, maximum=None, options=None):
+        """Local worker processes, e.g. JVMs which keep cpu_per_worker cpus busy; options override the defaults"""
+        cpus = max(1, int(cpu_count() / cpu_per_worker))
+        kwargs = {'maximum': maximum or cpus * 2, 'initial': cpus, 'mem_per_worker': mem_per_worker}
+        kwargs.update(options or {})
+        return cls(**kwargs)
+
+    @classmethod
+    def for_requests(cls, metrics, maximum, initial=16, stage='http', options=None):
+        """Requests to a server, limited by how its latency grows with concurrency"""
+        kwargs = {'maximum': maximum, 'initial': initial, 'metrics': metrics, 'latency_stage': stage}
+        kwargs.update(options or {})
+        return cls(**kwargs)
+
+    def _clamp(self, limit, cap=None):
+        return max(self.minimum, min(limit, self.maximum, cap if cap is not None else self.maximum))
+
+    def _memory_cap(self, child_memory):
+        available = mem_available()
+        per_worker = self.mem_per_worker
+        if self.active and child_memory:
+            per_worker = child_memory / self.active
+        if available is None or not per_worker:
+            return None
+        return self.active + int((available - self.mem_reserve) // per_worker)
+
+    def _cpu_busy(self):
+        now = _cpu_times()
+        if now is None or self._cpu is None:
+            return None
+        total, idle = now[0] - self._cpu[0], now[1] - self._cpu[1]
+        self._cpu = now
+        return 1 - idle / total if total > 0 else None
+
+    def _latency(self):
+        if self.metrics is None or self.latency_stage is None:
+            return None
+        stage = self.metrics.snapshot()['stages'].get(self.latency_stage)
+        if stage is None:
+            return None
+        mark, self._latency_mark = self._latency_mark, (stage['runs'], stage['seconds'])
+        if mark is None or stage['runs'] == mark[0]:
+            return None
+        return (stage['seconds'] - mark[1]) / (stage['runs'] - mark[0])
+
+    def adjust(self):
+        """Sample the host and the backend, and set the new limit"""
+        memory = child_rss() if self.mem_per_worker else None
+        cap = self._memory_cap(memory)
+        busy = self._cpu_busy()
+        latency = self._latency()
+        saturated = self.active >= self.limit  # only grow when the limit is what holds the workers back
+
+        limit = self.limit
+        available = mem_available()
+        if available is not None and self.mem_per_worker and available < self.mem_reserve:
+            limit -= max(1, limit // 4)
+        elif self.latency_stage is not None:
+            if latency is not None:
+                self._latency_floor = min(self._latency_floor or latency, latency)
+                if latency > self._latency_floor * self.latency_factor:
+                    limit -= max(1, limit // 4)
+                elif saturated:
+                    limit += max(1, limit // 8)
+        elif busy is not None:
+            if busy > min(0.99, self.target_cpu + 0.1):
+                limit -= 1
+            elif busy < self.target_cpu and saturated:
+                limit += 1
+        limit = self._clamp(limit, cap)
+
+        with self._cond:
+            if limit != self.limit:
+                logger.debug(f'Concurrency {self.limit} -> {limit} (cpu busy {busy}, latency {latency}, '
+                             f'child rss {memory}, memory cap {cap})')
+                self.limit = limit
+                self._cond.notify_all()
+        if self.metrics is not None:
+            self.metrics.set('concurrency_limit', limit)
+        return limit
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.adjust()
+            except Exception:
+                logger.exception('Could not adjust the concurrency')
+
+    def start(self):
+        logger.info(f'Concurrency starts at {self.limit}, at most {self.maximum}.')
+        self._thread = threading.Thread(target=self._loop, name='autoscaler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
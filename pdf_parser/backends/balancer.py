@@ -0,0 +1,101 @@
+import logging
+import threading
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint:
+    def __init__(self, url):
+        self.url = url
+        self.healthy = None  # unknown until the first probe
+        self.outstanding = 0
+        self.latency = None  # exponentially weighted moving average, in seconds
+
+    def __repr__(self):
+        return f'Endpoint({self.url}, healthy={self.healthy}, outstanding={self.outstanding})'
+
+
+class EndpointBalancer:
+    """Spread requests over several servers, and keep unhealthy ones out of rotation.
+
+    `policy` is 'least_outstanding' (fewest requests in flight, ties broken by latency) or
+    'latency' (lowest expected wait: latency * (outstanding + 1)). A background thread probes
+    `check_path` of every endpoint each `check_interval` seconds, so that a failed server is put
+    back in rotation once it recovers.
+    """
+
+    def __init__(self, urls, check_path='/api/isalive', check_interval=10, policy='least_outstanding',
+                 alpha=0.2):
+        if policy not in ('least_outstanding', 'latency'):
+            raise ValueError(f'balancing policy is not valid: {policy}')
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.check_path = check_path
+        self.check_interval = check_interval
+        self.policy = policy
+        self.alpha = alpha
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def check(self):
+        """Probe all endpoints now, return True if at least one is healthy"""
+        for endpoint in self.endpoints:
+            try:
+                healthy = requests.get(endpoint.url + self.check_path, timeout=2).status_code == 200
+            except Exception:
+                healthy = False
+            if healthy != endpoint.healthy:
+                if healthy:
+                    logger.info(f'{endpoint.url} is up, put it in rotation.')
+                else:
+                    logger.error(f'{endpoint.url} is down, take it out of rotation.')
+            endpoint.healthy = healthy
+        return self.healthy()
+
+    def healthy(self):
+        return any(endpoint.healthy for endpoint in self.endpoints)
+
+    def start(self):
+        if self._thread is not None or self.check_interval is None:
+            return
+        self._thread = threading.Thread(target=self._check_loop, name='endpoint-health-check', daemon=True)
+        self._thread.start()
+
+    def _check_loop(self):
+        while not self._stop.wait(self.check_interval):
+            self.check()
+
+    def close(self):
+        self._stop.set()
+
+    def _score(self, endpoint):
+        latency = endpoint.latency or 0.0
+        if self.policy == 'latency':
+            return latency * (endpoint.outstanding + 1), endpoint.outstanding
+        return endpoint.outstanding, latency
+
+    def acquire(self):
+        """Pick a healthy endpoint and count one more request in flight on it, return None if all are down"""
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint.healthy]
+            if not candidates:
+                return None
+            endpoint = min(candidates, key=self._score)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, latency=None, failed=False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                if endpoint.healthy:
+                    logger.error(f'{endpoint.url} failed, take it out of rotation.')
+                endpoint.healthy = False
+            elif latency is not None:
+                if endpoint.latency is None:
+                    endpoint.latency = latency
+                else:
+                    endpoint.latency += self.alpha * (latency - endpoint.latency)
@@ -1,32 +1,216 @@
 import os
+import json
+import time
 import logging
+import tempfile
+import threading
 from abc import ABCMeta, abstractmethod
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from ..autoscale import AutoScaler
+from ..metrics import Metrics
+from ..utils import bounded_as_completed, iter_pdf_files, longest_first
 
 logger = logging.getLogger(__name__)
 
+QUARANTINE_FILENAME = '.pdf_parser.quarantine.jsonl'
+
+
+class BackendError(Exception):
+    """An external parser or server failed on a pdf"""
+
+
+class BackendTimeout(BackendError):
+    """An external parser ran out of its time budget and was killed"""
+
+
+class BackendAborted(BackendError):
+    """An external parser or server went away while it held a pdf, e.g. crashed on it"""
+
 
 class Backend(object, metaclass=ABCMeta):
+    # suffixes appended to the pdf name for each artifact written into output_dir
+    result_suffixes = ()
+
+    _quarantine_lock = threading.Lock()
+
     def __init__(self):
         self.typ2service = None
+        self.metrics = Metrics(self.__class__.__name__)
+        # callables (input_file, ok, duration, error), called once per processed pdf
+        self.listeners = [self.metrics.on_result]
+        # optional callable returning a context manager, entered around each job of _process_files, e.g. to
+        # hold back a bulk job while interactive requests run
+        self.gate = None
+        # optional staging shared by the stages of a Pipeline, which makes one local copy of each pdf for all of them
+        self.staging = None
 
     @abstractmethod
     def _process_pdf(self, input_file, output_file, service, **kwargs):
         """Parse one pdf file, please implement in subclass"""
 
-    @abstractmethod
-    def _process_dir(self, input_dir, output_dir, service, n_threads=0, **kwargs):
-        """Parse multiple pdf files in a same directory, please implement in subclass"""
+    def _process_bytes(self, content, name, service, **kwargs):
+        """Parse one pdf given as bytes, return its results as {suffix: bytes}, or {suffix: {name: bytes}} for a
+        directory result. By default through a scratch dir, backends which can do without override this"""
+        with tempfile.TemporaryDirectory(prefix='pdf_parser-bytes-') as dirname:
+            input_file = os.path.join(dirname, name)
+            with open(input_file, 'wb') as fp:
+                fp.write(content)
+            output_dir = os.path.join(dirname, 'output')
+            os.mkdir(output_dir)
+            self._process_pdf(input_file, output_dir, service, **dict(kwargs, force=True))
+            return self._read_results(input_file, output_dir)
+
+    def _read_results(self, input_file, output_dir):
+        results = {}
+        for suffix, path in self._result_paths(input_file, output_dir).items():
+            if os.path.isfile(path):
+                with open(path, 'rb') as fp:
+                    results[suffix] = fp.read()
+            elif os.path.isdir(path):
+                results[suffix] = {}
+                for entry in os.scandir(path):
+                    with open(entry.path, 'rb') as fp:
+                        results[suffix][entry.name] = fp.read()
+        return results
+
+    def _threads(self, n_threads, autoscale=None):
+        """The threads of _process_files and the AutoScaler sizing them for n_threads='auto', by default one local
+        process per thread and one thread per cpu"""
+        if n_threads == 'auto':
+            scaler = AutoScaler.for_processes(cpu_per_worker=1, mem_per_worker=256 << 20, options=autoscale)
+            return scaler.maximum, scaler
+        return n_threads or os.cpu_count(), None
+
+    def _process_files(self, pdf_files, output_dir, service, n_threads=0, schedule='size', schedule_window=0,
+                       autoscale=None, **kwargs):
+        """Parse pdf files from an iterable, which may be lazy and unbounded, one _process_pdf per pdf on n_threads
+        threads, return the number parsed. Batched backends override this"""
+        n_threads, scaler = self._threads(n_threads, autoscale)
+        # longest first, so that the biggest documents do not start at the end of the run, within a look-ahead of
+        # a few pdfs per thread, so that the first jobs start at once
+        window = schedule_window or 4 * n_threads
+        pdf_files = (input_file for input_file, _ in longest_first(pdf_files, schedule, window))
+
+        def process(file):
+            start = time.time()
+            try:
+                return self._process_pdf(file, output_dir, service, **kwargs)
+            except Exception as e:
+                # a bug must not drop the pdf without a report, the other pdfs go on
+                logger.exception(f'PDF parse failed: {file}')
+                self._report(file, False, start, str(e))
+                return 0
+
+        logger.info('Start processing PDF files.')
+        n_parsed = 0
+        process = self._scaled(process, scaler)
+        with scaler or nullcontext(), ThreadPoolExecutor(max_workers=n_threads) as executor:
+            for count, future in enumerate(bounded_as_completed(executor, process, pdf_files, n_threads * 2,
+                                                                self.metrics), 1):
+                n_parsed += future.result() or 0
+                if count % 1000 == 0:
+                    logger.debug(f'{count} PDF files are processed, {n_parsed} parsed')
+                if count % 10000 == 0:
+                    logger.info(f'{count} PDF files are processed, {n_parsed} parsed')
+        return n_parsed
+
+    def _process_dir(self, input_dir, output_dir, service, n_threads=0, recursive=False, **kwargs):
+        pdf_files = iter_pdf_files(input_dir, recursive)
+        return self._process_files(pdf_files, output_dir, service, n_threads, **kwargs)
 
     # @abstractmethod
     # def parse(self, typ, input_dir, output_dir, n_threads=0, **kwargs):
     #     """Parse pdf(s), please implement in subclass"""
 
-    def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
+    def close(self):
+        """Release the resources held by the backend, e.g. resident worker processes"""
+
+    def get_services(self, typ):
         if typ not in self.typ2service:
             raise ValueError(f'Backend {self.__class__.__name__} could not parse for type "{typ}".')
-        services = self.typ2service[typ]
+        return self.typ2service[typ]
+
+    @staticmethod
+    def _result_stem(input_file):
+        return os.path.splitext(os.path.basename(input_file))[0]
+
+    def _result_paths(self, input_file, output_dir):
+        stem = self._result_stem(input_file)
+        return {suffix: os.path.join(output_dir, stem + suffix) for suffix in self.result_suffixes}
+
+    def _source(self, input_file):
+        """Path to read input_file from, its copy staged once for all stages of a Pipeline if any"""
+        return self.staging.get(input_file) if self.staging is not None else input_file
+
+    @staticmethod
+    def _staging_dir(output_dir):
+        """Scratch dir inside output_dir, so that inputs can be hardlinked and results renamed atomically into place"""
+        return tempfile.TemporaryDirectory(prefix='.pdf_parser-tmp-', dir=output_dir)
+
+    def _report(self, input_file, ok, start, error=None):
+        duration = time.time() - start
+        for listener in self.listeners:
+            listener(input_file, ok, duration, error)
+
+    def _fail_all(self, pdf_files, error):
+        """Report every pdf of a job which cannot run at all as failed, e.g. without any server, return 0"""
+        start = time.time()
+        for input_file in pdf_files:
+            self._report(input_file, False, start, error)
+        return 0
+
+    def _report_batch(self, input_files, output_dir, start, error=None):
+        """Report the pdfs of one run, a pdf without any result counts as failed only if the run failed"""
+        if not self.listeners:
+            return
+        for input_file in input_files:
+            produced = any(os.path.exists(path) for path in self._result_paths(input_file, output_dir).values())
+            self._report(input_file, produced or error is None, start, None if produced else error)
+
+    def _quarantine(self, input_file, output_dir, start, reason):
+        """Record a pdf which could not be parsed within its time budget, and report it as failed"""
+        logger.warning(f'Quarantine {input_file}: {reason}')
+        record = {'path': os.path.abspath(input_file), 'backend': self.__class__.__name__, 'reason': reason,
+                  'time': time.time()}
+        with self._quarantine_lock:
+            with open(os.path.join(output_dir, QUARANTINE_FILENAME), 'a', encoding='utf-8') as fp:
+                fp.write(json.dumps(record) + '\n')
+        self._report(input_file, False, start, f'quarantined: {reason}')
+
+    def _scaled(self, fn, scaler):
+        """fn gated by the gate of the backend and the slots of an AutoScaler, or fn itself without either"""
+        gate = self.gate
+        if scaler is None and gate is None:
+            return fn
+
+        def gated(*args, **kwargs):
+            with gate() if gate is not None else nullcontext(), scaler.slot() if scaler is not None else nullcontext():
+                return fn(*args, **kwargs)
+        return gated
+
+    @staticmethod
+    def _batch_budget(n_files, doc_timeout=None, batch_timeout=None):
+        """Time budget of a run over n_files pdfs, or None for no limit"""
+        budgets = [budget for budget in (batch_timeout, doc_timeout and doc_timeout * n_files) if budget]
+        return min(budgets) if budgets else None
+
+    def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
+        services = self.get_services(typ)
 
         if os.path.isfile(input_path):
             return self._process_pdf(input_path, output_dir, services, **kwargs)
         else:
             return self._process_dir(input_path, output_dir, services, n_threads, **kwargs)
+
+    def parse_bytes(self, typ, content, name='document.pdf', **kwargs):
+        services = self.get_services(typ)
+        name = os.path.basename(name) or 'document.pdf'
+        if not name.lower().endswith('.pdf'):
+            name += '.pdf'
+        return self._process_bytes(content, name, services, **kwargs)
+
+    def parse_files(self, typ, pdf_files, output_dir, n_threads=0, **kwargs):
+        services = self.get_services(typ)
+        return self._process_files(pdf_files, output_dir, services, n_threads, **kwargs)
@@ -1,20 +1,28 @@
 import os
 import math
-import shutil
+import time
 import random
 import logging
-import tempfile
 import subprocess as sp
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from itertools import chain, islice
 from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
 
-from .base import Backend
+from .base import Backend, BackendTimeout
+from .jvm import JvmWorkerPool, JvmWorkerTimeout
+from ..autoscale import GB, AutoScaler
+from ..utils import bounded_as_completed, link_or_copy, longest_first, pack_batches, replace_path
 
 logger = logging.getLogger(__name__)
 
 
 class Cermine(Backend):
-    def __init__(self):
+    result_suffixes = ('.cermine.xml', '.cermine.figure')
+
+    class_name = 'pl.edu.icm.cermine.ContentExtractor'
+
+    def __init__(self, jvm_workers=0, jvm_max_docs=1000):
         super(Cermine, self).__init__()
         file_dir = os.path.dirname(__file__)
         self.jar = os.path.join(file_dir, '..', 'jar', 'cermine-1.13.jar')
@@ -27,6 +35,15 @@ class Cermine(Backend):
         self.health = None
         self._check_java()
 
+        # resident JVMs, so that small batches and single files do not pay the JVM startup every time
+        self.jvm_pool = None
+        if self.health and jvm_workers > 0:
+            self.jvm_pool = JvmWorkerPool(self.jar, self.class_name, size=jvm_workers, max_docs=jvm_max_docs)
+
+    def close(self):
+        if self.jvm_pool is not None:
+            self.jvm_pool.close()
+
     def _check_java(self):
         cmd = ['java', '-version']
         try:
@@ -37,78 +54,161 @@ class Cermine(Backend):
             logger.error('No java in your environment.')
 
     @staticmethod
-    def _move_result_from_tmp_to_output(tmp_dir, output_dir):
+    def _move_result_from_tmp_to_output(tmp_dir, output_dir, tmp_id2pdf_name):
+        produced = set()
         for name in os.listdir(tmp_dir):
-            prefix, ext = os.path.splitext(name)
+            tmp_id, ext = os.path.splitext(name)
+            pdf_name = tmp_id2pdf_name.get(tmp_id)
+            if pdf_name is None:
+                continue
             if ext == '.cermxml':
-                new_name = prefix + '.cermine.xml'
-                shutil.move(os.path.join(tmp_dir, name), os.path.join(output_dir, new_name))
+                replace_path(os.path.join(tmp_dir, name), os.path.join(output_dir, pdf_name + '.cermine.xml'))
+                produced.add(tmp_id)
             elif ext == '.images':
                 if len(os.listdir(os.path.join(tmp_dir, name))) == 0:
                     continue
-                new_name = prefix + '.cermine.figure'
-                shutil.move(os.path.join(tmp_dir, name), os.path.join(output_dir, new_name))
+                replace_path(os.path.join(tmp_dir, name), os.path.join(output_dir, pdf_name + '.cermine.figure'))
+                produced.add(tmp_id)
+        return len(produced)
 
-    def _process_pdf(self, input_file, output_dir, service, **kwargs):
-        if not self.health:
-            return 0
+    @staticmethod
+    def _complete(path):
+        """Whether a result was written out completely, rather than cut off by a killed run"""
+        if os.path.isdir(path):
+            return all(Cermine._complete(entry.path) for entry in os.scandir(path))
+        try:
+            if path.endswith('.cermxml'):
+                ET.parse(path)
+                return True
+            with open(path, 'rb') as fp:
+                fp.seek(max(0, os.fstat(fp.fileno()).st_size - 12))
+                tail = fp.read()
+        except (ET.ParseError, OSError):
+            return False
+        ext = os.path.splitext(path)[1].lower()
+        if ext == '.png':
+            return tail.endswith(b'IEND\xaeB`\x82')
+        if ext in ('.jpg', '.jpeg'):
+            return tail.endswith(b'\xff\xd9')
+        return True
 
-        class_name = 'pl.edu.icm.cermine.ContentExtractor'
-        with tempfile.TemporaryDirectory() as dirname:
-            shutil.copy(input_file, dirname)
-            cmd = ['java', '-cp', self.jar, class_name, '-path', dirname, '-outputs', service]
-            try:
-                sp.run(cmd, stdout=sp.DEVNULL, stderr=None, check=True)
-            except Exception as e:
-                logger.warning('Cermine exit exceptly with error: %s', str(e))
-            self._move_result_from_tmp_to_output(dirname, output_dir)
-        return 1
+    @staticmethod
+    def _finished_ids(tmp_dir, validate=False):
+        """Tmp ids with results, only those whose results are complete with validate, after a killed run"""
+        finished = set()
+        for name in os.listdir(tmp_dir):
+            tmp_id, ext = os.path.splitext(name)
+            if ext in ('.cermxml', '.images') and (not validate or Cermine._complete(os.path.join(tmp_dir, name))):
+                finished.add(tmp_id)
+        return finished
+
+    def _run_extractor(self, dirname, service, n_docs, timeout=None):
+        args = ['-path', dirname, '-outputs', service]
+        try:
+            if self.jvm_pool is not None:
+                self.jvm_pool.run(args, n_docs, timeout)
+            else:
+                sp.run(['java', '-cp', self.jar, self.class_name] + args, stdout=sp.DEVNULL, stderr=None, check=True,
+                       timeout=timeout)
+        except (sp.TimeoutExpired, JvmWorkerTimeout):
+            raise BackendTimeout(f'Cermine killed after {timeout:.0f} seconds')
+        except Exception as e:
+            logger.warning('Cermine exit exceptly with error: %s', str(e))
+            return str(e)
+        return None
+
+    def _process_pdf(self, input_file, output_dir, service, **kwargs):
+        return self._process_batch([input_file], output_dir, service, **kwargs)
 
-    def _process_batch(self, batch_input_files, output_dir, service, **kwargs):
+    def _process_batch(self, batch_input_files, output_dir, service, doc_timeout=None, batch_timeout=None, **kwargs):
         if not self.health:
             return 0
         logger.debug('One Batch of %s pdfs: %s...', len(batch_input_files), ', '.join(list(batch_input_files)[:3]))
 
-        class_name = 'pl.edu.icm.cermine.ContentExtractor'
-        with tempfile.TemporaryDirectory() as dirname:
-            for input_file in batch_input_files:
-                shutil.copy(input_file, dirname)
-            cmd = ['java', '-cp', self.jar, class_name, '-path', dirname, '-outputs', service]
+        start = time.time()
+        timeout = self._batch_budget(len(batch_input_files), doc_timeout, batch_timeout)
+        timed_out = False
+        n_docs = len(batch_input_files)
+        with self._staging_dir(output_dir) as dirname:
+            # staged under unique names, two inputs may share a base name, e.g. in sub directories
+            tmp_id2pdf_name = {}
+            with self.metrics.timer('staging', n_docs):
+                for input_file in batch_input_files:
+                    tmp_id = str(len(tmp_id2pdf_name))
+                    tmp_id2pdf_name[tmp_id] = self._result_stem(input_file)
+                    link_or_copy(self._source(input_file), os.path.join(dirname, '%s.pdf' % tmp_id), symlink=True)
             try:
-                sp.run(cmd, stdout=sp.DEVNULL, stderr=None, check=True)
-            except Exception as e:
-                logger.warning('Cermine exit exceptly with error: %s', str(e))
-            self._move_result_from_tmp_to_output(dirname, output_dir)
-        return len(batch_input_files)
-
-    def _process_dir(self, input_dir, output_dir, service, n_threads=0, **kwargs):
+                with self.metrics.timer('subprocess', n_docs), self.metrics.track('in_flight', n_docs):
+                    error = self._run_extractor(dirname, service, n_docs, timeout)
+            except BackendTimeout as e:
+                error = str(e)
+                timed_out = True
+                self.metrics.inc('timeouts')
+            finished = self._finished_ids(dirname, validate=timed_out)
+            if timed_out:
+                # results cut off by the kill are left behind in the staging dir, and parsed again
+                tmp_id2pdf_name = {tmp_id: name for tmp_id, name in tmp_id2pdf_name.items() if tmp_id in finished}
+            with self.metrics.timer('move', n_docs):
+                n_produced = self._move_result_from_tmp_to_output(dirname, output_dir, tmp_id2pdf_name)
+        if not timed_out:
+            self._report_batch(batch_input_files, output_dir, start, error)
+            return n_produced
+
+        if len(batch_input_files) == 1:
+            self._quarantine(batch_input_files[0], output_dir, start, error)
+            return n_produced
+
+        # keep what finished in time, and bisect the rest with their own budgets until the straggler is alone
+        unfinished = [file for tmp_id, file in enumerate(batch_input_files) if str(tmp_id) not in finished]
+        self.metrics.inc('retries', len(unfinished))
+        self._report_batch([file for file in batch_input_files if file not in unfinished], output_dir, start)
+        logger.info(f'Cermine batch timed out, retry {len(unfinished)} unfinished of {len(batch_input_files)} PDF files.')
+        mid = (len(unfinished) + 1) // 2
+        for half in (unfinished[:mid], unfinished[mid:]):
+            if half:
+                n_produced += self._process_batch(half, output_dir, service, doc_timeout, batch_timeout, **kwargs)
+        return n_produced
+
+    def _process_files(self, pdf_files, output_dir, service, n_threads=0, batch_pages=2000, schedule='size',
+                       schedule_window=0, autoscale=None, **kwargs):
         if not self.health:
             return 0
 
-        if n_threads == 0:
+        scaler = None
+        if n_threads == 'auto':
+            # as many cermine processes as fit in the cpus and the memory, measured while they run
+            scaler = AutoScaler.for_processes(cpu_per_worker=2, mem_per_worker=3 * GB // 2, options=autoscale)
+            n_threads = scaler.maximum
+        elif n_threads == 0:
             n_threads = min(os.cpu_count() // 2, 30)  # one cermine process use 200% cpus average, and not exceed 30 to reduce memory
 
-        pdf_files = []
-        for file in os.listdir(input_dir):
-            if file.endswith('.pdf'):
-                pdf_files.append(os.path.join(input_dir, file))
-        random.shuffle(pdf_files)
-        batch_size = min(100, math.ceil(len(pdf_files) / n_threads / 2))
-
-        logger.info(f'{len(pdf_files)} PDF files to process.')
-        with ThreadPoolExecutor(max_workers=n_threads) as executor:
-            futures = []
-            count = 0
-            for batch_start in range(len(pdf_files)):
-                batch_input_files = pdf_files[batch_start:batch_start + batch_size]
-                futures.append(executor.submit(self._process_batch, batch_input_files, output_dir, service, **kwargs))
-            for future in as_completed(futures):
-                count += future.result()
-                if count // 1000 != (count - future.result()) // 1000:
-                    logger.debug(f'{count} PDF files are processed')
-                if count // 10000 != (count - future.result()) // 10000:
-                    logger.info(f'{count} PDF files are processed')
-        return len(pdf_files)
+        # longest first, so that the biggest documents do not start at the end, then a bounded look-ahead window
+        # to size the batches, so that small inputs still spread over all threads
+        look_ahead = n_threads * 2 * 100
+        scheduled = longest_first(pdf_files, schedule, schedule_window or look_ahead)
+        head = list(islice(scheduled, look_ahead))
+        if schedule is None:
+            random.shuffle(head)
+        batch_size = max(1, min(100, math.ceil(len(head) / (scaler.limit if scaler else n_threads) / 2)))
+
+        def process(batch_input_files):
+            return len(batch_input_files), self._process_batch(batch_input_files, output_dir, service, **kwargs)
+
+        logger.info('Start processing PDF files.')
+        count = 0
+        n_processed = 0
+        process = self._scaled(process, scaler)
+        with scaler or nullcontext(), ThreadPoolExecutor(max_workers=n_threads) as executor:
+            batches = pack_batches(chain(head, scheduled), batch_size, batch_pages)
+            for future in bounded_as_completed(executor, process, batches, n_threads * 2, self.metrics):
+                n_batch, n_produced = future.result()
+                count += n_produced
+                n_processed += n_batch
+                if n_processed // 1000 != (n_processed - n_batch) // 1000:
+                    logger.debug(f'{n_processed} PDF files are processed, {count} produced results')
+                if n_processed // 10000 != (n_processed - n_batch) // 10000:
+                    logger.info(f'{n_processed} PDF files are processed, {count} produced results')
+        return count
 
     # def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
     #     typ2service = {
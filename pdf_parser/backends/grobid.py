@@ -1,69 +1,94 @@
 import os
 import time
+import random
+import asyncio
 import logging
 import requests
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
-from .base import Backend
+from .base import Backend, BackendAborted, BackendError, BackendTimeout
+from .balancer import EndpointBalancer
+from ..autoscale import AutoScaler
+from .grobid_async import AsyncGrobidClient
+from ..utils import longest_first, write_file
 
 logger = logging.getLogger(__name__)
 
 
+def never_sent(error):
+    """Whether a requests.ConnectionError happened before the request went out, e.g. connection refused, as
+    opposed to a connection lost after the pdf was sent"""
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
 class Grobid(Backend):
-    def __init__(self, host, port, sleep_time=5, coordinates=None):
+    result_suffixes = ('.grobid.xml',)
+
+    def __init__(self, host=None, port=None, sleep_time=5, coordinates=None, asynchronous=False, max_concurrency=256,
+                 target_latency=None, endpoints=None, balance_policy='least_outstanding', check_interval=10,
+                 max_backoff=60):
         super(Grobid, self).__init__()
         self.host = host
         self.port = port
-        self.url = f'http://{self.host}:{self.port}'
 
-        self.sleep_time = sleep_time
+        # several GROBID servers can be given as endpoints, e.g. ['server10:8070', 'http://server11:8070']
+        urls = [f'http://{self.host}:{self.port}'] if host is not None else []
+        for endpoint in endpoints or []:
+            urls.append(endpoint if '://' in endpoint else f'http://{endpoint}')
+        if not urls:
+            raise ValueError('Either host and port or endpoints of GROBID server should be given.')
+        self.url = urls[0]
+        self.balancer = EndpointBalancer(urls, check_interval=check_interval, policy=balance_policy)
+
+        self.sleep_time = sleep_time  # first backoff on a 503, doubled on each one in a row up to max_backoff
+        self.max_backoff = max_backoff
         self.coordinates = coordinates or ["persName", "figure", "ref", "biblStruct", "formula"]
 
         self.typ2service = {
             'text': 'processFulltextDocument',
         }
 
-        self.health = None
+        # keep-alive connections shared by all threads and jobs, mounted once, since a job mounting its own pool
+        # would close the connections of the jobs running next to it. Up to max_concurrency kept per server
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # asyncio client for directories, one event loop thread instead of one OS thread per request
+        self.async_client = None
+        if asynchronous:
+            self.async_client = AsyncGrobidClient(self, max_concurrency=max_concurrency,
+                                                  target_latency=target_latency)
+
         self._check_server()
+        # re-probe in the background, so that servers leave and re-join the rotation while parsing
+        self.balancer.start()
+
+    @property
+    def health(self):
+        return self.balancer.healthy()
+
+    def close(self):
+        self.balancer.close()
+        self.session.close()
 
     def _check_server(self):
-        check_url = f'{self.url}/api/isalive'
-        try:
-            r = requests.get(check_url, timeout=2)
-        except Exception:
-            self.health = False
-            logger.error(f'Cannot connect to {self.url}.')
-            return
-
-        status = r.status_code
-        if status == 200:
-            self.health = True
-            logger.info('GROBID server is up and running.')
+        if self.balancer.check():
+            n_healthy = sum(endpoint.healthy for endpoint in self.balancer.endpoints)
+            logger.info(f'GROBID server is up and running ({n_healthy}/{len(self.balancer.endpoints)} endpoints).')
         else:
-            self.health = False
             logger.error('GROBID server does not appear.')
 
-    def _process_pdf(self, input_file, output_dir, service, **kwargs):
-        if not self.health:
-            return 0
-
+    @staticmethod
+    def _output_file(input_file, output_dir):
         input_filename = os.path.basename(input_file)
-        output_file = os.path.join(output_dir, os.path.splitext(input_filename)[0] + '.grobid.xml')
-
-        if not kwargs.get('force', False) and os.path.exists(output_file):
-            return 1
-
-        files = {
-            'input': (
-                input_file,
-                open(input_file, 'rb'),
-                'application/pdf',
-                {'Expires': '0'}
-            )
-        }
+        return os.path.join(output_dir, os.path.splitext(input_filename)[0] + '.grobid.xml')
 
-        url = f'{self.url}/api/{service}'
+    def _request_data(self, **kwargs):
         data = {}
         if kwargs.get('generateIDs', False):
             data['generateIDs'] = '1'
@@ -73,48 +98,136 @@ class Grobid(Backend):
             data['consolidateCitations'] = '1'
         if kwargs.get('teiCoordinates', False):
             data['teiCoordinates'] = self.coordinates
+        return data
+
+    def _post(self, content, filename, service, **kwargs):
+        """Send one pdf to a GROBID server, return the TEI bytes.
 
+        A 503 is retried after a jittered, growing backoff. A server which cannot be reached is taken out of
+        rotation and the pdf goes to another one. A connection lost after the pdf was sent is the failure of
+        the pdf, it may have crashed the server, so it raises BackendAborted rather than going to the others.
+        """
+        files = {
+            'input': (
+                filename,
+                content,
+                'application/pdf',
+                {'Expires': '0'}
+            )
+        }
+        data = self._request_data(**kwargs)
+
+        backoff = self.sleep_time
         while True:
-            r = requests.post(url=url, data=data, files=files, headers={'Accept': 'application/xml'})
+            endpoint = self.balancer.acquire()
+            if endpoint is None:
+                raise BackendError('no GROBID server available')
+            sent = time.monotonic()
+            try:
+                with self.metrics.track('in_flight'):
+                    r = self.session.post(url=f'{endpoint.url}/api/{service}', data=data, files=files,
+                                          headers={'Accept': 'application/xml'}, timeout=kwargs.get('doc_timeout'))
+            except requests.ConnectTimeout:
+                # too slow to even connect to, and never saw the pdf: take it out of rotation and retry on another
+                # one. ConnectTimeout is a Timeout too, so it is caught first
+                self.balancer.release(endpoint, failed=True)
+                self.metrics.inc('connection_errors')
+                continue
+            except requests.ConnectionError as e:
+                self.metrics.inc('connection_errors')
+                if never_sent(e):  # refused or unknown host, the server is gone
+                    self.balancer.release(endpoint, failed=True)
+                    continue
+                # reset while the server held the pdf, the health checks tell whether the server is gone
+                self.balancer.release(endpoint)
+                raise BackendAborted(f'connection lost while parsing: {e}')
+            except requests.Timeout:
+                self.balancer.release(endpoint, time.monotonic() - sent)
+                self.metrics.inc('timeouts')
+                raise BackendTimeout(f'no response in {kwargs["doc_timeout"]} seconds')
+            self.balancer.release(endpoint, time.monotonic() - sent)
+            self.metrics.observe('http', time.monotonic() - sent)
+
             if r.status_code == 200:  # success
-                break
+                return r.content
             elif r.status_code != 503:  # not 503 means fatal error, do not re-try, return directly
-                logger.warning(f"PDF parse failed: {input_file} with http code {r.status_code}")
-                return 0
-            time.sleep(self.sleep_time)
+                raise BackendError(f'http code {r.status_code}')
+            self.metrics.inc('retries')
+            # jittered, so that the clients held back by one overloaded server do not all come back at once
+            time.sleep(random.uniform(backoff / 2, backoff))
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _process_bytes(self, content, name, service, **kwargs):
+        if not self.health:
+            return {}
+        start = time.time()
+        try:
+            body = self._post(content, name, service, **kwargs)
+        except BackendError as e:
+            logger.warning(f"PDF parse failed: {name} with {e}")
+            self._report(name, False, start, str(e))
+            return {}
+        self._report(name, True, start)
+        return {self.result_suffixes[0]: body}
+
+    def _process_pdf(self, input_file, output_dir, service, **kwargs):
+        if not self.health:
+            return self._fail_all([input_file], 'no GROBID server available')
+
+        start = time.time()
+        output_file = self._output_file(input_file, output_dir)
+        if not kwargs.get('force', False) and os.path.exists(output_file):
+            self._report(input_file, True, start)
+            return 1
+
+        # read the pdf once, a file object would be exhausted after the first 503
+        with self.metrics.timer('read'):
+            with open(self._source(input_file), 'rb') as fp:
+                content = fp.read()
 
         try:
-            with open(output_file, 'wb') as out:
-                out.write(r.content)
+            body = self._post(content, input_file, service, **kwargs)
+        except (BackendTimeout, BackendAborted) as e:
+            self._quarantine(input_file, output_dir, start, str(e))
+            return 0
+        except BackendError as e:
+            logger.warning(f"PDF parse failed: {input_file} with {e}")
+            self._report(input_file, False, start, str(e))
+            return 0
+
+        try:
+            with self.metrics.timer('write'):
+                write_file(output_file, body)
         except Exception:
             logger.error(f"Could not write out result file: {output_file}")
+            self._report(input_file, False, start, 'could not write out result file')
             return 0
 
+        self._report(input_file, True, start)
         return 1
 
-    def _process_dir(self, input_dir, output_dir, service, n_threads=0, **kwargs):
+    def _threads(self, n_threads, autoscale=None):
+        if n_threads == 'auto':
+            # as many requests as the servers take without queueing them
+            scaler = AutoScaler.for_requests(self.metrics, maximum=self.max_concurrency * len(self.balancer.endpoints),
+                                             options=autoscale)
+            return scaler.maximum, scaler
+        # the number of cpus of server10, because the grobid server always run on server10
+        return n_threads or 112 * len(self.balancer.endpoints), None
+
+    def _process_files(self, pdf_files, output_dir, service, n_threads=0, schedule='size', schedule_window=0,
+                       autoscale=None, **kwargs):
         if not self.health:
-            return 0
+            return self._fail_all(pdf_files, 'no GROBID server available')
+
+        if self.async_client is not None:
+            n_threads = 0 if n_threads == 'auto' else n_threads  # the async client adapts its concurrency anyway
+            window = schedule_window or 4 * (n_threads or self.async_client.max_concurrency)
+            pdf_files = (input_file for input_file, _ in longest_first(pdf_files, schedule, window))
+            return asyncio.run(self.async_client.process_files(pdf_files, output_dir, service, n_threads, **kwargs))
 
-        if n_threads == 0:
-            n_threads = 112  # the number of cpus of server10, because the grobid server always run on server10
-
-        pdf_files = []
-        for file in os.listdir(input_dir):
-            if file.endswith('.pdf'):
-                pdf_files.append(os.path.join(input_dir, file))
-
-        logger.info(f'{len(pdf_files)} PDF files to process.')
-        with ThreadPoolExecutor(max_workers=n_threads) as executor:
-            futures = []
-            for file in pdf_files:
-                futures.append(executor.submit(self._process_pdf, file, output_dir, service, **kwargs))
-            for idx, _ in enumerate(as_completed(futures)):
-                if idx % 1000 == 0:
-                    logger.debug(f'{idx} PDF files are processed')
-                if idx % 10000 == 0:
-                    logger.info(f'{idx} PDF files are processed')
-        return len(pdf_files)
+        return super(Grobid, self)._process_files(pdf_files, output_dir, service, n_threads, schedule=schedule,
+                                                  schedule_window=schedule_window, autoscale=autoscale, **kwargs)
 
     # def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
     #     typ2service = {
@@ -0,0 +1,217 @@
+import os
+import time
+import random
+import asyncio
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency, only needed for Grobid(asynchronous=True)
+    aiohttp = None
+
+from ..utils import write_file
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """Concurrency limit adjusted by additive increase / multiplicative decrease.
+
+    The limit grows by one after `limit` consecutive successes, and is halved on a 503 or on a
+    response slower than `target_latency`, at most once per `cooldown` seconds.
+    """
+
+    def __init__(self, initial=16, minimum=1, maximum=256, target_latency=None, cooldown=1.0):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def on_success(self, latency):
+        if self.target_latency is not None and latency > self.target_latency:
+            self._decrease()
+            return
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.maximum:
+            self.limit += 1
+            self._successes = 0
+
+    def on_overload(self):
+        self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self._successes = 0
+        new_limit = max(self.minimum, self.limit // 2)
+        if new_limit != self.limit:
+            logger.debug(f'GROBID concurrency limit decreased from {self.limit} to {new_limit}')
+        self.limit = new_limit
+
+
+class AsyncGrobidClient:
+    """Send the pdf files of a directory to GROBID from one event loop, over pooled keep-alive connections"""
+
+    def __init__(self, grobid, max_concurrency=256, initial_concurrency=16, target_latency=None, max_backoff=60):
+        if aiohttp is None:
+            raise ImportError('aiohttp is required by the asynchronous GROBID client: pip install aiohttp')
+        self.grobid = grobid
+        self.max_concurrency = max_concurrency
+        self.initial_concurrency = initial_concurrency
+        self.target_latency = target_latency
+        self.max_backoff = max_backoff
+
+    def _form(self, content, input_file, data):
+        form = aiohttp.FormData()
+        for name, value in data.items():
+            for item in (value if isinstance(value, list) else [value]):
+                form.add_field(name, item)
+        form.add_field('input', content, filename=os.path.basename(input_file), content_type='application/pdf')
+        return form
+
+    async def _process_pdf(self, session, limiter, input_file, output_dir, service, **kwargs):
+        loop = asyncio.get_running_loop()
+        grobid = self.grobid
+        begin = time.time()
+        output_file = grobid._output_file(input_file, output_dir)
+        if not kwargs.get('force', False) and os.path.exists(output_file):
+            grobid._report(input_file, True, begin)
+            return 1
+
+        def read():
+            with open(grobid._source(input_file), 'rb') as fp:
+                return fp.read()
+
+        read_start = time.perf_counter()
+        content = await loop.run_in_executor(None, read)
+        grobid.metrics.observe('read', time.perf_counter() - read_start)
+        balancer = grobid.balancer
+        data = grobid._request_data(**kwargs)
+
+        backoff = grobid.sleep_time
+        timeout = aiohttp.ClientTimeout(total=kwargs.get('doc_timeout'))
+        while True:
+            await limiter.acquire()
+            endpoint = balancer.acquire()
+            if endpoint is None:
+                await limiter.release()
+                logger.warning(f"PDF parse failed: {input_file}, no GROBID server available")
+                grobid._report(input_file, False, begin, 'no GROBID server available')
+                return 0
+            start = time.monotonic()
+            grobid.metrics.add('in_flight', 1)
+            try:
+                async with session.post(f'{endpoint.url}/api/{service}', data=self._form(content, input_file, data),
+                                        headers={'Accept': 'application/xml'}, timeout=timeout) as r:
+                    status = r.status
+                    body = await r.read() if status == 200 else None
+            except (aiohttp.ClientConnectorError, aiohttp.ServerTimeoutError) as e:
+                if isinstance(e, getattr(aiohttp, 'SocketTimeoutError', ())):  # a read timeout, on a sent pdf
+                    balancer.release(endpoint, time.monotonic() - start)
+                    grobid.metrics.inc('timeouts')
+                    grobid._quarantine(input_file, output_dir, begin, f'no response in {kwargs["doc_timeout"]} seconds')
+                    return 0
+                # refused, unknown host or connect timeout, the server never saw the pdf: take it out of rotation
+                # and retry on another one. Both are caught before TimeoutError and ClientConnectionError
+                balancer.release(endpoint, failed=True)
+                grobid.metrics.inc('connection_errors')
+                continue
+            except asyncio.TimeoutError:
+                balancer.release(endpoint, time.monotonic() - start)
+                grobid.metrics.inc('timeouts')
+                grobid._quarantine(input_file, output_dir, begin, f'no response in {kwargs["doc_timeout"]} seconds')
+                return 0
+            except aiohttp.ClientConnectionError as e:
+                # reset while the server held the pdf, which may have crashed it: quarantined as in the sync path,
+                # rather than replayed against the other servers, and the health checks tell whether it is gone
+                balancer.release(endpoint)
+                grobid.metrics.inc('connection_errors')
+                grobid._quarantine(input_file, output_dir, begin, f'connection lost while parsing: {e}')
+                return 0
+            except aiohttp.ClientError as e:
+                balancer.release(endpoint)
+                logger.warning(f"PDF parse failed: {input_file} with error {e}")
+                grobid._report(input_file, False, begin, str(e))
+                return 0
+            finally:
+                grobid.metrics.add('in_flight', -1)
+                await limiter.release()
+            balancer.release(endpoint, time.monotonic() - start)
+            grobid.metrics.observe('http', time.monotonic() - start)
+
+            if status == 200:  # success
+                limiter.on_success(time.monotonic() - start)
+                break
+            elif status != 503:  # not 503 means fatal error, do not re-try, return directly
+                logger.warning(f"PDF parse failed: {input_file} with http code {status}")
+                grobid._report(input_file, False, begin, f'http code {status}')
+                return 0
+            limiter.on_overload()
+            grobid.metrics.inc('retries')
+            await asyncio.sleep(random.uniform(backoff / 2, backoff))
+            backoff = min(backoff * 2, self.max_backoff)
+
+        try:
+            with grobid.metrics.timer('write'):
+                await loop.run_in_executor(None, write_file, output_file, body)
+        except Exception:
+            logger.error(f"Could not write out result file: {output_file}")
+            grobid._report(input_file, False, begin, 'could not write out result file')
+            return 0
+        grobid._report(input_file, True, begin)
+        return 1
+
+    async def process_files(self, pdf_files, output_dir, service, max_concurrency=0, **kwargs):
+        max_concurrency = max_concurrency or self.max_concurrency * len(self.grobid.balancer.endpoints)
+        limiter = AdaptiveLimiter(initial=min(self.initial_concurrency, max_concurrency), maximum=max_concurrency,
+                                  target_latency=self.target_latency)
+        connector = aiohttp.TCPConnector(limit=max_concurrency)
+        timeout = aiohttp.ClientTimeout(total=None)
+
+        count = 0
+
+        def collect(done):
+            nonlocal count
+            for task in done:
+                if task.exception() is not None:
+                    logger.warning('PDF parse failed with error: %s', str(task.exception()))
+                count += 1
+                if count % 1000 == 0:
+                    logger.debug(f'{count} PDF files are processed')
+                if count % 10000 == 0:
+                    logger.info(f'{count} PDF files are processed')
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            tasks = set()
+            for file in pdf_files:
+                # back-pressure on the directory scan: never hold more tasks than the concurrency ceiling
+                while len(tasks) >= max_concurrency:
+                    done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                    self.grobid.metrics.set('queue_depth', len(tasks))
+                    collect(done)
+                tasks.add(asyncio.ensure_future(
+                    self._process_pdf(session, limiter, file, output_dir, service, **kwargs)))
+                self.grobid.metrics.set('queue_depth', len(tasks))
+            if tasks:
+                done, _ = await asyncio.wait(tasks)
+                self.grobid.metrics.set('queue_depth', 0)
+                collect(done)
+        return count
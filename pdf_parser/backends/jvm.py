@@ -0,0 +1,253 @@
+import os
+import re
+import atexit
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess as sp
+from collections import deque
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+WORKER_CLASS = 'PdfParserWorker'
+WORKER_SOURCE = os.path.join(os.path.dirname(__file__), '..', 'java', WORKER_CLASS + '.java')
+
+_VERSION_RE = re.compile(r'version "(\d+)(?:\.(\d+))?')
+
+
+class JvmWorkerError(Exception):
+    pass
+
+
+class JvmWorkerTimeout(JvmWorkerError):
+    pass
+
+
+def parse_java_version(text):
+    """Major version in the output of `java -version`, e.g. 8 for "1.8.0_392", or None"""
+    match = _VERSION_RE.search(text)
+    if match is None:
+        return None
+    major = int(match.group(1))
+    if major == 1 and match.group(2):
+        major = int(match.group(2))
+    return major
+
+
+@lru_cache(maxsize=None)
+def java_version():
+    try:
+        r = sp.run(['java', '-version'], stdout=sp.PIPE, stderr=sp.STDOUT, timeout=30)
+    except (OSError, sp.TimeoutExpired):
+        return None
+    return parse_java_version(r.stdout.decode(errors='replace'))
+
+
+def _compile_worker():
+    """Compile the worker class once per user and source version, return its class dir, or None if javac is not
+    available.
+
+    The classes are compiled into a private dir, which is renamed into place once complete, so that processes
+    starting at the same time never load a half-written class.
+    """
+    with open(WORKER_SOURCE, 'rb') as fp:
+        version = hashlib.sha256(fp.read()).hexdigest()[:12]
+    uid = os.getuid() if hasattr(os, 'getuid') else 0
+    class_dir = os.path.join(tempfile.gettempdir(), f'pdf_parser-jvm-{uid}-{version}')
+    if os.path.exists(os.path.join(class_dir, WORKER_CLASS + '.class')):
+        return class_dir
+    if shutil.which('javac') is None:
+        return None
+
+    tmp_dir = tempfile.mkdtemp(prefix=f'.pdf_parser-jvm-{uid}-', dir=tempfile.gettempdir())
+    try:
+        sp.run(['javac', '-nowarn', '-d', tmp_dir, WORKER_SOURCE], stdout=sp.DEVNULL, stderr=sp.PIPE, check=True)
+        try:
+            os.replace(tmp_dir, class_dir)
+        except OSError:
+            if not os.path.exists(os.path.join(class_dir, WORKER_CLASS + '.class')):
+                raise  # not just another process which was faster
+    except (OSError, sp.CalledProcessError) as e:
+        logger.error('Could not compile %s: %s', WORKER_SOURCE,
+                     e.stderr.decode(errors='replace') if isinstance(e, sp.CalledProcessError) else str(e))
+        return None
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return class_dir
+
+
+def worker_command(jar, main_class, java_opts=None):
+    class_dir = _compile_worker()
+    cmd = ['java'] + list(java_opts or [])
+    major = java_version()
+    if major is not None and 12 <= major < 24:
+        # the security manager which traps System.exit of the parser, java 18+ refuses it without this,
+        # java 24+ refuses to start with it
+        cmd.append('-Djava.security.manager=allow')
+    if class_dir is not None:
+        cmd += ['-cp', os.pathsep.join([jar, class_dir]), WORKER_CLASS]
+    else:  # java 11+ can launch a single source file directly
+        cmd += ['-cp', jar, WORKER_SOURCE]
+    return cmd + [main_class]
+
+
+class JvmWorker:
+    """One resident JVM, which runs the main class of a parser jar once per task.
+
+    Its stderr is logged at debug level, and its last lines are kept for the error when the JVM dies.
+    """
+
+    def __init__(self, cmd, stderr_lines=20):
+        self.n_docs = 0
+        self.process = sp.Popen(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE,
+                                encoding='utf-8', errors='replace', bufsize=1)
+        self.stderr = deque(maxlen=stderr_lines)
+        self._stderr_thread = threading.Thread(target=self._read_stderr, name=f'jvm-{self.process.pid}-stderr',
+                                               daemon=True)
+        self._stderr_thread.start()
+        status, _, message = self.process.stdout.readline().strip().partition('\t')
+        if status != 'READY':
+            self.close()
+            raise JvmWorkerError(f'JVM worker did not start: {" ".join(cmd)}{self._stderr_tail()}')
+        self.exit_trapped = not message
+        if message:
+            logger.warning(f'JVM worker {self.process.pid}: {message}, a parser which calls System.exit '
+                           f'costs a new JVM.')
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            line = line.rstrip('\n')
+            self.stderr.append(line)
+            logger.debug(f'JVM worker {self.process.pid}: {line}')
+
+    def _stderr_tail(self):
+        self._stderr_thread.join(1)  # the pipe is drained once the process is gone
+        return (': ' + ' | '.join(self.stderr)) if self.stderr else ''
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, args, n_docs=1, timeout=None):
+        # on timeout the JVM is killed, which unblocks readline, and the pool replaces the worker
+        timer = None
+        expired = threading.Event()
+        if timeout is not None:
+            def kill():
+                expired.set()
+                self.process.kill()
+
+            timer = threading.Timer(timeout, kill)
+            timer.start()
+        try:
+            self.process.stdin.write('\t'.join(args) + '\n')
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (OSError, ValueError) as e:
+            line = None
+            error = e
+        finally:
+            if timer is not None:
+                timer.cancel()
+        if expired.is_set():
+            self.process.wait()
+            raise JvmWorkerTimeout(f'JVM worker killed after {timeout} seconds')
+        if line is None:
+            raise JvmWorkerError(f'JVM worker is broken: {error}')
+        if not line:
+            raise JvmWorkerError(f'JVM worker exited with code {self.process.wait()}{self._stderr_tail()}')
+
+        self.n_docs += n_docs
+        status, _, message = line.rstrip('\n').partition('\t')
+        if status != 'OK':
+            raise JvmWorkerError(message or status)
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except (OSError, sp.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class JvmWorkerPool:
+    """Pool of at most `size` resident JVMs, each one recycled after `max_docs` documents to cap heap growth"""
+
+    def __init__(self, jar, main_class, size=1, max_docs=1000, java_opts=None):
+        self.cmd = worker_command(jar, main_class, java_opts)
+        self.size = size
+        self.max_docs = max_docs
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._n_workers = 0
+        self._closed = False
+        self.respawns = 0  # JVMs which died, e.g. killed on a timeout, or exited by the parser
+        atexit.register(self.close)
+
+    def _acquire(self):
+        with self._cond:
+            while not self._closed and not self._idle and self._n_workers >= self.size:
+                self._cond.wait()
+            if self._closed:
+                raise JvmWorkerError('JVM worker pool is closed')
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.alive():
+                    return worker
+                logger.warning(f'Idle JVM worker {worker.process.pid} exited with code {worker.process.poll()}, '
+                               f'respawn it.')
+                self._n_workers -= 1
+            self._n_workers += 1
+
+        try:
+            return JvmWorker(self.cmd)
+        except Exception:
+            with self._cond:
+                self._n_workers -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, broken=False):
+        if broken or not worker.alive() or worker.n_docs >= self.max_docs:
+            recycled = not broken and worker.alive()
+            if recycled:
+                logger.debug(f'Recycle JVM worker after {worker.n_docs} documents.')
+            else:
+                logger.warning(f'JVM worker {worker.process.pid} exited with code {worker.process.poll()}, '
+                               f'respawn it for the next task.')
+            worker.close()
+            with self._cond:
+                self._n_workers -= 1
+                self.respawns += not recycled
+                self._cond.notify()
+            return
+        with self._cond:
+            if self._closed:
+                worker.close()
+                self._n_workers -= 1
+            else:
+                self._idle.append(worker)
+            self._cond.notify()
+
+    def run(self, args, n_docs=1, timeout=None):
+        worker = self._acquire()
+        try:
+            worker.run(args, n_docs, timeout)
+        except JvmWorkerError:
+            self._release(worker, broken=not worker.alive())
+            raise
+        self._release(worker)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._n_workers -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.close()
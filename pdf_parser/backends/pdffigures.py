@@ -1,17 +1,17 @@
 import os
-import shutil
+import time
 import logging
-import tempfile
 import subprocess as sp
-from concurrent.futures import ThreadPoolExecutor
-from concurrent.futures import as_completed
 
 from .base import Backend
+from ..utils import replace_path
 
 logger = logging.getLogger(__name__)
 
 
 class PDFFigures(Backend):
+    result_suffixes = ('.pdffigures.figure',)
+
     def __init__(self):
         super(PDFFigures, self).__init__()
 
@@ -46,48 +46,38 @@ class PDFFigures(Backend):
         for name in os.listdir(tmp_dir):
             ext = os.path.splitext(name)[1]
             if ext == '.json':
-                shutil.move(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, 'figure-data.json'))
+                replace_path(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, 'figure-data.json'))
             elif ext == '.png':
                 figure_name = name.split('-', maxsplit=1)[1]
-                shutil.move(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, figure_name))
+                replace_path(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, figure_name))
 
-    def _process_pdf(self, input_file, output_dir, services, **kwargs):
+    def _process_pdf(self, input_file, output_dir, services, doc_timeout=None, **kwargs):
         if not self.health:
             return 0
 
-        with tempfile.TemporaryDirectory() as dirname:
+        start = time.time()
+        with self._staging_dir(output_dir) as dirname:
             prefix = os.path.join(dirname, 'prefix')
             cmd = [self.bin]
             for service in services:
                 cmd.extend([service, prefix])
-            cmd.append(input_file)
-            sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
-            self._move_result_from_tmp_to_output(dirname, output_dir, input_file)
+            cmd.append(self._source(input_file))
+            try:
+                with self.metrics.timer('subprocess'), self.metrics.track('in_flight'):
+                    r = sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL, timeout=doc_timeout)
+            except sp.TimeoutExpired:
+                self.metrics.inc('timeouts')
+                self._quarantine(input_file, output_dir, start, f'pdffigures killed after {doc_timeout:.0f} seconds')
+                return 0
+            with self.metrics.timer('move'):
+                self._move_result_from_tmp_to_output(dirname, output_dir, input_file)
+        self._report_batch([input_file], output_dir, start, f'exit code {r.returncode}' if r.returncode != 0 else None)
         return 1
 
-    def _process_dir(self, input_dir, output_dir, services, n_threads=0, **kwargs):
+    def _process_files(self, pdf_files, output_dir, services, n_threads=0, **kwargs):
         if not self.health:
             return 0
-
-        if n_threads == 0:
-            n_threads = os.cpu_count()  # one cermine process use 200% cpus average
-
-        pdf_files = []
-        for file in os.listdir(input_dir):
-            if file.endswith('.pdf'):
-                pdf_files.append(os.path.join(input_dir, file))
-
-        logger.info(f'{len(pdf_files)} PDF files to process.')
-        with ThreadPoolExecutor(max_workers=n_threads) as executor:
-            futures = []
-            for file in pdf_files:
-                futures.append(executor.submit(self._process_pdf, file, output_dir, services))
-            for idx, _ in enumerate(as_completed(futures)):
-                if idx % 1000 == 0:
-                    logger.debug(f'{idx} PDF files are processed')
-                if idx % 10000 == 0:
-                    logger.info(f'{idx} PDF files are processed')
-        return len(pdf_files)
+        return super(PDFFigures, self)._process_files(pdf_files, output_dir, services, n_threads, **kwargs)
 
     # def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
     #     typ2services = {
@@ -1,18 +1,29 @@
 import os
 import json
-import shutil
+import time
 import logging
-import tempfile
+import threading
 import subprocess as sp
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait
 
-from .base import Backend
+from .base import Backend, BackendTimeout
+from .jvm import JvmWorkerPool, JvmWorkerTimeout
+from ..autoscale import GB, AutoScaler, cpu_count
+from ..utils import bounded_as_completed, link_or_copy, longest_first, pack_batches, replace_path, write_file
 
 logger = logging.getLogger(__name__)
 
 
 class PDFFigures2(Backend):
-    def __init__(self):
+    result_suffixes = ('.pdffigures2.json', '.pdffigures2.figure')
+
+    class_name = 'org.allenai.pdffigures2.FigureExtractorBatchCli'
+
+    def __init__(self, jvm_workers=0, jvm_max_docs=1000, collect_threads=8, collect_interval=1.0):
         super(PDFFigures2, self).__init__()
+        self.collect_threads = collect_threads  # threads moving the results of a batch out of its staging dir
+        self.collect_interval = collect_interval  # seconds between two looks for results while a batch runs
 
         file_dir = os.path.dirname(__file__)
         self.jar = os.path.join(file_dir, '..', 'jar', 'pdffigures2-0.1.0.jar')
@@ -25,6 +36,15 @@ class PDFFigures2(Backend):
         self.health = None
         self._check_java()
 
+        # resident JVMs, so that small batches and single files do not pay the JVM startup every time
+        self.jvm_pool = None
+        if self.health and jvm_workers > 0:
+            self.jvm_pool = JvmWorkerPool(self.jar, self.class_name, size=jvm_workers, max_docs=jvm_max_docs)
+
+    def close(self):
+        if self.jvm_pool is not None:
+            self.jvm_pool.close()
+
     def _check_java(self):
         cmd = ['java', '-version']
         try:
@@ -35,108 +55,236 @@ class PDFFigures2(Backend):
             logger.error('No java in your environment.')
 
     @staticmethod
-    def _move_result_from_tmp_to_output(tmp_dir, output_dir, tmp_id2pdf_name, services):
+    def _index_staging(tmp_dir, sizes=False):
+        """Results in the staging dir by tmp id, {tmp_id: [json name, json size, [png names]]}, from one scandir"""
+        index = {}
+        with os.scandir(tmp_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.endswith('.json'):
+                    size = None
+                    if sizes:
+                        try:
+                            size = entry.stat().st_size
+                        except FileNotFoundError:  # just moved by a collector thread
+                            continue
+                    record = index.setdefault(name[:-5], [None, None, []])
+                    record[0] = name
+                    record[1] = size
+                elif name.endswith('.png'):
+                    index.setdefault(name.split('-', maxsplit=1)[0], [None, None, []])[2].append(name)
+        return index
+
+    def _collect_result(self, tmp_dir, output_dir, pdf_name, json_name, png_names, services, complete=True):
+        """Move the results of one pdf from the staging dir to output_dir, return whether its json was complete,
+        or None if it may still be in the works while the JVM runs: a json which does not parse, or figure data
+        which refers to a figure not written yet"""
         if '-g' in services:  # text mode
-            for name in os.listdir(tmp_dir):
-                tmp_id, ext = os.path.splitext(name)
-                if ext == '.json':
-                    new_name = tmp_id2pdf_name[tmp_id] + '.pdffigures2.json'
-                    shutil.move(os.path.join(tmp_dir, name), os.path.join(output_dir, new_name))
-        else:  # figure mode
-            new_dirs = []
-            for name in os.listdir(tmp_dir):
-                ext = os.path.splitext(name)[1]
-                if ext == '.json':
-                    tmp_id = os.path.splitext(name)[0]
-                    pdf_output_sub_dir = os.path.join(output_dir, tmp_id2pdf_name[tmp_id] + '.pdffigures2.figure')
-                    if not os.path.exists(pdf_output_sub_dir):
-                        new_dirs.append(pdf_output_sub_dir)
-                        os.makedirs(pdf_output_sub_dir)
-
-                    # update renderURL in figure data json, and then write to output_dir
-                    with open(os.path.join(tmp_dir, name), encoding='utf-8', errors='ignore') as fp_in:
+            if json_name is None:
+                return False
+            if not complete:
+                try:
+                    with open(os.path.join(tmp_dir, json_name), 'rb') as fp:
+                        json.load(fp)
+                except ValueError:
+                    return None
+            # a rename keeps the inode, so a json still being written is completed at its new path
+            os.replace(os.path.join(tmp_dir, json_name), os.path.join(output_dir, pdf_name + '.pdffigures2.json'))
+            return True
+
+        # figure mode, update renderURL in figure data json, and then write it next to the figures
+        figure_data = None
+        if json_name is not None:
+            with self.metrics.timer('json_rewrite'):
+                try:
+                    with open(os.path.join(tmp_dir, json_name), encoding='utf-8', errors='ignore') as fp_in:
                         figure_data = json.load(fp_in)
-                        for item in figure_data:
-                            new_render_url = os.path.basename(item['renderURL']).split('-', maxsplit=1)[1]
-                            item['renderURL'] = new_render_url
-                        with open(os.path.join(pdf_output_sub_dir, 'figure-data.json'), 'w',
-                                  encoding='utf-8') as fp_out:
-                            json.dump(figure_data, fp_out)
-                elif ext == '.png':
-                    tmp_id, figure_name = name.split('-', maxsplit=1)
-                    pdf_output_sub_dir = os.path.join(output_dir, tmp_id2pdf_name[tmp_id] + '.pdffigures2.figure')
-                    if not os.path.exists(pdf_output_sub_dir):
-                        os.makedirs(pdf_output_sub_dir)
-                    shutil.move(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, figure_name))
-            for dirname in new_dirs:
-                if len(os.listdir(dirname)) <= 1:
-                    shutil.rmtree(dirname)
+                except ValueError:  # still being written, or cut off by a timeout
+                    if not complete:
+                        return None
+                    logger.warning(f'Incomplete figure data of {pdf_name}')
+                    return False
+                if not complete and not {os.path.basename(item['renderURL']) for item in figure_data} <= set(png_names):
+                    return None
+                for item in figure_data:
+                    item['renderURL'] = os.path.basename(item['renderURL']).split('-', maxsplit=1)[1]
 
-    def _process_pdf(self, input_file, output_dir, services, **kwargs):
-        if not self.health:
-            return 0
+        pdf_output_sub_dir = os.path.join(output_dir, pdf_name + '.pdffigures2.figure')
+        if not png_names and not os.path.isdir(pdf_output_sub_dir):
+            return figure_data is not None  # no figures, no directory
+        try:
+            os.mkdir(pdf_output_sub_dir)
+            move = os.replace  # nothing to replace in a new dir, and staging is on the same device
+        except FileExistsError:
+            move = replace_path
+        if figure_data is not None:
+            data = json.dumps(figure_data).encode('utf-8')
+            write_file(os.path.join(pdf_output_sub_dir, 'figure-data.json'), data)
+        for name in png_names:
+            move(os.path.join(tmp_dir, name), os.path.join(pdf_output_sub_dir, name.split('-', maxsplit=1)[1]))
+        return figure_data is not None
 
-        tmp_id2pdf_name = {'0': os.path.splitext(os.path.basename(input_file))[0]}
-        with tempfile.TemporaryDirectory() as dirname:
-            shutil.copy(input_file, os.path.join(dirname, '0.pdf'))
-            if not dirname.endswith(os.sep):
-                dirname += os.sep
-            cmd = ['java', '-jar', self.jar, '-e']
-            for service in services:
-                cmd.extend([service, dirname])
-            cmd.append(dirname)
-            sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
-            self._move_result_from_tmp_to_output(dirname, output_dir, tmp_id2pdf_name, services)
-        return 1
+    def _run_extractor(self, args, n_docs, timeout=None):
+        try:
+            if self.jvm_pool is None:
+                r = sp.run(['java', '-jar', self.jar] + args, stdout=sp.DEVNULL, stderr=sp.DEVNULL, timeout=timeout)
+                return f'exit code {r.returncode}' if r.returncode != 0 else None
+            self.jvm_pool.run(args, n_docs, timeout)
+        except (sp.TimeoutExpired, JvmWorkerTimeout):
+            raise BackendTimeout(f'PDFFigures2 killed after {timeout:.0f} seconds')
+        except Exception as e:
+            logger.warning('PDFFigures2 exit exceptly with error: %s', str(e))
+            return str(e)
+        return None
+
+    def _process_pdf(self, input_file, output_dir, services, **kwargs):
+        return self._process_batch([input_file], output_dir, services, **kwargs)
 
-    def _process_batch(self, batch_input_files, output_dir, services, n_threads=0, **kwargs):
+    def _process_batch(self, batch_input_files, output_dir, services, n_threads=0, doc_timeout=None, batch_timeout=None,
+                       **kwargs):
         if not self.health:
             return 0
         logger.debug('One Batch of %s pdfs: %s...', len(batch_input_files), ', '.join(list(batch_input_files)[:3]))
 
-        with tempfile.TemporaryDirectory() as dirname:
+        start = time.time()
+        timeout = self._batch_budget(len(batch_input_files), doc_timeout, batch_timeout)
+        timed_out = False
+        with self._staging_dir(output_dir) as dirname:
             if not dirname.endswith(os.sep):
                 dirname += os.sep
 
+            n_docs = len(batch_input_files)
             tmp_id2pdf_name = {}
-            for input_file in batch_input_files:
-                tmp_id = str(len(tmp_id2pdf_name))
-                pdf_name = os.path.splitext(os.path.basename(input_file))[0]
-                tmp_id2pdf_name[tmp_id] = pdf_name
-                shutil.copy(input_file, os.path.join(dirname, '%s.pdf' % tmp_id))
+            with self.metrics.timer('staging', n_docs):
+                for input_file in batch_input_files:
+                    tmp_id = str(len(tmp_id2pdf_name))
+                    pdf_name = os.path.splitext(os.path.basename(input_file))[0]
+                    tmp_id2pdf_name[tmp_id] = pdf_name
+                    link_or_copy(self._source(input_file), os.path.join(dirname, '%s.pdf' % tmp_id),
+                                 symlink=True)
 
-            cmd = ['java', '-jar', self.jar, '-e', '-t', str(n_threads)]
+            args = ['-e']
+            if n_threads > 0:
+                args.extend(['-t', str(n_threads)])
             for service in services:
-                cmd.extend([service, dirname])
-            cmd.append(dirname)
+                args.extend([service, dirname])
+            args.append(dirname)
+
+            # results are collected in parallel, and already while the JVM runs: once the size of a json did not
+            # change since the previous poll, it is collected if it parses and all the figures it refers to are
+            # there, else it is tried again at the next poll. Figures which still show up later are moved by the
+            # last pass, after the JVM is done
+            collected = {}  # tmp id -> future of whether its json was complete
+            json_sizes = {}
+            done = threading.Event()
+
+            def collect(index, complete):
+                # a json read while still being written is collected again later
+                for tmp_id in [tmp_id for tmp_id, future in collected.items()
+                               if future.done() and future.result() is None]:
+                    del collected[tmp_id]
+                late = []
+                for tmp_id, (json_name, size, png_names) in index.items():
+                    if tmp_id not in tmp_id2pdf_name:
+                        continue
+                    if tmp_id in collected:
+                        if complete and png_names:
+                            late.append(collector.submit(self._collect_result, dirname, output_dir,
+                                                         tmp_id2pdf_name[tmp_id], None, png_names, services))
+                        continue
+                    if not complete and (json_name is None or json_sizes.get(tmp_id) != size):
+                        json_sizes[tmp_id] = size
+                        continue
+                    collected[tmp_id] = collector.submit(self._collect_result, dirname, output_dir,
+                                                         tmp_id2pdf_name[tmp_id], json_name, png_names, services,
+                                                         complete)
+                return late
+
+            def poll():
+                while not done.wait(self.collect_interval):
+                    try:
+                        collect(self._index_staging(dirname, sizes=True), complete=False)
+                    except Exception:
+                        # the last pass still collects everything
+                        logger.exception(f'Could not collect PDFFigures2 results early from {dirname}')
+
+            with ThreadPoolExecutor(max_workers=self.collect_threads) as collector:
+                poller = threading.Thread(target=poll, name='pdffigures2-collect', daemon=True)
+                poller.start()
+                try:
+                    with self.metrics.timer('subprocess', n_docs), self.metrics.track('in_flight', n_docs):
+                        error = self._run_extractor(args, n_docs, timeout)
+                except BackendTimeout as e:
+                    error = str(e)
+                    timed_out = True
+                    self.metrics.inc('timeouts')
+                finally:
+                    done.set()
+                    poller.join()
+                self.metrics.inc('collected_early', len(collected))
+                with self.metrics.timer('move', n_docs):
+                    wait(list(collected.values()))
+                    for future in collect(self._index_staging(dirname), complete=True):
+                        future.result()
+                    finished = {tmp_id for tmp_id, future in collected.items() if future.result()}
+        if not timed_out:
+            self._report_batch(batch_input_files, output_dir, start, error)
+            return len(batch_input_files)
+
+        if len(batch_input_files) == 1:
+            self._quarantine(batch_input_files[0], output_dir, start, error)
+            return 1
 
-            sp.run(cmd, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
-            self._move_result_from_tmp_to_output(dirname, output_dir, tmp_id2pdf_name, services)
+        # keep what finished in time, and bisect the rest with their own budgets until the straggler is alone
+        unfinished = [file for tmp_id, file in enumerate(batch_input_files) if str(tmp_id) not in finished]
+        self.metrics.inc('retries', len(unfinished))
+        self._report_batch([file for file in batch_input_files if file not in unfinished], output_dir, start)
+        logger.info(f'PDFFigures2 batch timed out, retry {len(unfinished)} unfinished of '
+                    f'{len(batch_input_files)} PDF files.')
+        mid = (len(unfinished) + 1) // 2
+        for half in (unfinished[:mid], unfinished[mid:]):
+            if half:
+                self._process_batch(half, output_dir, services, n_threads, doc_timeout, batch_timeout, **kwargs)
         return len(batch_input_files)
 
-    def _process_dir(self, input_dir, output_dir, services, n_threads=0, **kwargs):
+    def _process_files(self, pdf_files, output_dir, services, n_threads=0, jvm_batches=1, batch_size=1000,
+                       batch_pages=20000, schedule='size', schedule_window=0, autoscale=None, **kwargs):
         if not self.health:
             return 0
 
-        if n_threads == 0:
+        scaler = None
+        if n_threads == 'auto':
+            # as many JVMs at once as fit in the memory, up to jvm_batches if given, sharing all cpus
+            n_threads = cpu_count()
+            scaler = AutoScaler.for_processes(cpu_per_worker=4, mem_per_worker=2 * GB,
+                                              maximum=jvm_batches if jvm_batches > 1 else None, options=autoscale)
+            jvm_batches = scaler.maximum
+        elif n_threads == 0:
             n_threads = os.cpu_count()  # one cermine process use 200% cpus average
 
-        pdf_files = []
-        for file in os.listdir(input_dir):
-            if file.endswith('.pdf'):
-                pdf_files.append(os.path.join(input_dir, file))
+        # several JVMs share the threads, and the next batch is staged and dispatched as soon as one finishes,
+        # so that the slowest documents of a batch do not leave the other cores idle
+        def process(batch_input_files):
+            threads_per_batch = max(1, n_threads // (scaler.limit if scaler else jvm_batches))
+            self._process_batch(batch_input_files, output_dir, services, threads_per_batch, **kwargs)
+            return len(batch_input_files)
 
-        logger.info(f'{len(pdf_files)} PDF files to process.')
+        logger.info('Start processing PDF files.')
         count = 0
-        step = 1000
-        for start in range(0, len(pdf_files), step):
-            self._process_batch(pdf_files[start: start + step], output_dir, services, n_threads, **kwargs)
-            count += step
-            if count // 1000 != (count - step) // 1000:
-                logger.debug(f'{count} PDF files are processed')
-            if count // 10000 != (count - step) // 10000:
-                logger.info(f'{count} PDF files are processed')
-        return len(pdf_files)
+        process = self._scaled(process, scaler)
+        with scaler or nullcontext(), ThreadPoolExecutor(max_workers=jvm_batches) as executor:
+            # longest first and packed by pages, so that batches take about the same time and no giant document
+            # starts last, within a look-ahead of the batches in flight
+            window = schedule_window or (jvm_batches + 1) * batch_size
+            batches = pack_batches(longest_first(pdf_files, schedule, window), batch_size, batch_pages)
+            for future in bounded_as_completed(executor, process, batches, jvm_batches + 1, self.metrics):
+                n_batch = future.result()
+                count += n_batch
+                if count // 1000 != (count - n_batch) // 1000:
+                    logger.debug(f'{count} PDF files are processed')
+                if count // 10000 != (count - n_batch) // 10000:
+                    logger.info(f'{count} PDF files are processed')
+        return count
 
     # def parse(self, typ, input_path, output_dir, n_threads=0, **kwargs):
     #     typ2services = {
@@ -1,50 +1,120 @@
 import os
-import json
-import shutil
-import tempfile
+import time
 import logging
+import requests
+from requests.adapters import HTTPAdapter
 
-from pathlib import Path
-from science_parse_api.api import parse_pdf
-
-from .base import Backend
+from .base import Backend, BackendError, BackendTimeout
+from ..autoscale import AutoScaler
+from ..utils import write_file
 
 logger = logging.getLogger(__name__)
 
 
 class ScienceParse(Backend):
-    def __init__(self, host, port, retry=3):
+    result_suffixes = ('.scienceparse.json',)
+
+    def __init__(self, host, port, retry=3, backoff=1, max_backoff=60, max_concurrency=128):
         super(ScienceParse, self).__init__()
         self.host = host
         self.port = port
-        self.retry = retry
+        self.url = f'http://{self.host}:{self.port}/v1'
+        self.retry = retry  # attempts of a request which fails on the connection or a 5xx
+        self.backoff = backoff
+        self.max_backoff = max_backoff
         self.typ2service = {
             'text': 'text',
         }
 
+        # keep-alive connections shared by all threads and jobs, mounted once, up to max_concurrency kept
+        self.max_concurrency = max_concurrency
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency))
+
     @staticmethod
-    def _move_result_from_tmp_to_output(tmp_dir, output_dir):
-        count = 0
-        for name in os.listdir(tmp_dir):
-            prefix, ext = os.path.splitext(name)
-            prefix = os.path.splitext(prefix)[0]
-            new_name = prefix + '.scienceparse.json'
-            shutil.move(os.path.join(tmp_dir, name), os.path.join(output_dir, new_name))
-            count += 1
-        return count
+    def _result_stem(input_file):
+        return os.path.basename(input_file)
 
-    def _process_pdf(self, input_file, output_dir, service, **kwargs):
-        output_file = os.path.join(output_dir, os.path.basename(input_file) + '.scienceparse.json')
-        output_dict = parse_pdf(f'http://{self.host}', Path(input_file), port=str(self.port))
-        for _ in range(self.retry):
+    def _output_file(self, input_file, output_dir):
+        return os.path.join(output_dir, self._result_stem(input_file) + self.result_suffixes[0])
+
+    def _post(self, content, filename, **kwargs):
+        """Send one pdf to the ScienceParse server, retry with exponential backoff, return the json bytes"""
+        # the /v1 endpoint takes the raw pdf as the request body, not a form
+        headers = {'Content-Type': 'application/pdf', 'Accept': 'application/json'}
+        backoff = self.backoff
+        for attempt in range(1, max(1, self.retry) + 1):
+            sent = time.monotonic()
             try:
-                with open(output_file, 'w') as f:
-                    json.dump(output_dict, f)
-            except Exception:
-                logger.error(f"Could not write out result file: {output_file}")
-                if _ == self.retry - 1:
-                    raise
-
-    def _process_dir(self, input_dir, output_dir, service, n_threads=0, **kwargs):
-        with tempfile.TemporaryDirectory() as dirname:
-            self._move_result_from_tmp_to_output(dirname, output_dir)
+                with self.metrics.track('in_flight'):
+                    r = self.session.post(self.url, data=content, headers=headers, timeout=kwargs.get('doc_timeout'))
+                self.metrics.observe('http', time.monotonic() - sent)
+                if r.status_code == 200:
+                    return r.content
+                error = f'http code {r.status_code}'
+                if r.status_code < 500:  # the pdf is rejected, do not re-try
+                    raise BackendError(error)
+            except (requests.ConnectTimeout, requests.ConnectionError) as e:
+                # the server never saw the pdf, a ConnectTimeout is a Timeout too and must not quarantine it
+                self.metrics.inc('connection_errors')
+                error = str(e)
+            except requests.Timeout:
+                self.metrics.inc('timeouts')
+                raise BackendTimeout(f'no response in {kwargs["doc_timeout"]} seconds')
+            if attempt < self.retry:
+                logger.debug(f'ScienceParse failed on {filename} with {error}, retry in {backoff} seconds')
+                self.metrics.inc('retries')
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+        raise BackendError(error)
+
+    def _process_bytes(self, content, name, service, **kwargs):
+        start = time.time()
+        try:
+            body = self._post(content, name, **kwargs)
+        except BackendError as e:
+            logger.warning(f"PDF parse failed: {name} with {e}")
+            self._report(name, False, start, str(e))
+            return {}
+        self._report(name, True, start)
+        return {self.result_suffixes[0]: body}
+
+    def _process_pdf(self, input_file, output_dir, service, **kwargs):
+        start = time.time()
+        output_file = self._output_file(input_file, output_dir)
+        if not kwargs.get('force', False) and os.path.exists(output_file):
+            self._report(input_file, True, start)
+            return 1
+
+        with self.metrics.timer('read'):
+            with open(self._source(input_file), 'rb') as fp:
+                content = fp.read()
+
+        try:
+            body = self._post(content, input_file, **kwargs)
+        except BackendTimeout as e:
+            self._quarantine(input_file, output_dir, start, str(e))
+            return 0
+        except BackendError as e:
+            logger.warning(f"PDF parse failed: {input_file} with {e}")
+            self._report(input_file, False, start, str(e))
+            return 0
+
+        try:
+            with self.metrics.timer('write'):
+                write_file(output_file, body)
+        except Exception:
+            logger.error(f"Could not write out result file: {output_file}")
+            self._report(input_file, False, start, 'could not write out result file')
+            return 0
+
+        self._report(input_file, True, start)
+        return 1
+
+    def _threads(self, n_threads, autoscale=None):
+        if n_threads == 'auto':
+            # as many requests as the server takes without queueing them
+            scaler = AutoScaler.for_requests(self.metrics, maximum=self.max_concurrency, options=autoscale)
+            return scaler.maximum, scaler
+        # requests mostly wait on the server, which parses several pdfs at once
+        return n_threads or 32, None
@@ -0,0 +1,304 @@
+"""Throughput and latency benchmark of the backends.
+
+Usage: python -m pdf_parser bench [--corpus DIR | --synthetic N] [--backends grobid,cermine] [--types text,figure]
+
+With --stub, GROBID and ScienceParse are served by a local stub HTTP server, so that the benchmark
+runs offline and measures the client side only.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import logging
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+from .autoscale import child_rss, threads_arg
+from .parser import Parser, ParserBackend
+from .utils import estimate_pages, iter_pdf_files
+
+logger = logging.getLogger(__name__)
+
+WORDS = ('parser', 'figure', 'table', 'reference', 'method', 'result', 'network', 'model', 'data', 'analysis',
+         'section', 'graph', 'learning', 'system', 'evaluation', 'corpus')
+
+
+def make_synthetic_pdf(path, n_pages=1, seed=None, doc_id=None):
+    """Write a small valid pdf of n_pages pages of random text, with `doc_id` (hex) as the /ID of its trailer"""
+    rng = random.Random(seed)
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for _ in range(n_pages):
+        lines = [' '.join(rng.choice(WORDS) for _ in range(10)) for _ in range(40)]
+        text = b''.join(b'(%s) Tj T* ' % line.encode() for line in lines)
+        stream = b'BT /F1 10 Tf 12 TL 72 760 Td ' + text + b'ET'
+        objects.append(b'<< /Length %d >>\nstream\n%s\nendstream' % (len(stream), stream))
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents %d 0 R '
+                       b'/Resources << /Font << /F1 3 0 R >> >> >>' % len(objects))
+        kids.append(b'%d 0 R' % len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [%s] /Count %d >>' % (b' '.join(kids), n_pages)
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, obj)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    trailer_id = b' /ID [<%s> <%s>]' % (doc_id.encode(), doc_id.encode()) if doc_id else b''
+    out += b'trailer\n<< /Size %d /Root 1 0 R%s >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, trailer_id, xref)
+    with open(path, 'wb') as fp:
+        fp.write(out)
+
+
+def make_corpus(corpus_dir, n_docs, min_pages=1, max_pages=30, seed=0):
+    os.makedirs(corpus_dir, exist_ok=True)
+    rng = random.Random(seed)
+    for idx in range(n_docs):
+        make_synthetic_pdf(os.path.join(corpus_dir, f'synthetic-{idx:06d}.pdf'), rng.randint(min_pages, max_pages),
+                           seed=rng.random())
+    return corpus_dir
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/plain'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/isalive':
+            self._send(200, b'true')
+        else:
+            self._send(404)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.delay + self.server.delay_per_mb * len(body) / (1 << 20))
+        if self.path.startswith('/api/'):  # GROBID
+            tei = b'<?xml version="1.0" encoding="UTF-8"?><TEI xmlns="http://www.tei-c.org/ns/1.0"><text/></TEI>'
+            self._send(200, tei, 'application/xml')
+        elif self.path == '/v1':  # ScienceParse, which only takes the raw pdf as body
+            if self.headers.get('Content-Type') != 'application/pdf' or not body.startswith(b'%PDF'):
+                self._send(415, b'expected the pdf as body, with Content-Type: application/pdf')
+                return
+            self._send(200, json.dumps({'title': 'stub', 'sections': []}).encode(), 'application/json')
+        else:
+            self._send(404)
+
+
+class StubServer:
+    """Local stand-in for a GROBID and ScienceParse server, answering each pdf after a fixed delay"""
+
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0, delay_per_mb=0.0):
+        self.httpd = ThreadingHTTPServer((host, port), _StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.delay = delay
+        self.httpd.delay_per_mb = delay_per_mb
+        self.host, self.port = self.httpd.server_address[:2]
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+def peak_rss_mb():
+    """Peak RSS of this process and of the largest child process (e.g. a JVM), in MB, over the whole life of the
+    process, where RssSampler is not available"""
+    if resource is None:
+        return None, None
+    scale = 1 if sys.platform == 'darwin' else 1024  # bytes on mac, KB on linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / (1 << 20)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / (1 << 20)
+    return round(own, 1), round(children, 1)
+
+
+def _own_rss():
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RssSampler:
+    """Peak RSS of this process and of all its child processes (e.g. the JVMs) while one benchmark runs, sampled
+    from /proc every `interval` seconds. ru_maxrss can not tell it apart from the peaks of earlier benchmarks."""
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.own = None
+        self.children = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='rss-sampler', daemon=True)
+
+    def sample(self):
+        own, children = _own_rss(), child_rss()
+        if own is not None:
+            self.own = max(self.own or 0, own)
+        if children is not None:
+            self.children = max(self.children or 0, children)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def peaks_mb(self):
+        """(own, children) peak RSS in MB, None if unknown"""
+        return tuple(None if value is None else round(value / (1 << 20), 1) for value in (self.own, self.children))
+
+    def __enter__(self):
+        self.sample()
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+def run_benchmark(backend, typ, corpus_dir, n_threads=0, backend_kwargs=None, parse_kwargs=None):
+    pdf_files = list(iter_pdf_files(corpus_dir))
+    n_pages = sum(estimate_pages(file) for file in pdf_files)
+    result = {'backend': backend, 'typ': typ, 'docs': len(pdf_files), 'pages': n_pages}
+
+    try:
+        parser = Parser(backend, **(backend_kwargs or {}))
+        parser.handler.get_services(typ)
+    except Exception as e:
+        result['error'] = str(e)
+        return result
+    if getattr(parser.handler, 'health', True) is False:
+        result['error'] = 'backend is not available'
+        return result
+
+    latencies = []
+    failures = []
+
+    def on_result(input_file, ok, duration, error):
+        latencies.append(duration)
+        if not ok:
+            failures.append(input_file)
+
+    parser.handler.listeners.append(on_result)
+    output_dir = tempfile.mkdtemp(prefix='pdf_parser-bench-')
+    try:
+        with RssSampler() as sampler:
+            start = time.time()
+            parser.parse(typ, corpus_dir, output_dir, n_threads, force=True, **(parse_kwargs or {}))
+            wall = time.time() - start
+    finally:
+        parser.handler.listeners.remove(on_result)
+        parser.close()
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    rss, children_rss = sampler.peaks_mb()
+    if rss is None:  # no /proc
+        rss, children_rss = peak_rss_mb()
+    result.update({
+        'seconds': round(wall, 3),
+        'docs_per_sec': round(len(pdf_files) / wall, 2) if wall else None,
+        'pages_per_sec': round(n_pages / wall, 2) if wall else None,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'failure_rate': round(len(failures) / len(pdf_files), 4) if pdf_files else None,
+        'peak_rss_mb': rss,
+        'peak_child_rss_mb': children_rss,
+    })
+    return result
+
+
+def _format_row(result):
+    if 'error' in result:
+        return f"{result['backend']:<13}{result['typ']:<8}{result['error']}"
+    latency = '/'.join('-' if result[q] is None else f'{result[q]:.3f}' for q in ('p50', 'p95', 'p99'))
+    return (f"{result['backend']:<13}{result['typ']:<8}{result['docs_per_sec']:>10}{result['pages_per_sec']:>11}"
+            f"  {latency:<26}{result['failure_rate']:>8}{result['peak_rss_mb']:>10}{result['peak_child_rss_mb']:>10}")
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m pdf_parser bench', description=__doc__.splitlines()[0])
+    arg_parser.add_argument('--corpus', default=None, help='Directory of PDF files to parse.')
+    arg_parser.add_argument('--synthetic', type=int, default=100,
+                            help='Number of synthetic PDF files, if no corpus is given. (Default: 100)')
+    arg_parser.add_argument('--max-pages', type=int, default=30, help='Max pages of a synthetic PDF. (Default: 30)')
+    arg_parser.add_argument('-b', '--backends', default=','.join([ParserBackend.GROBID, ParserBackend.SCIENCE]),
+                            help='Comma separated backends. (Default: grobid,scienceparse)')
+    arg_parser.add_argument('-t', '--types', default='text,figure', help='Comma separated types. (Default: text,figure)')
+    arg_parser.add_argument('-n', '--thread', type=threads_arg, default=0, help='Number of thread, or auto. (Default: 0)')
+    arg_parser.add_argument('--stub', action='store_true', help='Serve GROBID and ScienceParse by a local stub server.')
+    arg_parser.add_argument('--stub-delay', type=float, default=0.05,
+                            help='Seconds the stub server takes per PDF. (Default: 0.05)')
+    arg_parser.add_argument('--host', default='127.0.0.1', help='Host of GROBID/ScienceParse, without --stub.')
+    arg_parser.add_argument('--grobid-port', type=int, default=8070, help='Port of GROBID, without --stub.')
+    arg_parser.add_argument('--scienceparse-port', type=int, default=8080, help='Port of ScienceParse, without --stub.')
+    arg_parser.add_argument('--json', default=None, help='Also write the results as JSON lines to this file.')
+    args = arg_parser.parse_args(argv)
+
+    tmp_corpus = None
+    corpus_dir = args.corpus
+    if corpus_dir is None:
+        tmp_corpus = tempfile.mkdtemp(prefix='pdf_parser-corpus-')
+        corpus_dir = make_corpus(tmp_corpus, args.synthetic, max_pages=args.max_pages)
+
+    stub = StubServer(delay=args.stub_delay) if args.stub else None
+    results = []
+    try:
+        if stub is not None:
+            stub.__enter__()
+        http_kwargs = {
+            ParserBackend.GROBID: {'host': stub.host if stub else args.host,
+                                   'port': stub.port if stub else args.grobid_port},
+            ParserBackend.SCIENCE: {'host': stub.host if stub else args.host,
+                                    'port': stub.port if stub else args.scienceparse_port},
+        }
+        print(f"{'backend':<13}{'type':<8}{'docs/s':>10}{'pages/s':>11}  {'latency p50/p95/p99 (s)':<26}"
+              f"{'failed':>8}{'rss MB':>10}{'child MB':>10}")
+        for backend in args.backends.split(','):
+            for typ in args.types.split(','):
+                result = run_benchmark(backend, typ, corpus_dir, args.thread, http_kwargs.get(backend))
+                results.append(result)
+                print(_format_row(result), flush=True)
+    finally:
+        if stub is not None:
+            stub.__exit__(None, None, None)
+        if tmp_corpus is not None:
+            shutil.rmtree(tmp_corpus, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'a', encoding='utf-8') as fp:
+            for result in results:
+                fp.write(json.dumps(dict(result, time=time.time())) + '\n')
+    return results
@@ -0,0 +1,135 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from .utils import file_sha256, link_or_copy_tree, path_size, remove_path
+
+logger = logging.getLogger(__name__)
+
+# options which change how a backend runs, but not what it produces
+IGNORED_OPTIONS = {'force', 'recursive', 'batch_pages', 'doc_timeout', 'batch_timeout', 'jvm_batches', 'batch_size',
+                   'schedule', 'schedule_window', 'autoscale'}
+
+
+class ResultCache:
+    """Content-addressed store of parse results, shared by all backends.
+
+    Entries are keyed by the sha256 of the PDF, the backend name and the service/options, so
+    renamed or re-uploaded copies of a paper hit the same entry. Artifacts are hardlinked in
+    and out when the cache and output dir are on the same device. This relies on the backends
+    replacing a result by rename, never writing into an existing one, which would write through
+    into the entry. The least recently used entries are evicted once `max_entries` or
+    `max_bytes` is exceeded.
+    """
+
+    def __init__(self, cache_dir, max_entries=100000, max_bytes=None):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._total_bytes = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        entries = []
+        for shard in os.listdir(self.cache_dir):
+            shard_dir = os.path.join(self.cache_dir, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_dir):
+                continue
+            for key in os.listdir(shard_dir):
+                entry_dir = os.path.join(shard_dir, key)
+                entries.append((os.path.getmtime(entry_dir), key, path_size(entry_dir)))
+        for _, key, size in sorted(entries):
+            self._entries[key] = size
+            self._total_bytes += size
+        logger.debug(f'{len(self._entries)} entries loaded from result cache {self.cache_dir}')
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    @staticmethod
+    def key(input_file, backend, services, options=None):
+        options = {k: v for k, v in (options or {}).items() if k not in IGNORED_OPTIONS}
+        digest = hashlib.sha256()
+        digest.update(file_sha256(input_file).encode())
+        digest.update(json.dumps([backend, services, options], sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def restore(self, key, result_paths):
+        """Link the cached artifacts of `key` to `result_paths` ({suffix: path}), return False on miss"""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._entries.move_to_end(key)
+        entry_dir = self._entry_dir(key)
+        try:
+            names = os.listdir(entry_dir)
+            for name in names:
+                output_path = result_paths.get(name)
+                if output_path is None:
+                    continue
+                remove_path(output_path)
+                link_or_copy_tree(os.path.join(entry_dir, name), output_path)
+            os.utime(entry_dir)
+        except OSError as e:
+            logger.warning('Could not restore result cache entry %s: %s', key, str(e))
+            self._discard(key)
+            return False
+        return True
+
+    def store(self, key, result_paths):
+        """Store the existing ones of `result_paths` ({suffix: path}) under `key`, return True if stored"""
+        existing = {suffix: path for suffix, path in result_paths.items() if os.path.exists(path)}
+        if not existing:
+            return False
+
+        tmp_dir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cache_dir)
+        try:
+            for suffix, path in existing.items():
+                link_or_copy_tree(path, os.path.join(tmp_dir, suffix))
+            size = path_size(tmp_dir)
+            entry_dir = self._entry_dir(key)
+            os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+            with self._lock:
+                remove_path(entry_dir)
+                os.replace(tmp_dir, entry_dir)
+                self._total_bytes += size - self._entries.pop(key, 0)
+                self._entries[key] = size
+                self._evict()
+        except OSError as e:
+            logger.warning('Could not store result cache entry %s: %s', key, str(e))
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return False
+        return True
+
+    def _discard(self, key):
+        with self._lock:
+            self._total_bytes -= self._entries.pop(key, 0)
+            remove_path(self._entry_dir(key))
+
+    def _evict(self):
+        # caller must hold self._lock
+        start = time.time()
+        evicted = 0
+        while self._entries and (
+                (self.max_entries is not None and len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and self._total_bytes > self.max_bytes)):
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            remove_path(self._entry_dir(key))
+            evicted += 1
+        if evicted:
+            logger.debug(f'{evicted} entries evicted from result cache in {time.time() - start:.3f}s')
+
+    def __len__(self):
+        return len(self._entries)
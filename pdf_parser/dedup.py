@@ -0,0 +1,177 @@
+import os
+import re
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+import subprocess as sp
+
+from .utils import file_sha256, pdf_page_count
+
+logger = logging.getLogger(__name__)
+
+DUPLICATES_FILENAME = '.pdf_parser.duplicates.jsonl'
+
+_ID_RE = re.compile(rb'/ID\s*\[\s*<\s*([0-9A-Fa-f\s]+)>')
+_WORD_RE = re.compile(r'\w+')
+
+
+def pdf_id(path, window=64 * 1024):
+    """First half of the /ID of a pdf, which is set when the document is created and kept by later saves, or None"""
+    try:
+        with open(path, 'rb') as fp:
+            head = fp.read(window)  # the first page trailer of a linearized pdf
+            fp.seek(max(0, os.fstat(fp.fileno()).st_size - window))
+            tail = fp.read(window)
+    except OSError:
+        return None
+    match = _ID_RE.search(tail) or _ID_RE.search(head)
+    if match is None:
+        return None
+    value = b''.join(match.group(1).split()).lower()
+    # some producers write a constant or empty id, which would collapse unrelated papers
+    return value.decode() if len(set(value)) > 2 else None
+
+
+def text_simhash(path, pages=2, min_words=50, timeout=30):
+    """64 bit simhash of the word 3-grams of the first pages, by pdftotext, or None without enough text"""
+    try:
+        r = sp.run(['pdftotext', '-q', '-l', str(pages), path, '-'], stdout=sp.PIPE, stderr=sp.DEVNULL,
+                   timeout=timeout)
+    except (OSError, sp.TimeoutExpired):
+        return None
+    words = _WORD_RE.findall(r.stdout.decode('utf-8', errors='ignore').lower())
+    if len(words) < min_words:
+        return None  # scanned, or nearly empty, every such pdf would look alike
+    weights = [0] * 64
+    for i in range(len(words) - 2):
+        digest = hashlib.blake2b(' '.join(words[i:i + 3]).encode(), digest_size=8).digest()
+        value = int.from_bytes(digest, 'big')
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+class Deduplicator:
+    """Find copies of the same paper among the pdfs of a job, so that only one of them is parsed.
+
+    Methods, tried in order:
+    - 'hash': byte-identical files, by sha256. A file is only hashed once another file of the same size shows up.
+    - 'id': the same /ID in the trailer and the same page count, e.g. a paper re-saved or re-stamped by a repository.
+    - 'text': a simhash of the first `text_pages` pages, at most `threshold` bits apart, e.g. the same paper
+      produced twice. It needs pdftotext (poppler) and costs one pdftotext run per pdf.
+
+    The first pdf of each group is its representative. The Parser parses it, then links its results to the
+    output names of the others, and appends each collapsed pdf to `.pdf_parser.duplicates.jsonl` in the
+    output dir. A Deduplicator given to a Parser only holds the configuration: each parse starts from a
+    `fresh` copy, since the representatives of a previous job may have no results in the next output dir.
+
+        parser = Parser('grobid', dedup=Deduplicator(methods=('hash', 'id')))
+    """
+
+    PENDING = None
+
+    def __init__(self, methods=('hash', 'id'), threshold=3, text_pages=2):
+        unknown = set(methods) - {'hash', 'id', 'text'}
+        if unknown:
+            raise ValueError(f'unknown dedup methods: {", ".join(sorted(unknown))}')
+        self.methods = tuple(methods)
+        self.threshold = threshold
+        self.text_pages = text_pages
+        if 'text' in self.methods and shutil.which('pdftotext') is None:
+            logger.warning('pdftotext not found, duplicates are not detected by text.')
+            self.methods = tuple(method for method in self.methods if method != 'text')
+
+        self._lock = threading.Lock()
+        self._canonical = {}  # duplicate -> representative
+        self._sizes = {}  # size -> the only file of that size, not hashed yet, or None once hashed
+        self._keys = {}  # ('hash' or 'id', value) -> representative
+        self._simhashes = {}  # (band, 16 bits) -> [(simhash, representative)]
+        self._status = {}  # representative -> None while parsing, then whether it was parsed
+        self._waiting = {}  # representative -> duplicates waiting for its results
+        self.counts = {method: 0 for method in self.methods}
+
+    def fresh(self):
+        """A Deduplicator of the same configuration with nothing seen yet, for the next job"""
+        return Deduplicator(self.methods, self.threshold, self.text_pages)
+
+    def _representative(self, file):
+        return self._canonical.get(file, file)
+
+    def _by_hash(self, file):
+        size = os.path.getsize(file)
+        if size not in self._sizes:
+            self._sizes[size] = file
+            return None
+        first, self._sizes[size] = self._sizes[size], None
+        if first is not None:
+            self._keys.setdefault(('hash', file_sha256(first)), self._representative(first))
+        return ('hash', file_sha256(file))
+
+    def _by_id(self, file):
+        value = pdf_id(file)
+        return ('id', value, pdf_page_count(file)) if value else None
+
+    def _similar(self, simhash):
+        for band in range(4):
+            for other, representative in self._simhashes.get((band, simhash >> band * 16 & 0xffff), ()):
+                if bin(simhash ^ other).count('1') <= self.threshold:
+                    return representative
+        return None
+
+    def match(self, file):
+        """The representative of which `file` is a duplicate, with the method which found it, or (None, None) if
+        `file` is the first of its kind. Called by a single thread, the one which dispatches the pdfs."""
+        keys = []
+        simhash = None
+        for method in self.methods:
+            if method == 'text':
+                simhash = text_simhash(file, self.text_pages)
+                representative = self._similar(simhash) if simhash is not None else None
+            else:
+                key = self._by_hash(file) if method == 'hash' else self._by_id(file)
+                representative = self._keys.get(key) if key is not None else None
+                if key is not None:
+                    keys.append(key)
+            if representative is not None and representative != file:  # not the same file seen twice
+                self._canonical[file] = representative
+                self.counts[method] += 1
+                return representative, method
+
+        for key in keys:
+            self._keys[key] = file
+        if simhash is not None:
+            for band in range(4):
+                self._simhashes.setdefault((band, simhash >> band * 16 & 0xffff), []).append((simhash, file))
+        with self._lock:
+            self._status[file] = self.PENDING
+        return None, None
+
+    def wait_for(self, representative, duplicate, method):
+        """Whether the representative was parsed, or None if it is still parsing, then (duplicate, method) is
+        queued and returned by `done` of the representative"""
+        with self._lock:
+            status = self._status.get(representative)
+            if status is self.PENDING:
+                self._waiting.setdefault(representative, []).append((duplicate, method))
+            return status
+
+    def done(self, representative, ok):
+        """Record the result of a representative, return the (duplicate, method) which wait for it"""
+        with self._lock:
+            if representative not in self._status:
+                return []
+            self._status[representative] = ok
+            return self._waiting.pop(representative, [])
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(duplicates) for duplicates in self._waiting.values())
+
+    def report(self, output_dir, duplicate, representative, method, ok):
+        record = {'path': os.path.abspath(duplicate), 'duplicate_of': os.path.abspath(representative),
+                  'method': method, 'ok': ok, 'time': time.time()}
+        with self._lock, open(os.path.join(output_dir, DUPLICATES_FILENAME), 'a', encoding='utf-8') as fp:
+            fp.write(json.dumps(record) + '\n')
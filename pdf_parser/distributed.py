@@ -0,0 +1,350 @@
+import os
+import json
+import argparse
+import time
+import socket
+import sqlite3
+import logging
+import threading
+
+from .autoscale import threads_arg
+from .parser import Parser
+from .utils import batched, iter_pdf_files
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class WorkQueue:
+    """Queue of pdf jobs in a SQLite database on storage shared by all nodes.
+
+    A job is one pdf for one (backend, typ), with its output dir and parse options. Workers lease jobs
+    for `lease` seconds and keep extending the lease while they work. A job whose lease runs out, e.g.
+    because its worker died, is delivered again, until it has been tried `max_attempts` times.
+    The database stays in rollback journal mode, since WAL does not work across hosts.
+    """
+
+    def __init__(self, path, max_attempts=3, timeout=60):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    typ TEXT NOT NULL,
+                    output_dir TEXT NOT NULL,
+                    options TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    duration REAL,
+                    error TEXT,
+                    updated REAL,
+                    UNIQUE (path, backend, typ)
+                )''')
+            conn.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, backend)')
+
+    def _conn(self):
+        # one connection per thread, e.g. the heartbeat thread of a worker has its own
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=DELETE')
+        return _Transaction(conn)
+
+    def enqueue(self, pdf_files, output_dir, backend, typ, options=None, chunk_size=1000):
+        """Add pdfs to the queue, a pdf already queued for the same backend and type is left as is"""
+        output_dir = os.path.abspath(output_dir)
+        options = json.dumps(options or {}, sort_keys=True)
+        count = 0
+        for chunk in batched(pdf_files, chunk_size):
+            now = time.time()
+            with self._conn() as conn:
+                cursor = conn.executemany(
+                    'INSERT OR IGNORE INTO jobs (path, backend, typ, output_dir, options, status, updated) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(os.path.abspath(file), backend, typ, output_dir, options, QUEUED, now) for file in chunk])
+                count += cursor.rowcount
+        return count
+
+    def claim(self, worker, backends=None, limit=100, lease=600, exclude=()):
+        """Lease up to `limit` jobs, for one (backend, typ, output_dir, options) group at a time"""
+        now = time.time()
+        where = '(status = ? OR (status = ? AND lease_until < ?))'
+        params = [QUEUED, LEASED, now]
+        if backends:
+            where += ' AND backend IN (%s)' % ','.join('?' * len(backends))
+            params.extend(backends)
+        if exclude:
+            where += ' AND backend NOT IN (%s)' % ','.join('?' * len(exclude))
+            params.extend(exclude)
+        with self._conn() as conn:
+            # a job which keeps killing its workers goes to failed, instead of being delivered forever
+            conn.execute('UPDATE jobs SET status = ?, error = ?, updated = ? '
+                         'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                         (FAILED, 'lease expired too many times', now, LEASED, now, self.max_attempts))
+            first = conn.execute(f'SELECT backend, typ, output_dir, options FROM jobs WHERE {where} LIMIT 1',
+                                 params).fetchone()
+            if first is None:
+                return None, []
+            rows = conn.execute(
+                f'SELECT id, path FROM jobs WHERE {where} AND backend = ? AND typ = ? AND output_dir = ? '
+                f'AND options = ? LIMIT ?', params + list(first) + [limit]).fetchall()
+            conn.executemany('UPDATE jobs SET status = ?, worker = ?, lease_until = ?, attempts = attempts + 1, '
+                             'updated = ? WHERE id = ?', [(LEASED, worker, now + lease, now, row[0]) for row in rows])
+        backend, typ, output_dir, options = first
+        return (backend, typ, output_dir, json.loads(options)), rows
+
+    def extend(self, worker, lease=600):
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute('UPDATE jobs SET lease_until = ? WHERE status = ? AND worker = ?', (now + lease, LEASED, worker))
+
+    def finish(self, results, worker):
+        """Record (job_id, ok, duration, error) of leased jobs, in one transaction"""
+        now = time.time()
+        with self._conn() as conn:
+            conn.executemany('UPDATE jobs SET status = ?, duration = ?, error = ?, updated = ? '
+                             'WHERE id = ? AND worker = ? AND status = ?',
+                             [(DONE if ok else FAILED, duration, error, now, job_id, worker, LEASED)
+                              for job_id, ok, duration, error in results])
+
+    def release(self, job_ids, worker, error=None):
+        """Give leased jobs back to the queue, e.g. when the backend is not available on this node.
+
+        A job which has used up its attempts is failed instead.
+        """
+        with self._conn() as conn:
+            conn.executemany('UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, '
+                             'lease_until = NULL, error = ?, updated = ? WHERE id = ? AND worker = ? AND status = ?',
+                             [(self.max_attempts, FAILED, QUEUED, error, time.time(), job_id, worker, LEASED)
+                              for job_id in job_ids])
+
+    def retry_failed(self):
+        with self._conn() as conn:
+            return conn.execute('UPDATE jobs SET status = ?, attempts = 0, error = NULL, updated = ? WHERE status = ?',
+                                (QUEUED, time.time(), FAILED)).rowcount
+
+    def counts(self):
+        with self._conn() as conn:
+            return dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+
+    def unfinished(self, backends=None, exclude=()):
+        """Number of jobs queued or leased, of the given backends only if any"""
+        where, params = 'status IN (?, ?)', [QUEUED, LEASED]
+        if backends:
+            where += ' AND backend IN (%s)' % ','.join('?' * len(backends))
+            params.extend(backends)
+        if exclude:
+            where += ' AND backend NOT IN (%s)' % ','.join('?' * len(exclude))
+            params.extend(exclude)
+        with self._conn() as conn:
+            return conn.execute(f'SELECT COUNT(*) FROM jobs WHERE {where}', params).fetchone()[0]
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, so that two workers never lease the same job"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute('BEGIN IMMEDIATE')
+        return self.conn
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.conn.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+
+
+class Worker:
+    """Pull jobs of the queue and parse them with the local backends, until the queue is drained.
+
+    `backend_kwargs` maps a backend name to the kwargs of its Parser, `backends` restricts which jobs
+    this node takes, e.g. only ['grobid'] on a node without java. A backend which is not healthy on this
+    node is left to other nodes for `unavailable_backoff` seconds, doubled each time it is still not
+    healthy, up to `max_backoff`, then its Parser is created anew and tried again.
+    """
+
+    def __init__(self, queue, backends=None, backend_kwargs=None, num_threads=0, batch_size=100, lease=600,
+                 heartbeat=60, poll=10, forever=False, name=None, unavailable_backoff=60, max_backoff=3600):
+        self.queue = queue
+        self.backends = backends
+        self.backend_kwargs = backend_kwargs or {}
+        self.num_threads = num_threads
+        self.batch_size = batch_size
+        self.lease = lease
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.forever = forever
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+
+        self.unavailable_backoff = unavailable_backoff
+        self.max_backoff = max_backoff
+
+        self._parsers = {}
+        self._unavailable = {}  # backend which is not healthy on this node -> time.monotonic() to try it again
+        self._backoffs = {}  # backend -> its last backoff, until it works again
+        self._stop = threading.Event()
+
+    def _parser(self, backend):
+        if backend not in self._parsers:
+            self._parsers[backend] = Parser(backend, **self.backend_kwargs.get(backend, {}))
+        return self._parsers[backend]
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.heartbeat):
+            try:
+                self.queue.extend(self.name, self.lease)
+            except sqlite3.Error as e:
+                logger.warning(f'Could not extend the leases of {self.name}: {e}')
+
+    def stop(self):
+        self._stop.set()
+
+    def _excluded(self):
+        """Backends left to other nodes for now, the ones whose backoff is over are tried again"""
+        now = time.monotonic()
+        for backend, retry_at in list(self._unavailable.items()):
+            if retry_at <= now:
+                logger.info(f'Try {backend} again on {self.name}.')
+                del self._unavailable[backend]
+                parser = self._parsers.pop(backend, None)
+                if parser is not None:  # a new one checks the health again, e.g. java or the server
+                    parser.close()
+        return sorted(self._unavailable)
+
+    def run_batch(self, group, jobs):
+        backend, typ, output_dir, options = group
+        id_of = {path: job_id for job_id, path in jobs}
+        results = {}
+
+        # results are written once per batch, one transaction per pdf would be slow on shared storage
+        def on_result(input_file, ok, duration, error):
+            job_id = id_of.get(input_file)
+            if job_id is not None:
+                results[job_id] = (job_id, ok, duration, error)
+
+        parser = None
+        try:
+            parser = self._parser(backend)
+            os.makedirs(output_dir, exist_ok=True)
+            parser.handler.listeners.append(on_result)
+            try:
+                parser.parse_files(typ, list(id_of), output_dir, self.num_threads, **options)
+            finally:
+                parser.handler.listeners.remove(on_result)
+        except Exception:
+            logger.exception(f'{backend}/{typ} failed on a batch of {len(jobs)} PDF files')
+        results = list(results.values())
+        self.queue.finish(results, self.name)
+        # jobs the backend did not report, e.g. since it is not healthy on this node, go back to the queue
+        # and count as one attempt
+        reported = {result[0] for result in results}
+        unreported = [job_id for job_id, _ in jobs if job_id not in reported]
+        if unreported:
+            self.queue.release(unreported, self.name, 'not reported by the backend')
+        if parser is None or getattr(parser.handler, 'health', True) is False:
+            backoff = self._backoffs.get(backend)
+            backoff = self.unavailable_backoff if backoff is None else min(backoff * 2, self.max_backoff)
+            self._backoffs[backend] = backoff
+            self._unavailable[backend] = time.monotonic() + backoff
+            logger.warning(f'{backend} is not available on {self.name}, leave its jobs to other workers for '
+                           f'{backoff:.0f} seconds.')
+        else:
+            self._backoffs.pop(backend, None)
+        return len(results)
+
+    def run(self):
+        logger.info(f'Worker {self.name} started on {self.queue.path}')
+        heartbeat = threading.Thread(target=self._heartbeat_loop, name='worker-heartbeat', daemon=True)
+        heartbeat.start()
+        count = 0
+        try:
+            while not self._stop.is_set():
+                exclude = self._excluded()
+                group, jobs = self.queue.claim(self.name, self.backends, self.batch_size, self.lease, exclude)
+                if not jobs:
+                    if not self.forever and self.queue.unfinished(self.backends, exclude) == 0:
+                        break
+                    self._stop.wait(self.poll)  # leased by other workers, or waiting for new jobs
+                    continue
+                count += self.run_batch(group, jobs)
+                logger.info(f'Worker {self.name}: {count} PDF files processed, queue: {self.queue.counts()}')
+        finally:
+            self._stop.set()
+            for parser in self._parsers.values():
+                parser.close()
+        logger.info(f'Worker {self.name} finished, {count} PDF files processed.')
+        return count
+
+
+def enqueue_dir(queue, input_path, output_dir, backend, typ, recursive=False, options=None):
+    pdf_files = [input_path] if os.path.isfile(input_path) else iter_pdf_files(input_path, recursive)
+    return queue.enqueue(pdf_files, output_dir, backend, typ, options)
+
+
+def wait(queue, interval=30):
+    """Log the progress of the queue until no job is queued or leased"""
+    while True:
+        counts = queue.counts()
+        logger.info(f'Queue {queue.path}: {counts}')
+        if counts.get(QUEUED, 0) + counts.get(LEASED, 0) == 0:
+            return counts
+        time.sleep(interval)
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m pdf_parser')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+
+    coordinator = commands.add_parser('coordinator', help='Enqueue PDF files into a shared work queue.')
+    coordinator.add_argument('queue', help='Path of the SQLite work queue, on storage shared by all nodes.')
+    coordinator.add_argument('input_path', help='Input directory or Input PDF file')
+    coordinator.add_argument('output_path', help='Output directory, on storage shared by all nodes')
+    coordinator.add_argument('-b', '--backend', default='grobid', help='Backend to use. (Default: grobid)')
+    coordinator.add_argument('-t', '--type', default='text', help='Type of content. (Default: text)')
+    coordinator.add_argument('-r', '--recursive', action='store_true', help='Also parse PDF files in sub directories.')
+    coordinator.add_argument('--options', default='{}', help='Parse options as JSON, e.g. \'{"doc_timeout": 60}\'.')
+    coordinator.add_argument('--max-attempts', type=int, default=3, help='Deliveries of a job before it fails.')
+    coordinator.add_argument('--retry-failed', action='store_true', help='Put the failed jobs back into the queue.')
+    coordinator.add_argument('--wait', action='store_true', help='Log the progress until the queue is drained.')
+
+    worker = commands.add_parser('worker', help='Parse PDF files pulled from a shared work queue.')
+    worker.add_argument('queue', help='Path of the SQLite work queue, on storage shared by all nodes.')
+    worker.add_argument('-b', '--backends', default=None, help='Comma separated backends to take jobs for. (Default: all)')
+    worker.add_argument('--backend-kwargs', default='{}',
+                        help='Parser kwargs by backend as JSON, e.g. \'{"grobid": {"host": "server10", "port": 8070}}\'.')
+    worker.add_argument('-n', '--thread', type=threads_arg, default=0, help='Number of thread, or auto. (Default: 0)')
+    worker.add_argument('--batch-size', type=int, default=100, help='Jobs leased at a time. (Default: 100)')
+    worker.add_argument('--lease', type=float, default=600, help='Seconds of a lease. (Default: 600)')
+    worker.add_argument('--heartbeat', type=float, default=60, help='Seconds between lease extensions. (Default: 60)')
+    worker.add_argument('--max-attempts', type=int, default=3, help='Deliveries of a job before it fails.')
+    worker.add_argument('--forever', action='store_true', help='Keep waiting for new jobs once the queue is drained.')
+    worker.add_argument('--unavailable-backoff', type=float, default=60,
+                        help='Seconds before a backend which is not available on this node is tried again, doubled '
+                             'while it stays unavailable. (Default: 60)')
+
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    queue = WorkQueue(args.queue, max_attempts=args.max_attempts)
+    if args.command == 'coordinator':
+        if args.retry_failed:
+            logger.info(f'{queue.retry_failed()} failed jobs put back into the queue.')
+        count = enqueue_dir(queue, args.input_path, args.output_path, args.backend, args.type, args.recursive,
+                            json.loads(args.options))
+        logger.info(f'{count} PDF files enqueued.')
+        if args.wait:
+            wait(queue)
+    else:
+        backends = args.backends.split(',') if args.backends else None
+        Worker(queue, backends, json.loads(args.backend_kwargs), args.thread, args.batch_size, args.lease,
+               args.heartbeat, forever=args.forever, unavailable_backoff=args.unavailable_backoff).run()
@@ -0,0 +1,110 @@
+import java.io.BufferedReader;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.PrintStream;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.security.Permission;
+
+/**
+ * Resident JVM worker used by pdf_parser.
+ *
+ * Usage: java -cp <parser jar>:<dir of this class> PdfParserWorker <main class>
+ *
+ * Each line read from stdin is one task: the tab separated arguments of the main class.
+ * The main method is invoked in this JVM, and one line is written back to stdout per task:
+ * "OK", or "ERROR\t<message>". The output of the parser itself is discarded, its stderr is kept.
+ *
+ * A System.exit of the parser is trapped by a security manager and ends the task instead of the JVM,
+ * exit code 0 as "OK". The security manager needs -Djava.security.manager=allow on java 18 to 23, and is
+ * not available from java 24 on: the worker then announces "READY\tno exit trap", and a parser which
+ * exits costs a new JVM.
+ */
+public class PdfParserWorker {
+    private static class ExitTrapped extends SecurityException {
+        final int status;
+
+        ExitTrapped(int status) {
+            super("System.exit(" + status + ")");
+            this.status = status;
+        }
+    }
+
+    @SuppressWarnings("removal")
+    private static boolean trapExit() {
+        try {
+            System.setSecurityManager(new SecurityManager() {
+                @Override
+                public void checkExit(int status) {
+                    throw new ExitTrapped(status);
+                }
+
+                @Override
+                public void checkPermission(Permission perm) {
+                }
+
+                @Override
+                public void checkPermission(Permission perm, Object context) {
+                }
+            });
+            return true;
+        } catch (UnsupportedOperationException | SecurityException e) {
+            System.err.println("PdfParserWorker: no exit trap, " + e);
+            return false;
+        }
+    }
+
+    public static void main(String[] args) throws Exception {
+        Method main = Class.forName(args[0]).getMethod("main", String[].class);
+
+        PrintStream protocol = System.out;
+        System.setOut(new PrintStream(new OutputStream() {
+            @Override
+            public void write(int b) {
+            }
+
+            @Override
+            public void write(byte[] b, int off, int len) {
+            }
+        }));
+
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        protocol.println(trapExit() ? "READY" : "READY\tno exit trap");
+        protocol.flush();
+
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            try {
+                main.invoke(null, (Object) line.split("\t", -1));
+                protocol.println("OK");
+            } catch (InvocationTargetException e) {
+                ExitTrapped exit = exitOf(e.getCause());
+                if (exit == null) {
+                    protocol.println("ERROR\t" + message(e.getCause()));
+                } else {
+                    protocol.println(exit.status == 0 ? "OK" : "ERROR\texit code " + exit.status);
+                }
+            } catch (Throwable e) {
+                protocol.println("ERROR\t" + message(e));
+            }
+            protocol.flush();
+        }
+    }
+
+    private static ExitTrapped exitOf(Throwable e) {
+        // the parser may have wrapped it
+        for (; e != null; e = e.getCause()) {
+            if (e instanceof ExitTrapped) {
+                return (ExitTrapped) e;
+            }
+        }
+        return null;
+    }
+
+    private static String message(Throwable e) {
+        return String.valueOf(e).replace('\n', ' ').replace('\r', ' ');
+    }
+}
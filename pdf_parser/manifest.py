@@ -0,0 +1,118 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobManifest:
+    """Durable per-pdf record of a batch job, kept as a SQLite database in the output dir.
+
+    Each pdf is recorded with its backend, type, status (pending/done/failed), duration and error,
+    together with its size and mtime, so that a rerun skips the pdfs which are done and unchanged.
+    Writes are committed every `commit_every` records, so a crash loses at most those.
+    """
+
+    FILENAME = '.pdf_parser.manifest.sqlite'
+
+    # manifests of the same output dir (e.g. the stages of a Pipeline) share one connection, since a
+    # second connection would wait on the write transaction which the first keeps open between commits
+    _shared = {}  # path -> [connection, lock, number of users]
+    _shared_lock = threading.Lock()
+
+    def __init__(self, output_dir, backend, typ, commit_every=100):
+        self.path = os.path.abspath(os.path.join(output_dir, self.FILENAME))
+        self.backend = backend
+        self.typ = typ
+        self.commit_every = commit_every
+
+        self._uncommitted = 0
+        with self._shared_lock:
+            shared = self._shared.get(self.path)
+            if shared is None:
+                shared = self._shared[self.path] = [self._connect(self.path), threading.Lock(), 0]
+            shared[2] += 1
+        self._conn, self._lock = shared[:2]
+
+    @staticmethod
+    def _connect(path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                path TEXT NOT NULL,
+                backend TEXT NOT NULL,
+                typ TEXT NOT NULL,
+                size INTEGER,
+                mtime REAL,
+                status TEXT NOT NULL,
+                duration REAL,
+                error TEXT,
+                updated REAL,
+                PRIMARY KEY (path, backend, typ)
+            )''')
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _stat(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None, None
+        return st.st_size, st.st_mtime
+
+    def is_done(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT status, size, mtime FROM documents WHERE path = ? AND backend = ? AND typ = ?',
+                (path, self.backend, self.typ)).fetchone()
+        return row is not None and row[0] == DONE and tuple(row[1:]) == self._stat(path)
+
+    def _write(self, path, status, duration=None, error=None):
+        path = os.path.abspath(path)
+        size, mtime = self._stat(path)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (path, self.backend, self.typ, size, mtime, status, duration, error, time.time()))
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def mark_pending(self, path):
+        self._write(path, PENDING)
+
+    def record(self, path, ok, duration=None, error=None):
+        self._write(path, DONE if ok else FAILED, duration, error)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT status, COUNT(*) FROM documents WHERE backend = ? AND typ = ? GROUP BY status',
+                (self.backend, self.typ)).fetchall()
+        return dict(rows)
+
+    def failed(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT path, error FROM documents WHERE backend = ? AND typ = ? AND status = ?',
+                (self.backend, self.typ, FAILED)).fetchall()
+
+    def close(self):
+        with self._shared_lock:
+            shared = self._shared[self.path]
+            shared[2] -= 1
+            with self._lock:
+                self._conn.commit()
+                if shared[2] == 0:
+                    self._conn.close()
+                    del self._shared[self.path]
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Thread-safe stage timers, counters and gauges of one backend.
+
+    A stage ('staging', 'subprocess', 'http', 'move', 'json_rewrite', ...) accumulates its number of
+    runs, the number of pdfs those runs covered, and the total and max seconds, so that per-pdf time of
+    a batched stage is total seconds / docs. Counters only grow (retries, timeouts, ...), gauges are
+    current levels (queue_depth, in_flight).
+    """
+
+    def __init__(self, backend=''):
+        self.backend = backend
+        self.started = time.time()
+        self.stages = {}  # name -> [runs, docs, seconds, max seconds]
+        self.counters = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, n_docs=1):
+        with self._lock:
+            record = self.stages.get(stage)
+            if record is None:
+                record = self.stages[stage] = [0, 0, 0.0, 0.0]
+            record[0] += 1
+            record[1] += n_docs
+            record[2] += seconds
+            record[3] = max(record[3], seconds)
+
+    @contextmanager
+    def timer(self, stage, n_docs=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, n_docs)
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def add(self, name, delta):
+        with self._lock:
+            self.gauges[name] = self.gauges.get(name, 0) + delta
+
+    @contextmanager
+    def track(self, name, n=1):
+        """Count n more in the gauge while the block runs, e.g. requests or batches in flight"""
+        self.add(name, n)
+        try:
+            yield
+        finally:
+            self.add(name, -n)
+
+    def on_result(self, input_file, ok, duration, error):
+        """Listener of the backend, count each processed pdf and its end-to-end time"""
+        self.inc('documents_ok' if ok else 'documents_failed')
+        self.observe('document', duration)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'time': time.time(),
+                'backend': self.backend,
+                'uptime': time.time() - self.started,
+                'stages': {name: {'runs': runs, 'docs': docs, 'seconds': seconds, 'max_seconds': longest}
+                           for name, (runs, docs, seconds, longest) in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+            }
+
+    def to_prometheus(self, prefix='pdf_parser'):
+        snapshot = self.snapshot()
+        label = f'backend="{self.backend}"'
+        lines = [f'# TYPE {prefix}_stage_seconds summary']
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_seconds_sum{{{label},stage="{name}"}} {stage["seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{{label},stage="{name}"}} {stage["runs"]}')
+        lines.append(f'# TYPE {prefix}_stage_documents_total counter')
+        for name, stage in sorted(snapshot['stages'].items()):
+            lines.append(f'{prefix}_stage_documents_total{{{label},stage="{name}"}} {stage["docs"]}')
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'# TYPE {prefix}_{name}_total counter')
+            lines.append(f'{prefix}_{name}_total{{{label}}} {value}')
+        for name, value in sorted(snapshot['gauges'].items()):
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name}{{{label}}} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write the metrics in Prometheus text format, e.g. for the textfile collector of node_exporter"""
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_jsonl(self, path):
+        with open(path, 'a', encoding='utf-8') as fp:
+            fp.write(json.dumps(self.snapshot()) + '\n')
+
+
+class MetricsReporter:
+    """Export the metrics of a backend every `interval` seconds from a background thread, and once more on stop"""
+
+    def __init__(self, metrics, jsonl_path=None, prometheus_path=None, interval=10):
+        self.metrics = metrics
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def export(self):
+        try:
+            if self.jsonl_path:
+                self.metrics.write_jsonl(self.jsonl_path)
+            if self.prometheus_path:
+                self.metrics.write_prometheus(self.prometheus_path)
+        except OSError as e:
+            logger.warning(f'Could not export metrics: {e}')
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name='metrics-reporter', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.export()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+@contextmanager
+def profiled(path=None, sort='cumulative', limit=30):
+    """Run the block under cProfile, dump the stats to path if given, and print the top functions.
+
+    Only the calling thread is profiled, so the time of the worker threads shows up as waits on their futures.
+    """
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if path:
+            profile.dump_stats(path)
+        stats = pstats.Stats(profile)
+        stats.sort_stats(sort)
+        stats.print_stats(limit)
@@ -0,0 +1,510 @@
+import io
+import os
+import json
+import logging
+import argparse
+import threading
+import xml.etree.ElementTree as ET
+
+from .store import doc_id
+
+logger = logging.getLogger(__name__)
+
+
+class _Record(object):
+    """Slotted record, serialized without its empty fields"""
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        for name in self.__slots__:
+            setattr(self, name, kwargs.pop(name, None))
+        if kwargs:
+            raise TypeError(f'{self.__class__.__name__} has no field {", ".join(kwargs)}')
+
+    def to_dict(self):
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if isinstance(value, _Record):
+                value = value.to_dict()
+            elif isinstance(value, list):
+                value = [item.to_dict() if isinstance(item, _Record) else item for item in value]
+            if value is not None and value != [] and value != '':
+                data[name] = value
+        return data
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.to_dict()})'
+
+
+class BoundingBox(_Record):
+    """Region of a page in PDF points (1/72 inch) from the top left corner, pages count from 1"""
+    __slots__ = ('page', 'x1', 'y1', 'x2', 'y2')
+
+
+class Author(_Record):
+    __slots__ = ('name', 'affiliations')
+
+
+class Section(_Record):
+    __slots__ = ('heading', 'text')
+
+
+class Reference(_Record):
+    __slots__ = ('title', 'authors', 'venue', 'year', 'doi')
+
+
+class Figure(_Record):
+    """A figure or table, `image` is the name of its rendered image in the result dir, if any"""
+    __slots__ = ('name', 'type', 'caption', 'page', 'bbox', 'caption_bbox', 'image')
+
+
+class Document(_Record):
+    """The results of all backends for one pdf, `sources` are the result suffixes it was built from"""
+    __slots__ = ('id', 'title', 'authors', 'abstract', 'year', 'doi', 'sections', 'references', 'figures', 'sources')
+
+    def __init__(self, **kwargs):
+        super(Document, self).__init__(**kwargs)
+        for name in ('authors', 'sections', 'references', 'figures', 'sources'):
+            if getattr(self, name) is None:
+                setattr(self, name, [])
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _text(elem):
+    if elem is None:
+        return None
+    return ' '.join(''.join(elem.itertext()).split()) or None
+
+
+def _child(elem, *names):
+    """First descendant along a path of local names, e.g. _child(elem, 'monogr', 'imprint', 'date')"""
+    for name in names:
+        if elem is None:
+            return None
+        elem = next((child for child in elem if _local(child.tag) == name), None)
+    return elem
+
+
+def _first(*elems):
+    # an element without children is false, so `a or b` does not pick the first element which exists
+    return next((elem for elem in elems if elem is not None), None)
+
+
+def _children(elem, name):
+    return [child for child in elem if _local(child.tag) == name] if elem is not None else []
+
+
+def _find(elem, name, **attrs):
+    for child in elem.iter():
+        if _local(child.tag) == name and all(_attr(child, key) == value for key, value in attrs.items()):
+            return child
+    return None
+
+
+def _attr(elem, name):
+    for key, value in elem.attrib.items():
+        if _local(key) == name:
+            return value
+    return None
+
+
+def _year(value):
+    return value[:4] if value and value[:4].isdigit() else None
+
+
+def _open(source):
+    """Binary file object of a file result given as bytes or a path"""
+    if isinstance(source, (bytes, bytearray)):
+        return io.BytesIO(source)
+    return open(source, 'rb')
+
+
+def _load_json(source):
+    with _open(source) as fp:
+        return json.load(fp)
+
+
+def _dir_names(source):
+    if isinstance(source, dict):
+        return sorted(source)
+    return sorted(os.listdir(source))
+
+
+def _dir_file(source, name):
+    """Content of one file of a directory result given as {file name: bytes} or a path, or None"""
+    if isinstance(source, dict):
+        return source.get(name)
+    path = os.path.join(source, name)
+    return path if os.path.isfile(path) else None
+
+
+# TEI of GROBID
+
+def _tei_person(pers):
+    parts = [_text(child) for child in pers if _local(child.tag) in ('forename', 'surname')]
+    return ' '.join(part for part in parts if part) or _text(pers)
+
+
+def _tei_authors(parent):
+    authors = []
+    for author in _children(parent, 'author'):
+        pers = _child(author, 'persName')
+        if pers is None:
+            continue
+        affiliations = [_text(_child(aff, 'orgName')) or _text(aff) for aff in _children(author, 'affiliation')]
+        authors.append(Author(name=_tei_person(pers), affiliations=[aff for aff in affiliations if aff]))
+    return authors
+
+
+def _tei_date(bibl):
+    date = _child(bibl, 'monogr', 'imprint', 'date')
+    return _year(_attr(date, 'when') or _text(date)) if date is not None else None
+
+
+def _tei_doi(bibl):
+    idno = _find(bibl, 'idno', type='DOI')
+    return _text(idno)
+
+
+def _tei_reference(bibl):
+    analytic = _child(bibl, 'analytic')
+    monogr = _child(bibl, 'monogr')
+    title = _text(_child(analytic, 'title')) or _text(_child(monogr, 'title'))
+    venue = _text(_child(monogr, 'title')) if analytic is not None and _child(analytic, 'title') is not None else None
+    authors = _tei_authors(analytic) or _tei_authors(monogr)
+    return Reference(title=title, authors=[author.name for author in authors], venue=venue, year=_tei_date(bibl),
+                     doi=_tei_doi(bibl))
+
+
+def _tei_coords(value):
+    """First box of a GROBID coords attribute, 'page,x,y,width,height;...'"""
+    if not value:
+        return None
+    try:
+        page, x, y, width, height = (float(part) for part in value.split(';')[0].split(','))
+    except ValueError:
+        return None
+    return BoundingBox(page=int(page), x1=x, y1=y, x2=x + width, y2=y + height)
+
+
+def _tei_figure(elem):
+    graphic = _child(elem, 'graphic')
+    return Figure(name=_text(_child(elem, 'label')) or _attr(elem, 'id'), type=_attr(elem, 'type') or 'figure',
+                  caption=' '.join(filter(None, [_text(_child(elem, 'head')), _text(_child(elem, 'figDesc'))])),
+                  bbox=_tei_coords(_attr(graphic, 'coords') if graphic is not None else None) or
+                  _tei_coords(_attr(elem, 'coords')))
+
+
+def from_tei(source, doc=None):
+    """Add a GROBID TEI document, given as bytes or a path, which is read incrementally, so that the
+    elements of a large document are dropped as soon as they are converted"""
+    doc = doc if doc is not None else Document()
+    stack = []
+    with _open(source) as fp:
+        for event, elem in ET.iterparse(fp, events=('start', 'end')):
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag == 'div' and stack and stack[-1] == 'body':
+                    doc.sections.append(Section())  # placeholder, so that sections keep their order
+                stack.append(tag)
+                continue
+            stack.pop()
+            if tag == 'title' and stack[-1:] == ['titleStmt'] and doc.title is None:
+                doc.title = _text(elem)
+            elif tag == 'biblStruct' and 'sourceDesc' in stack:
+                doc.authors.extend(_tei_authors(_child(elem, 'analytic')))
+                doc.year = doc.year or _tei_date(elem)
+                doc.doi = doc.doi or _tei_doi(elem)
+                elem.clear()
+            elif tag == 'abstract':
+                doc.abstract = _text(elem)
+                elem.clear()
+            elif tag == 'biblStruct' and 'listBibl' in stack:
+                doc.references.append(_tei_reference(elem))
+                elem.clear()
+            elif tag == 'figure' and 'text' in stack:
+                doc.figures.append(_tei_figure(elem))
+                elem.clear()
+            elif tag == 'div' and stack[-1:] == ['body']:
+                section = next(section for section in reversed(doc.sections) if section.heading is None and
+                               section.text is None)
+                section.heading = _text(_child(elem, 'head'))
+                section.text = '\n'.join(filter(None, (_text(p) for p in _children(elem, 'p')))) or None
+                elem.clear()
+    doc.sections = [section for section in doc.sections if section.heading or section.text]
+    return doc
+
+
+# JATS of CERMINE
+
+def _jats_name(elem):
+    name = elem if _local(elem.tag) in ('name', 'string-name') else _first(_child(elem, 'name'),
+                                                                            _child(elem, 'string-name'))
+    if name is None:
+        return _text(elem)
+    given, surname = _text(_child(name, 'given-names')), _text(_child(name, 'surname'))
+    return ' '.join(filter(None, [given, surname])) or _text(name)
+
+
+def _jats_reference(ref):
+    citation = _first(_child(ref, 'mixed-citation'), _child(ref, 'element-citation'), ref)
+    doi = next((_text(pub_id) for pub_id in _children(citation, 'pub-id') if _attr(pub_id, 'pub-id-type') == 'doi'),
+               None)
+    return Reference(title=_text(_child(citation, 'article-title')), venue=_text(_child(citation, 'source')),
+                     authors=[_jats_name(name) for name in citation if _local(name.tag) in ('string-name', 'name')],
+                     year=_year(_text(_child(citation, 'year'))), doi=doi)
+
+
+def from_jats(source, doc=None):
+    """Add a CERMINE JATS document, given as bytes or a path"""
+    doc = doc if doc is not None else Document()
+    stack = []
+    affiliations = {}
+    with _open(source) as fp:
+        for event, elem in ET.iterparse(fp, events=('start', 'end')):
+            tag = _local(elem.tag)
+            if event == 'start':
+                if tag == 'sec' and 'body' in stack:
+                    doc.sections.append(Section())
+                stack.append(tag)
+                continue
+            stack.pop()
+            if tag == 'article-title' and 'title-group' in stack and doc.title is None:
+                doc.title = _text(elem)
+            elif tag == 'aff' and 'article-meta' in stack:
+                affiliations[_attr(elem, 'id')] = _text(_child(elem, 'institution')) or _text(elem)
+            elif tag == 'contrib' and _attr(elem, 'contrib-type') in ('author', None):
+                xrefs = [_attr(xref, 'rid') for xref in _children(elem, 'xref') if _attr(xref, 'ref-type') == 'aff']
+                doc.authors.append(Author(name=_jats_name(elem), affiliations=xrefs))
+            elif tag == 'abstract' and doc.abstract is None:
+                doc.abstract = _text(elem)
+            elif tag == 'article-id' and _attr(elem, 'pub-id-type') == 'doi':
+                doc.doi = _text(elem)
+            elif tag == 'year' and 'pub-date' in stack and doc.year is None:
+                doc.year = _year(_text(elem))
+            elif tag == 'ref' and 'ref-list' in stack:
+                doc.references.append(_jats_reference(elem))
+                elem.clear()
+            elif tag == 'fig' or tag == 'table-wrap':
+                graphic = _child(elem, 'graphic')
+                doc.figures.append(Figure(name=_text(_child(elem, 'label')) or _attr(elem, 'id'),
+                                          type='table' if tag == 'table-wrap' else 'figure',
+                                          caption=_text(_child(elem, 'caption')),
+                                          image=_attr(graphic, 'href') if graphic is not None else None))
+                elem.clear()
+            elif tag == 'sec' and 'body' in stack:
+                section = next(section for section in reversed(doc.sections) if section.heading is None and
+                               section.text is None)
+                section.heading = _text(_child(elem, 'title'))
+                section.text = '\n'.join(filter(None, (_text(p) for p in _children(elem, 'p')))) or None
+                for child in _children(elem, 'p'):
+                    child.clear()
+    for author in doc.authors:
+        author.affiliations = [affiliations[rid] for rid in author.affiliations if affiliations.get(rid)]
+    doc.sections = [section for section in doc.sections if section.heading or section.text]
+    return doc
+
+
+# JSON of ScienceParse and PDFFigures/PDFFigures2
+
+def _value(value):
+    """A text which some outputs give as {'text': ...}"""
+    if isinstance(value, dict):
+        value = value.get('text')
+    return value or None
+
+
+def from_scienceparse(source, doc=None):
+    doc = doc if doc is not None else Document()
+    data = _load_json(source)
+    doc.title = doc.title or data.get('title')
+    doc.abstract = doc.abstract or data.get('abstractText')
+    doc.year = doc.year or (str(data['year']) if data.get('year') else None)
+    doc.authors.extend(Author(name=author.get('name'), affiliations=author.get('affiliations') or [])
+                       for author in data.get('authors') or [])
+    doc.sections.extend(Section(heading=section.get('heading'), text=section.get('text'))
+                        for section in data.get('sections') or [])
+    doc.references.extend(Reference(title=ref.get('title'), authors=ref.get('authors') or [], venue=ref.get('venue'),
+                                    year=str(ref['year']) if ref.get('year') else None)
+                          for ref in data.get('references') or [])
+    return doc
+
+
+def _box(region, page, scale=1.0):
+    if isinstance(region, dict):
+        region = [region.get('x1'), region.get('y1'), region.get('x2'), region.get('y2')]
+    if not region or None in region:
+        return None
+    x1, y1, x2, y2 = (value * scale for value in region)
+    return BoundingBox(page=page, x1=x1, y1=y1, x2=x2, y2=y2)
+
+
+def _pdffigures2_figure(item):
+    page = item['page'] + 1 if item.get('page') is not None else None  # pdffigures2 counts pages from 0
+    return Figure(name=item.get('name'), type=(item.get('figType') or 'figure').lower(), caption=item.get('caption'),
+                  page=page, bbox=_box(item.get('regionBoundary'), page),
+                  caption_bbox=_box(item.get('captionBoundary'), page), image=item.get('renderURL'))
+
+
+def from_pdffigures2_text(source, doc=None):
+    doc = doc if doc is not None else Document()
+    data = _load_json(source)
+    doc.title = doc.title or _value(data.get('title'))
+    doc.abstract = doc.abstract or _value(data.get('abstractText'))
+    for section in data.get('sections') or []:
+        paragraphs = [_value(paragraph) for paragraph in section.get('paragraphs') or []]
+        doc.sections.append(Section(heading=_value(section.get('title')),
+                                    text='\n'.join(filter(None, paragraphs)) or None))
+    doc.figures.extend(_pdffigures2_figure(item) for item in data.get('figures') or [])
+    return doc
+
+
+def from_pdffigures2_figures(source, doc=None):
+    doc = doc if doc is not None else Document()
+    data = _dir_file(source, 'figure-data.json')
+    if data is not None:
+        doc.figures.extend(_pdffigures2_figure(item) for item in _load_json(data))
+    return doc
+
+
+def from_pdffigures_figures(source, doc=None):
+    doc = doc if doc is not None else Document()
+    data = _dir_file(source, 'figure-data.json')
+    if data is None:
+        return doc
+    images = [name for name in _dir_names(source) if name.endswith('.png')]
+    for item in _load_json(data):
+        scale = 72.0 / item['DPI'] if item.get('DPI') else 1.0  # pdffigures boxes are in pixels at DPI
+        kind = (item.get('Type') or 'figure').lower()
+        name = str(item.get('Number')) if item.get('Number') is not None else None
+        image = next((image for image in images if name and image.lower().startswith(f'{kind}-{name}.')), None)
+        doc.figures.append(Figure(name=name, type=kind, caption=item.get('Caption'), page=item.get('Page'),
+                                  bbox=_box(item.get('ImageBB'), item.get('Page'), scale),
+                                  caption_bbox=_box(item.get('CaptionBB'), item.get('Page'), scale), image=image))
+    return doc
+
+
+def from_cermine_figures(source, doc=None):
+    doc = doc if doc is not None else Document()
+    known = {figure.image for figure in doc.figures}
+    doc.figures.extend(Figure(name=os.path.splitext(name)[0], type='figure', image=name)
+                       for name in _dir_names(source) if name not in known)
+    return doc
+
+
+# result suffix -> function adding that result to a Document
+NORMALIZERS = {
+    '.grobid.xml': from_tei,
+    '.cermine.xml': from_jats,
+    '.scienceparse.json': from_scienceparse,
+    '.pdffigures2.json': from_pdffigures2_text,
+    '.pdffigures2.figure': from_pdffigures2_figures,
+    '.pdffigures.figure': from_pdffigures_figures,
+    '.cermine.figure': from_cermine_figures,
+}
+
+
+def normalize(doc, results):
+    """One Document from the results of a pdf, {suffix: bytes or path} or {suffix: {file name: bytes}} of a
+    directory result, as returned by Parser.parse_bytes or ResultStore.get. Results of several backends
+    are merged, the first one which has a field sets it, and lists are appended."""
+    document = Document(id=doc)
+    for suffix, source in results.items():
+        normalizer = NORMALIZERS.get(suffix)
+        if normalizer is None:
+            continue
+        try:
+            normalizer(source, document)
+        except (ET.ParseError, ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            logger.warning(f'Could not normalize {doc}{suffix}: {e}')
+            continue
+        document.sources.append(suffix)
+    return document
+
+
+def iter_output_dir(output_dir):
+    """(doc id, {suffix: path}) of the results in an output dir, grouped by pdf"""
+    docs = {}
+    for entry in os.scandir(output_dir):
+        suffix = next((suffix for suffix in NORMALIZERS if entry.name.endswith(suffix)), None)
+        if suffix is None:
+            continue
+        stem = entry.name[:-len(suffix)]
+        if stem.lower().endswith('.pdf'):  # scienceparse results keep the pdf extension
+            stem = stem[:-4]
+        docs.setdefault(stem, {})[suffix] = entry.path
+    for doc in sorted(docs):
+        yield doc, docs[doc]
+
+
+class DocumentWriter:
+    """JSON Lines file of normalized documents, one per pdf, appended as the backends write their results.
+
+        writer = DocumentWriter('/path/to/documents.jsonl')
+        parser = Parser('grobid', normalize=writer)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def write(self, document):
+        line = document.to_json() + '\n'
+        with self._lock:
+            self._fp.write(line)
+
+    def add(self, input_file, results):
+        """Normalize and write the results of a parsed pdf, {suffix: path} of which the existing ones are read,
+        or results as returned by Parser.parse_bytes"""
+        existing = {suffix: source for suffix, source in results.items()
+                    if not isinstance(source, str) or os.path.exists(source)}
+        if not existing:
+            return False
+        self.write(normalize(doc_id(input_file), existing))
+        return True
+
+    def flush(self):
+        with self._lock:
+            self._fp.flush()
+
+    def close(self):
+        with self._lock:
+            self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m pdf_parser normalize',
+                                         description='Convert the results in an output directory or a result '
+                                                     'store into one JSON Lines file of normalized documents.')
+    arg_parser.add_argument('input_path', help='Output directory of a parse, or directory of a result store')
+    arg_parser.add_argument('jsonl_path', help='JSON Lines file to append the documents to')
+
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    count = 0
+    with DocumentWriter(args.jsonl_path) as writer:
+        if os.path.exists(os.path.join(args.input_path, 'index.sqlite')):
+            from .store import ResultStore
+            with ResultStore(args.input_path) as store:
+                for doc in store.ids():
+                    writer.write(normalize(doc, store.get(doc)))
+                    count += 1
+        else:
+            for doc, results in iter_output_dir(args.input_path):
+                writer.write(normalize(doc, results))
+                count += 1
+    logger.info(f'{count} documents written to {args.jsonl_path}.')
@@ -2,8 +2,15 @@ __all__ = ["Parser", "ParserBackend"]
 
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from .backends import *
+from .dedup import Deduplicator
+from .manifest import JobManifest
+from .preflight import REJECTS_FILENAME, Preflight
+from .store import doc_id
+from .utils import bounded_as_completed, iter_pdf_files, link_or_copy_tree, remove_path
 
 logger = logging.getLogger(__name__)
 
@@ -26,8 +33,15 @@ parser_backend = {
 
 
 class Parser:
-    def __init__(self, backend, **kwargs):
+    def __init__(self, backend, cache=None, manifest=False, store=None, normalize=None, dedup=None, preflight=None,
+                 **kwargs):
         self.backend = backend
+        self.cache = cache  # optional ResultCache shared across parsers
+        self.manifest = manifest  # keep a JobManifest in the output dir, and skip pdfs done by a previous run
+        self.store = store  # optional ResultStore, which takes the results out of the output dir
+        self.normalize = normalize  # optional DocumentWriter, which converts the results while they are fresh
+        self.dedup = dedup  # parse one copy of each paper, by a Deduplicator or its methods, e.g. ('hash', 'id')
+        self.preflight = Preflight() if preflight is True else preflight  # reject junk before the backend sees it
         self.handler = self._init_handler(**kwargs)
 
     def _init_handler(self, **kwargs):
@@ -36,6 +50,18 @@ class Parser:
             raise ValueError(f"parser backend is not valid: {self.backend}")
         return parser(**kwargs)
 
+    @property
+    def metrics(self):
+        return self.handler.metrics
+
+    def close(self):
+        self.handler.close()
+
+    def _direct(self):
+        """Whether the backend parses on its own, without any of the result listeners of _parse_files"""
+        return (self.cache is None and not self.manifest and self.store is None and self.normalize is None and
+                not self.dedup and self.preflight is None)
+
     def _check_input_dir(self, input_path):
         if not os.path.exists(input_path):
             logger.error(f"Input path not found: {input_path}!")
@@ -64,6 +90,204 @@ class Parser:
             raise ValueError(f"output dir is not valid: {output_dir}")
 
         logger.info(f"Start parsing {typ} of pdf files using {self.backend}.")
-        num_parsed = self.handler.parse(typ, input_path, output_dir, num_threads, **kwargs)
+        if self._direct():
+            num_parsed = self.handler.parse(typ, input_path, output_dir, num_threads, **kwargs)
+        elif os.path.isfile(input_path):
+            num_parsed = self._parse_files(typ, [input_path], output_dir, num_threads, single_file=input_path,
+                                           **kwargs)
+        else:
+            recursive = kwargs.pop('recursive', False)
+            num_parsed = self._parse_files(typ, iter_pdf_files(input_path, recursive), output_dir, num_threads,
+                                           **kwargs)
         logger.info("Finish.")
         return num_parsed
+
+    def parse_bytes(self, typ, data, name='document.pdf', **kwargs):
+        """Parse one pdf given as bytes or a binary file object, without output dir.
+
+        Return the results as {suffix: bytes}, or {suffix: {file name: bytes}} for a directory result
+        such as extracted figures, and {} if the pdf could not be parsed.
+        """
+        if hasattr(data, 'read'):
+            name = getattr(data, 'name', None) or name
+            data = data.read()
+        if self.preflight is not None:
+            reason = self.preflight.check_bytes(data)
+            if reason is not None:
+                logger.warning(f"Reject {name}: {reason}")
+                self.metrics.inc('rejected')
+                return {}
+        return self.handler.parse_bytes(typ, data, str(name), **kwargs)
+
+    def parse_stream(self, typ, documents, num_threads=8, **kwargs):
+        """Parse an iterable of pdfs, each bytes, a binary file object or a (name, bytes or file object) pair.
+
+        Yield (name, results) as each pdf is done, which may be out of order, with results as in parse_bytes.
+        At most 2 * num_threads pdfs are read ahead of the parsing ones.
+        """
+        def process(item):
+            index, document = item
+            name = f'document-{index}.pdf'
+            if isinstance(document, tuple):
+                name, document = document
+            elif hasattr(document, 'name'):
+                name = document.name
+            return name, self.parse_bytes(typ, document, name, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=num_threads) as executor:
+            for future in bounded_as_completed(executor, process, enumerate(documents), num_threads * 2):
+                yield future.result()
+
+    def parse_files(self, typ, pdf_files, output_dir, num_threads=0, on_done=None, **kwargs):
+        """Parse pdf files from an iterable, which may be lazy, e.g. fed from another thread.
+
+        on_done, if given, is called (input_file, ok) once the job is done with a pdf, whether it was parsed,
+        restored from the cache, skipped as done before or shared from a duplicate.
+        """
+        if not self._check_output_dir(output_dir):
+            raise ValueError(f"output dir is not valid: {output_dir}")
+
+        if self._direct() and on_done is None:
+            return self.handler.parse_files(typ, pdf_files, output_dir, num_threads, **kwargs)
+        return self._parse_files(typ, pdf_files, output_dir, num_threads, on_done=on_done, **kwargs)
+
+    def _share_results(self, representative, duplicate, output_dir):
+        """Give a duplicate pdf the results of its representative, in the result store or linked in the output dir"""
+        if self.store is not None:
+            self.store.copy(doc_id(representative), doc_id(duplicate))
+            if self.normalize is not None:
+                self.normalize.add(duplicate, self.store.get(doc_id(duplicate)))
+            return
+        paths = self.handler._result_paths(duplicate, output_dir)
+        for suffix, path in self.handler._result_paths(representative, output_dir).items():
+            if os.path.exists(path) and path != paths[suffix]:
+                remove_path(paths[suffix])
+                link_or_copy_tree(path, paths[suffix])
+        if self.normalize is not None:
+            self.normalize.add(duplicate, paths)
+
+    def _parse_files(self, typ, pdf_files, output_dir, num_threads=0, single_file=None, on_done=None, **kwargs):
+        """Parse through the result cache, the job manifest, the result store, the normalizer and/or the
+        deduplicator, only the remaining pdfs reach the backend"""
+        services = self.handler.get_services(typ)
+        manifest = JobManifest(output_dir, self.backend, typ) if self.manifest else None
+        force = kwargs.get('force', False)
+
+        # one per job, the groups of a previous job may be gone
+        dedup = None
+        if isinstance(self.dedup, Deduplicator):
+            dedup = self.dedup.fresh()
+        elif self.dedup:
+            dedup = Deduplicator(self.dedup)
+
+        stats = {'restored': 0, 'skipped': 0, 'stored': 0, 'duplicates': 0, 'rejected': 0}
+        cache_keys = {}
+        lock = threading.Lock()
+
+        def done(input_file, ok):
+            if on_done is not None:
+                on_done(input_file, ok)
+
+        def share(representative, duplicate, method, ok):
+            if ok:
+                self._share_results(representative, duplicate, output_dir)
+            if manifest is not None:
+                manifest.record(duplicate, ok, 0.0, None if ok else f'duplicate of {representative}, which failed')
+            dedup.report(output_dir, duplicate, representative, method, ok)
+            done(duplicate, ok)
+
+        def on_result(input_file, ok, duration, error):
+            if manifest is not None:
+                manifest.record(input_file, ok, duration, error)
+            with lock:
+                key = cache_keys.pop(input_file, None)
+            if ok and key is not None:
+                self.cache.store(key, self.handler._result_paths(input_file, output_dir))
+            duplicates = dedup.done(input_file, ok) if dedup else []
+            if ok and self.normalize is not None:
+                self.normalize.add(input_file, self.handler._result_paths(input_file, output_dir))
+            if ok and self.store is not None:
+                self.store.add(input_file, self.handler._result_paths(input_file, output_dir))
+            for duplicate, method in duplicates:
+                share(input_file, duplicate, method, ok)
+            done(input_file, ok)
+
+        def remaining():
+            for file in pdf_files:
+                if manifest is not None and not force and manifest.is_done(file):
+                    stats['skipped'] += 1
+                    done(file, True)
+                    continue
+                if (self.store is not None and not force and
+                        self.store.has(doc_id(file), self.handler.result_suffixes)):
+                    stats['stored'] += 1
+                    done(file, True)
+                    continue
+                reason = self.preflight.check(file) if self.preflight is not None else None
+                if reason is not None:
+                    stats['rejected'] += 1
+                    self.metrics.inc('rejected')
+                    self.preflight.reject(output_dir, file, reason)
+                    if manifest is not None:
+                        manifest.record(file, False, 0.0, f'rejected: {reason}')
+                    done(file, False)
+                    continue
+                if dedup:
+                    representative, method = dedup.match(file)
+                    if representative is not None:
+                        stats['duplicates'] += 1
+                        status = dedup.wait_for(representative, file, method)
+                        if status is not None:  # else shared once the representative is done
+                            share(representative, file, method, status)
+                        continue
+                if self.cache is not None:
+                    key = self.cache.key(self.handler._source(file), self.backend, services, kwargs)
+                    if not force and self.cache.restore(key, self.handler._result_paths(file, output_dir)):
+                        stats['restored'] += 1
+                        if self.normalize is not None:
+                            self.normalize.add(file, self.handler._result_paths(file, output_dir))
+                        if self.store is not None:
+                            self.store.add(file, self.handler._result_paths(file, output_dir))
+                        if manifest is not None:
+                            manifest.record(file, True, 0.0)
+                        if dedup:
+                            dedup.done(file, True)
+                        done(file, True)
+                        continue
+                    with lock:
+                        cache_keys[file] = key
+                if manifest is not None:
+                    manifest.mark_pending(file)
+                yield file
+
+        self.handler.listeners.append(on_result)
+        try:
+            if single_file is not None:
+                num_parsed = 0
+                if list(remaining()):
+                    num_parsed = self.handler.parse(typ, single_file, output_dir, num_threads, **kwargs)
+            else:
+                num_parsed = self.handler.parse_files(typ, remaining(), output_dir, num_threads, **kwargs)
+        finally:
+            self.handler.listeners.remove(on_result)
+            if manifest is not None:
+                logger.info(f"Job manifest: {manifest.counts()}")
+                manifest.close()
+            if self.store is not None:
+                self.store.flush()
+            if self.normalize is not None:
+                self.normalize.flush()
+            if dedup and dedup.waiting():
+                logger.warning(f"{dedup.waiting()} duplicates left without results, their copy was not parsed.")
+
+        if stats['skipped']:
+            logger.info(f"{stats['skipped']} PDF files skipped, already done in a previous run.")
+        if stats['stored']:
+            logger.info(f"{stats['stored']} PDF files skipped, already in the result store.")
+        if stats['rejected']:
+            logger.info(f"{stats['rejected']} PDF files rejected by the pre-flight checks, see {REJECTS_FILENAME}.")
+        if stats['duplicates']:
+            logger.info(f"{stats['duplicates']} PDF files collapsed into the results of a copy ({dedup.counts}).")
+        if self.cache is not None:
+            logger.info(f"{stats['restored']} PDF files restored from result cache.")
+        return stats['restored'] + num_parsed
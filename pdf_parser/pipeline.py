@@ -0,0 +1,211 @@
+import os
+import queue
+import logging
+import tempfile
+import threading
+
+from .parser import Parser
+from .preflight import Preflight
+from .store import doc_id
+from .utils import iter_pdf_files, link_or_copy, remove_path
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Staged:
+    __slots__ = ('path', 'lock', 'ready', 'stages')
+
+    def __init__(self, path, stages):
+        self.path = path
+        self.lock = threading.Lock()
+        self.ready = False
+        self.stages = stages  # indexes of the stages not done with the pdf yet
+
+
+class _SharedStaging:
+    """One local copy of each pdf for all stages of a Pipeline, made when the first stage reads the pdf, and
+    removed once every stage is done with it.
+
+    It is a hardlink when the input is on the device of the output dir, else a copy, so that a pdf on a network
+    filesystem is read from there once, rather than once per stage. The batch backends hardlink it on into
+    their own scratch dirs.
+    """
+
+    def __init__(self, output_dir, n_stages):
+        self.n_stages = n_stages
+        self._tmp_dir = tempfile.TemporaryDirectory(prefix='.pdf_parser-tmp-', dir=output_dir)
+        self._lock = threading.Lock()
+        self._files = {}  # input file -> _Staged
+        self._count = 0
+
+    def add(self, input_file):
+        with self._lock:
+            self._count += 1
+            path = os.path.join(self._tmp_dir.name, '%d.pdf' % self._count)
+            self._files[input_file] = _Staged(path, set(range(self.n_stages)))
+
+    def get(self, input_file):
+        """Path of the staged copy of input_file, staged on the first call, or input_file itself if it is not
+        one of the pdfs of the pipeline"""
+        with self._lock:
+            staged = self._files.get(input_file)
+        if staged is None:
+            return input_file
+        with staged.lock:
+            if not staged.ready:
+                try:
+                    link_or_copy(input_file, staged.path)
+                except OSError as e:
+                    logger.warning(f'Could not stage {input_file}: {e}')
+                    return input_file
+                staged.ready = True
+        return staged.path
+
+    def done(self, input_file, stage):
+        """Record that a stage is done with input_file, return True once all stages are"""
+        with self._lock:
+            staged = self._files.get(input_file)
+            if staged is None:
+                return False
+            staged.stages.discard(stage)
+            if staged.stages:
+                return False
+            del self._files[input_file]
+        remove_path(staged.path)
+        return True
+
+    def pending(self):
+        """The pdfs which some stage never reported, e.g. a stage which failed"""
+        with self._lock:
+            return list(self._files)
+
+    def close(self):
+        self._tmp_dir.cleanup()
+
+
+class Pipeline:
+    """Run several (backend, typ) stages over one corpus in a single pass.
+
+    The input directory is scanned once, and every pdf is handed to all stages, each of which runs in
+    its own thread with its own concurrency (`num_threads` and any other parse option in the stage
+    options). Each stage has a bounded queue, so the scan runs ahead of the slowest stage by at most
+    `queue_size` pdfs. All results are written side by side into the same output dir, which works since
+    the result suffixes of the backends differ.
+
+    Each pdf is staged once for all stages: the first stage to read it makes a local copy in the output
+    dir (a hardlink on the same device), which the others read from, and which is removed once every
+    stage is done with the pdf. The per-document bookkeeping is done once too: the pre-flight checks run
+    in the scan, and with `normalize`, one document merging the results of all stages is written per pdf.
+
+    A stage is (backend, typ) or (backend, typ, options), where backend is a backend name or a Parser.
+
+        pipeline = Pipeline([('grobid', 'text'), ('pdffigures2', 'figure', {'num_threads': 32})])
+        pipeline.parse('/path/to/pdf_dir', '/path/to/output')
+    """
+
+    def __init__(self, stages, cache=None, manifest=False, store=None, normalize=None, dedup=None, preflight=None,
+                 backend_kwargs=None, queue_size=10000):
+        self.queue_size = queue_size
+        self.store = store
+        self.normalize = normalize  # written by the pipeline, once all stages are done with a pdf
+        # checked once in the scan, rather than by every stage
+        self.preflight = Preflight() if preflight is True else preflight
+        self.stages = []
+        backend_kwargs = backend_kwargs or {}
+        for stage in stages:
+            backend, typ = stage[:2]
+            options = dict(stage[2]) if len(stage) > 2 else {}
+            if not isinstance(backend, Parser):
+                backend = Parser(backend, cache=cache, manifest=manifest, store=store, dedup=dedup,
+                                 **backend_kwargs.get(backend, {}))
+            backend.handler.get_services(typ)  # fail early on a type the backend cannot parse
+            self.stages.append((backend, typ, options))
+
+    def close(self):
+        for parser, _, _ in self.stages:
+            parser.close()
+
+    def _normalize(self, input_file, output_dir):
+        if self.store is not None:
+            results = self.store.get(doc_id(input_file))
+        else:
+            results = {}
+            for parser, _, _ in self.stages:
+                results.update(parser.handler._result_paths(input_file, output_dir))
+        self.normalize.add(input_file, results)
+
+    def _run_stage(self, parser, typ, files, output_dir, num_threads, options, results, on_done):
+        def drain():
+            while True:
+                file = files.get()
+                if file is _DONE:
+                    return
+                yield file
+
+        try:
+            results[(parser.backend, typ)] = parser.parse_files(typ, drain(), output_dir, num_threads,
+                                                                on_done=on_done, **options)
+        except Exception:
+            logger.exception(f'Stage {parser.backend}/{typ} failed, the other stages go on.')
+            results[(parser.backend, typ)] = None
+            # keep draining, so that the scan is never blocked by a dead stage
+            for _ in drain():
+                pass
+
+    def parse(self, input_path, output_dir, num_threads=0, recursive=False, **kwargs):
+        """Parse the pdfs with all stages, return the number parsed by each (backend, typ)"""
+        if not os.path.exists(input_path):
+            raise ValueError(f"input path is not valid: {input_path}")
+        os.makedirs(output_dir, exist_ok=True)
+
+        logger.info('Start parsing with %s', ', '.join(f'{parser.backend}/{typ}' for parser, typ, _ in self.stages))
+        staging = _SharedStaging(output_dir, len(self.stages))
+        results = {}
+        queues = []
+        threads = []
+        for index, (parser, typ, options) in enumerate(self.stages):
+            def on_done(input_file, ok, stage=index):
+                if staging.done(input_file, stage) and self.normalize is not None:
+                    self._normalize(input_file, output_dir)
+
+            parser.handler.staging = staging
+            options = dict(kwargs, **options)
+            stage_threads = options.pop('num_threads', num_threads)
+            files = queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self._run_stage, name=f'pipeline-{parser.backend}-{typ}',
+                                      args=(parser, typ, files, output_dir, stage_threads, options, results, on_done))
+            thread.start()
+            queues.append(files)
+            threads.append(thread)
+
+        pdf_files = [input_path] if os.path.isfile(input_path) else iter_pdf_files(input_path, recursive)
+        rejected = 0
+        try:
+            for file in pdf_files:
+                reason = self.preflight.check(file) if self.preflight is not None else None
+                if reason is not None:
+                    self.preflight.reject(output_dir, file, reason)
+                    rejected += 1
+                    continue
+                staging.add(file)
+                for files in queues:
+                    files.put(file)
+        finally:
+            for files in queues:
+                files.put(_DONE)
+            for thread in threads:
+                thread.join()
+            for parser, _, _ in self.stages:
+                parser.handler.staging = None
+            if self.normalize is not None:
+                # the pdfs which a stage never reported, e.g. a stage which failed, with the results of the others
+                for file in staging.pending():
+                    self._normalize(file, output_dir)
+                self.normalize.flush()
+            staging.close()
+        if rejected:
+            logger.info(f"{rejected} PDF files rejected by the pre-flight checks.")
+        logger.info("Finish.")
+        return results
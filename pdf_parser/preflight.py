@@ -0,0 +1,106 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+from .utils import page_count
+
+logger = logging.getLogger(__name__)
+
+REJECTS_FILENAME = '.pdf_parser.rejects.jsonl'
+
+_ENCRYPT_RE = re.compile(rb'/Encrypt\s*(?:\d+\s+\d+\s+R|<<)')
+_TRAILER_RE = re.compile(rb'trailer|startxref|/Type\s*/XRef\b')
+
+
+class Preflight:
+    """Cheap checks of a pdf, so that junk is rejected before it takes a JVM, a process or a server request.
+
+    Only the first and last `window` bytes are read: the header must be in the first kilobyte, the %%EOF
+    marker in the last one, and a trailer (or cross-reference stream) must be there. Encrypted files, files
+    whose page tree counts no page and, with `max_pages`, very long files are rejected too. With
+    `reject_image_only`, the whole file is scanned for fonts, and scanned papers without any text layer are
+    rejected, unless the fonts could be hidden in compressed object streams.
+
+    Rejected pdfs are appended to `.pdf_parser.rejects.jsonl` in the output dir with their reason.
+
+        parser = Parser('grobid', preflight=Preflight(max_pages=500))
+    """
+
+    def __init__(self, max_pages=None, reject_encrypted=True, reject_image_only=False, window=1 << 20):
+        self.max_pages = max_pages
+        self.reject_encrypted = reject_encrypted
+        self.reject_image_only = reject_image_only
+        self.window = window
+        self._lock = threading.Lock()
+
+    def _check(self, data, size, chunks):
+        """Reason to reject a pdf, or None. data is the whole pdf, or its first and last window"""
+        if size == 0:
+            return 'empty file'
+        head = data[:1024]
+        if b'%PDF-' not in head:
+            start = head.lstrip().lower()
+            if start.startswith((b'<!doctype html', b'<html')) or b'<html' in start:
+                return 'html, not a pdf'
+            return 'no pdf header'
+        if b'%%EOF' not in data[-1024:]:
+            return 'no %%EOF marker, truncated'
+        tail = data[-self.window:]
+        if not _TRAILER_RE.search(tail):
+            return 'no trailer'
+        if self.reject_encrypted and (_ENCRYPT_RE.search(tail) or _ENCRYPT_RE.search(data[:self.window])):
+            return 'encrypted'
+
+        n_pages = page_count(data)
+        if n_pages == 0:
+            return 'no pages'
+        if self.max_pages is not None and n_pages is not None and n_pages > self.max_pages:
+            return f'{n_pages} pages, more than {self.max_pages}'
+
+        if self.reject_image_only:
+            has_font = has_image = hidden = False
+            previous = b''
+            for chunk in chunks():
+                block = previous + chunk
+                has_font = has_font or b'/Font' in block
+                has_image = has_image or b'/Image' in block
+                hidden = hidden or b'/ObjStm' in block
+                if has_font or hidden:
+                    break
+                previous = chunk[-16:]  # a name split across two chunks
+            if has_image and not has_font and not hidden:
+                return 'images only, no text layer'
+        return None
+
+    def check(self, path):
+        """Reason to reject the pdf at path, or None if it may be parsed"""
+        try:
+            with open(path, 'rb') as fp:
+                size = os.fstat(fp.fileno()).st_size
+                if size <= 2 * self.window:
+                    data = fp.read()
+                else:
+                    data = fp.read(self.window)
+                    fp.seek(-self.window, os.SEEK_END)
+                    data += fp.read(self.window)
+
+                def chunks():
+                    fp.seek(0)
+                    return iter(lambda: fp.read(1 << 20), b'')
+
+                return self._check(data, size, chunks)
+        except OSError as e:
+            return f'unreadable: {e.strerror or e}'
+
+    def check_bytes(self, data):
+        """Reason to reject a pdf given as bytes, or None if it may be parsed"""
+        return self._check(data, len(data), lambda: [data])
+
+    def reject(self, output_dir, path, reason):
+        logger.info(f'Reject {path}: {reason}')
+        record = {'path': os.path.abspath(path), 'reason': reason, 'time': time.time()}
+        with self._lock, open(os.path.join(output_dir, REJECTS_FILENAME), 'a', encoding='utf-8') as fp:
+            fp.write(json.dumps(record) + '\n')
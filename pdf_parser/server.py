@@ -0,0 +1,391 @@
+import os
+import json
+import time
+import uuid
+import signal
+import zipfile
+import logging
+import argparse
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from .preflight import Preflight
+from .service import ParserService, INTERACTIVE, BULK
+from .store import doc_id
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    def __init__(self, kind, backend, typ, name, future):
+        self.id = uuid.uuid4().hex
+        self.kind = kind  # 'document' or 'bulk'
+        self.backend = backend
+        self.typ = typ
+        self.name = name
+        self.future = future
+        self.created = time.time()
+        self.finished = None
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        self.finished = time.time()
+
+    def status(self):
+        future = self.future
+        if future.cancelled():
+            status, error = 'cancelled', None
+        elif not future.done():
+            status, error = 'running' if future.running() else 'queued', None
+        elif future.exception() is not None:
+            status, error = 'failed', str(future.exception())
+        elif self.kind == 'document' and not future.result():
+            status, error = 'failed', 'not parsed'
+        else:
+            status, error = 'done', None
+        record = {'id': self.id, 'kind': self.kind, 'backend': self.backend, 'type': self.typ, 'name': self.name,
+                  'status': status, 'created': self.created, 'finished': self.finished}
+        if error is not None:
+            record['error'] = error
+        if status == 'done':
+            if self.kind == 'document':
+                record['results'] = sorted(future.result())
+            else:
+                record['count'] = future.result()
+        return record
+
+
+class _ChunkedWriter:
+    """File object over a response with chunked transfer encoding, so that a zip is sent while it is written"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, data):
+        if len(data):
+            self.wfile.write(b'%x\r\n' % len(data))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+        return len(data)
+
+    def flush(self):
+        self.wfile.flush()
+
+    def close(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+
+class _RequestError(Exception):
+    def __init__(self, code, message):
+        super(_RequestError, self).__init__(message)
+        self.code = code
+
+
+class ParserServer(ThreadingHTTPServer):
+    """HTTP front end of a ParserService, which keeps the backends, their health state and worker pools
+    resident between requests.
+
+    - POST /parse?backend=grobid&type=text parses the pdf in the request body, or at `path` on the server with
+      `allow_paths`, and sends its results back
+    - POST /jobs with the same parameters queues it and answers 202 with the job. With `path` a directory and
+      `output` an output dir on the server, the job is a bulk job of the whole directory
+    - GET /jobs/<id> is the status of a job, GET /jobs/<id>/result its results, DELETE /jobs/<id> cancels it
+    - GET /health answers 503 while a backend is down, for the health check of a load balancer, and
+      GET /metrics has the metrics of the service and of its parsers
+
+    Results are sent as a zip in the output dir layout, e.g. `paper.grobid.xml`, which is streamed while it
+    is written, or as the one file of `suffix`. Finished jobs are kept `job_ttl` seconds.
+
+        server = ParserServer(('0.0.0.0', 8080), ParserService({'grobid': {'host': 'server10', 'port': 8070}}))
+        server.serve_forever()
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, service, allow_paths=False, max_upload=256 << 20, job_ttl=3600):
+        super(ParserServer, self).__init__(address, _Handler)
+        self.service = service
+        self.allow_paths = allow_paths
+        self.max_upload = max_upload
+        self.job_ttl = job_ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def add_job(self, job):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, other in self._jobs.items()
+                       if other.finished is not None and other.finished < now - self.job_ttl]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._jobs[job.id] = job
+        return job
+
+    def job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None:
+            raise _RequestError(404, f'no job {job_id}')
+        return job
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def remove_job(self, job_id):
+        with self._lock:
+            return self._jobs.pop(job_id, None)
+
+    def health(self):
+        backends = {}
+        for backend, parser in self.service.interactive.items():
+            backends[backend] = {'interactive': bool(getattr(parser.handler, 'health', True)),
+                                 'bulk': bool(getattr(self.service.bulk[backend].handler, 'health', True))}
+        ok = all(all(lanes.values()) for lanes in backends.values())
+        return ok, {'ok': ok, 'backends': backends, 'latency_p99': self.service.latency(0.99)}
+
+    def metrics(self):
+        return {'service': self.service.metrics.snapshot(),
+                'interactive': {backend: parser.metrics.snapshot()
+                                for backend, parser in self.service.interactive.items()},
+                'bulk': {backend: parser.metrics.snapshot() for backend, parser in self.service.bulk.items()}}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'pdf_parser'
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+    def _send_json(self, code, record, headers=None):
+        body = json.dumps(record).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, routes):
+        url = urlsplit(self.path)
+        self.query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        try:
+            route = routes.get(tuple(parts[:1] + ['*'] * (len(parts) - 1)))
+            if route is None:
+                raise _RequestError(404, f'no such resource: {url.path}')
+            route(*parts[1:])
+        except _RequestError as e:
+            self._send_json(e.code, {'error': str(e)})
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logger.exception(f'{self.command} {self.path} failed')
+            self._send_json(500, {'error': str(e)})
+
+    def do_GET(self):
+        self._dispatch({('health',): self._health, ('metrics',): self._metrics, ('jobs',): self._list_jobs,
+                        ('jobs', '*'): self._status, ('jobs', '*', '*'): self._result})
+
+    def do_POST(self):
+        self._dispatch({('parse',): self._parse, ('jobs',): self._submit})
+
+    def do_DELETE(self):
+        self._dispatch({('jobs', '*'): self._cancel})
+
+    def _health(self):
+        ok, record = self.server.health()
+        self._send_json(200 if ok else 503, record)
+
+    def _metrics(self):
+        self._send_json(200, self.server.metrics())
+
+    def _list_jobs(self):
+        self._send_json(200, {'jobs': [job.status() for job in self.server.jobs()]})
+
+    def _status(self, job_id):
+        self._send_json(200, self.server.job(job_id).status())
+
+    def _read_body(self):
+        length = self.headers.get('Content-Length')
+        if length is None:
+            self.close_connection = True
+            raise _RequestError(411, 'send the pdf with a Content-Length, or its path')
+        length = int(length)
+        if length > self.server.max_upload:
+            # a client which is still sending would see a reset instead of the answer, so a body up to a few
+            # times the limit is read and dropped first
+            left = length if length <= 4 * self.server.max_upload else 0
+            while left > 0:
+                chunk = self.rfile.read(min(left, 1 << 20))
+                if not chunk:
+                    break
+                left -= len(chunk)
+            self.close_connection = True
+            raise _RequestError(413, f'pdf of {length} bytes, more than {self.server.max_upload}')
+        return self.rfile.read(length)
+
+    def _new_job(self, bulk=True):
+        backend = self.query.get('backend', 'grobid')
+        typ = self.query.get('type', 'text')
+        path = self.query.get('path')
+        service = self.server.service
+        if path is None:
+            data = self._read_body()
+            if not data:
+                raise _RequestError(400, 'empty request body')
+            name = os.path.basename(self.query.get('name', 'document.pdf'))
+            priority = int(self.query.get('priority', INTERACTIVE))
+            return _Job('document', backend, typ, name, service.submit(backend, typ, data, name, priority))
+
+        if self.headers.get('Content-Length', '0') != '0':
+            self.rfile.read(int(self.headers['Content-Length']))
+        if not self.server.allow_paths:
+            raise _RequestError(403, 'paths on the server are not allowed, send the pdf in the request body')
+        output = self.query.get('output')
+        if os.path.isdir(path) or output is not None:
+            if not bulk:
+                raise _RequestError(400, 'a directory or an output dir is a bulk job, queue it with POST /jobs')
+            if output is None:
+                raise _RequestError(400, 'a bulk job needs an output dir')
+            priority = int(self.query.get('priority', BULK))
+            num_threads = int(self.query.get('threads', 0))
+            recursive = self.query.get('recursive') in ('1', 'true')
+            future = service.submit_bulk(backend, typ, path, output, num_threads, priority, recursive)
+            return _Job('bulk', backend, typ, path, future)
+        if not os.path.isfile(path):
+            raise _RequestError(404, f'no pdf at {path}')
+        priority = int(self.query.get('priority', INTERACTIVE))
+        return _Job('document', backend, typ, os.path.basename(path), service.submit(backend, typ, path,
+                                                                                      priority=priority))
+
+    def _submit(self):
+        job = self.server.add_job(self._new_job())
+        self._send_json(202, job.status(), {'Location': f'/jobs/{job.id}'})
+
+    def _parse(self):
+        job = self._new_job(bulk=False)
+        timeout = float(self.query['timeout']) if 'timeout' in self.query else None
+        try:
+            job.future.exception(timeout)
+        except FutureTimeout:
+            # left running, its results can still be fetched
+            self.server.add_job(job)
+            self._send_json(504, dict(job.status(), error=f'not parsed within {timeout} seconds'),
+                            {'Location': f'/jobs/{job.id}'})
+            return
+        self._send_results(job)
+
+    def _result(self, job_id, resource):
+        if resource != 'result':
+            raise _RequestError(404, f'no such resource: {resource}')
+        job = self.server.job(job_id)
+        if job.kind == 'bulk':
+            raise _RequestError(409, 'the results of a bulk job are in its output dir')
+        if 'wait' in self.query:
+            try:
+                job.future.exception(float(self.query['wait']))
+            except FutureTimeout:
+                pass
+        if not job.future.done():
+            self._send_json(409, job.status())
+            return
+        self._send_results(job)
+
+    def _send_results(self, job):
+        if job.future.cancelled() or job.future.exception() is not None or not job.future.result():
+            self._send_json(422, job.status())
+            return
+        results = job.future.result()
+        suffix = self.query.get('suffix')
+        if suffix is not None:
+            if suffix not in results:
+                raise _RequestError(404, f'no {suffix} result, results: {", ".join(sorted(results))}')
+            results = {suffix: results[suffix]}
+            if not isinstance(results[suffix], dict):
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.send_header('Content-Length', str(len(results[suffix])))
+                self.end_headers()
+                self.wfile.write(results[suffix])
+                return
+
+        stem = doc_id(job.name)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', f'attachment; filename="{stem}.zip"')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        writer = _ChunkedWriter(self.wfile)
+        with zipfile.ZipFile(writer, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for suffix, data in results.items():
+                if isinstance(data, dict):
+                    for name, value in data.items():
+                        zf.writestr(f'{stem}{suffix}/{name}', value)
+                else:
+                    zf.writestr(stem + suffix, data)
+        writer.close()
+
+    def _cancel(self, job_id):
+        job = self.server.job(job_id)
+        cancelled = job.future.cancel()
+        if cancelled or job.future.done():
+            self.server.remove_job(job_id)
+        self._send_json(200 if cancelled or job.future.done() else 409, dict(job.status(), removed=job.future.done()))
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m pdf_parser serve',
+                                         description='Serve the parsers over HTTP, with resident backends.')
+    arg_parser.add_argument('-b', '--backends', default='grobid', help='Comma separated backends to serve. '
+                                                                       '(Default: grobid)')
+    arg_parser.add_argument('--backend-kwargs', default='{}',
+                            help='Parser kwargs by backend as JSON, e.g. \'{"grobid": {"host": "server10", "port": 8070}}\'.')
+    arg_parser.add_argument('--host', default='127.0.0.1', help='Address to listen on. (Default: 127.0.0.1)')
+    arg_parser.add_argument('--port', type=int, default=8080, help='Port to listen on. (Default: 8080)')
+    arg_parser.add_argument('--reserved', type=int, default=4,
+                            help='Threads of the interactive lane of each backend. (Default: 4)')
+    arg_parser.add_argument('--allow-paths', action='store_true',
+                            help='Also parse PDF files and directories given by their path on the server.')
+    arg_parser.add_argument('--max-upload', type=int, default=256,
+                            help='Max size of an uploaded PDF file in MB. (Default: 256)')
+    arg_parser.add_argument('--job-ttl', type=float, default=3600,
+                            help='Seconds a finished job and its results are kept. (Default: 3600)')
+    arg_parser.add_argument('--preflight', action='store_true',
+                            help='Reject empty, truncated, encrypted and non-PDF files before they reach the backend.')
+    arg_parser.add_argument('--max-pages', type=int, default=None,
+                            help='With --preflight, also reject PDF files with more pages. (Default: no limit)')
+    arg_parser.add_argument('--manifest', action='store_true',
+                            help='Keep a job manifest in the output dir of each bulk job, so that a bulk job stopped '
+                                 'by a shutdown resumes when it is queued again.')
+
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    backend_kwargs = json.loads(args.backend_kwargs)
+    backends = {backend: backend_kwargs.get(backend, {}) for backend in args.backends.split(',')}
+    parser_options, interactive_kwargs = {}, {}
+    if args.manifest:
+        parser_options['manifest'] = True
+    if args.preflight:
+        preflight = Preflight(max_pages=args.max_pages)
+        parser_options['preflight'] = preflight
+        interactive_kwargs = {backend: {'preflight': preflight} for backend in backends}
+
+    service = ParserService(backends, args.reserved, interactive_kwargs, parser_options)
+    server = ParserServer((args.host, args.port), service, args.allow_paths, args.max_upload << 20, args.job_ttl)
+    # shutdown waits for serve_forever, so it must not run in the thread which serves. A running bulk job is
+    # cancelled rather than waited for, it stops once the pdfs it started are done
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    logger.info(f'Serving {", ".join(backends)} on http://{args.host}:{server.server_port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close(cancel_bulk=True)
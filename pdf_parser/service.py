@@ -0,0 +1,221 @@
+import os
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from itertools import count
+from concurrent.futures import Future
+
+from .metrics import Metrics
+from .parser import Parser
+from .utils import iter_pdf_files
+
+logger = logging.getLogger(__name__)
+
+# priority classes, a lower value is served first
+INTERACTIVE = 0
+BULK = 10
+
+_STOP = float('inf')
+
+
+class ParserService:
+    """Long-running parsers which serve interactive single-paper requests next to bulk jobs.
+
+    Every backend has two warm Parsers, so that the two lanes never share a JVM pool or a connection pool:
+    - the interactive lane has `reserved` threads of its own, and its own handler, e.g. with resident JVMs
+      (`interactive_kwargs`, default jvm_workers=reserved for cermine and pdffigures2). Requests are served by
+      priority, then in order.
+    - the bulk lane runs one bulk job at a time, by priority, through Parser.parse_files with all of the
+      backend's usual concurrency and batching.
+
+    While interactive requests are queued or parsing, the bulk lane starts no new request or batch (`pause_bulk`),
+    so that the GROBID servers or the cpus which it shares with the interactive lane are left to them. Requests
+    and batches already running still finish, so the num_threads of a bulk job should leave room for `reserved`
+    requests on the servers.
+
+        service = ParserService({'grobid': {'host': 'server10', 'port': 8070}}, reserved=4)
+        service.submit_bulk('grobid', 'text', '/path/to/pdf_dir', '/path/to/output')
+        results = service.parse('grobid', 'text', '/path/to/xxx.pdf', timeout=30)
+        service.close()
+    """
+
+    def __init__(self, backends, reserved=4, interactive_kwargs=None, parser_options=None, pause_bulk=True,
+                 latency_window=10000):
+        self.reserved = reserved
+        self.pause_bulk = pause_bulk
+        self.metrics = Metrics('ParserService')
+
+        interactive_kwargs = interactive_kwargs or {}
+        parser_options = parser_options or {}
+        self.interactive = {}
+        self.bulk = {}
+        for backend, kwargs in backends.items():
+            lane_kwargs = dict(kwargs)
+            if backend in ('cermine', 'pdffigures2'):
+                lane_kwargs.setdefault('jvm_workers', reserved)  # no JVM startup per interactive request
+            lane_kwargs.update(interactive_kwargs.get(backend, {}))
+            self.interactive[backend] = Parser(backend, **lane_kwargs)
+            self.bulk[backend] = Parser(backend, **parser_options, **kwargs)
+            if pause_bulk:
+                self.bulk[backend].handler.gate = self._bulk_gate
+
+        self._seq = count()
+        self._requests = queue.PriorityQueue()
+        self._jobs = queue.PriorityQueue()
+        self._cond = threading.Condition()
+        self._backlog = 0  # interactive requests not started yet
+        self._active = 0  # interactive requests queued or parsing
+        self._latencies = deque(maxlen=latency_window)
+        self._stopping = threading.Event()  # set by close(cancel_bulk=True), the running bulk job takes no new pdf
+
+        self._threads = [threading.Thread(target=self._serve, name=f'interactive-{i}', daemon=True)
+                         for i in range(reserved)]
+        self._threads.append(threading.Thread(target=self._run_bulk, name='bulk', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def _parser(self, lane, backend):
+        parser = lane.get(backend)
+        if parser is None:
+            raise ValueError(f'backend is not served: {backend}')
+        return parser
+
+    def submit(self, backend, typ, document, name=None, priority=INTERACTIVE, **kwargs):
+        """Queue one pdf, given as a path, bytes or a binary file object, return a Future of its results as
+        returned by Parser.parse_bytes"""
+        parser = self._parser(self.interactive, backend)
+        parser.handler.get_services(typ)
+        if isinstance(document, str):
+            name = name or os.path.basename(document)
+            with open(document, 'rb') as fp:
+                document = fp.read()
+        future = Future()
+        with self._cond:
+            self._backlog += 1
+            self._active += 1
+            self.metrics.set('interactive_backlog', self._backlog)
+        self._requests.put((priority, next(self._seq), (future, parser, typ, document, name or 'document.pdf',
+                                                         kwargs, time.perf_counter())))
+        return future
+
+    def parse(self, backend, typ, document, name=None, priority=INTERACTIVE, timeout=None, **kwargs):
+        """Parse one pdf in the interactive lane and wait for its results"""
+        return self.submit(backend, typ, document, name, priority, **kwargs).result(timeout)
+
+    def _serve(self):
+        while True:
+            _, _, request = self._requests.get()
+            if request is None:
+                return
+            future, parser, typ, document, name, kwargs, enqueued = request
+            with self._cond:
+                self._backlog -= 1
+                self.metrics.set('interactive_backlog', self._backlog)
+            if not future.set_running_or_notify_cancel():
+                self._done()
+                continue
+            self.metrics.observe('interactive_wait', time.perf_counter() - enqueued)
+            try:
+                with self.metrics.timer('interactive_parse'):
+                    future.set_result(parser.parse_bytes(typ, document, name, **kwargs))
+            except Exception as e:
+                logger.exception(f'Interactive request for {name} failed')
+                future.set_exception(e)
+            latency = time.perf_counter() - enqueued
+            self.metrics.observe('interactive', latency)
+            self._done(latency)
+
+    def _done(self, latency=None):
+        with self._cond:
+            self._active -= 1
+            if latency is not None:
+                self._latencies.append(latency)
+            self._cond.notify_all()
+
+    def submit_bulk(self, backend, typ, pdf_files, output_dir, num_threads=0, priority=BULK, recursive=False,
+                    **kwargs):
+        """Queue a bulk job over a directory or an iterable of pdf files, return a Future of the number parsed.
+        Bulk jobs run one at a time, by priority, then in order."""
+        parser = self._parser(self.bulk, backend)
+        parser.handler.get_services(typ)
+        future = Future()
+        self._jobs.put((priority, next(self._seq), (future, parser, typ, pdf_files, output_dir, num_threads,
+                                                     recursive, kwargs)))
+        self.metrics.add('bulk_jobs', 1)
+        return future
+
+    @contextmanager
+    def _bulk_gate(self):
+        """Entered by the bulk backends before each request or batch, held back while interactive requests are
+        queued or parsing"""
+        with self._cond:
+            if self._active:
+                self.metrics.inc('bulk_pauses')
+            self._cond.wait_for(lambda: self._active == 0)
+        yield
+
+    def _run_bulk(self):
+        while True:
+            _, _, job = self._jobs.get()
+            if job is None:
+                return
+            future, parser, typ, pdf_files, output_dir, num_threads, recursive, kwargs = job
+            if future.set_running_or_notify_cancel():
+                if isinstance(pdf_files, str):
+                    pdf_files = [pdf_files] if os.path.isfile(pdf_files) else iter_pdf_files(pdf_files, recursive)
+                pdf_files = self._until_stopped(pdf_files)
+                logger.info(f'Start bulk job of {parser.backend}/{typ} into {output_dir}.')
+                try:
+                    future.set_result(parser.parse_files(typ, pdf_files, output_dir, num_threads, **kwargs))
+                except Exception as e:
+                    logger.exception(f'Bulk job into {output_dir} failed')
+                    future.set_exception(e)
+            self.metrics.add('bulk_jobs', -1)
+
+    def _until_stopped(self, pdf_files):
+        for file in pdf_files:
+            if self._stopping.is_set():
+                logger.info('Bulk job stopped, it takes no new pdf.')
+                return
+            yield file
+
+    def latency(self, q=0.99):
+        """Quantile of the end-to-end seconds of the recent interactive requests, waiting included"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def close(self, cancel_bulk=False):
+        """Stop once the queued interactive requests and the running bulk job are done, drop the queued bulk jobs.
+
+        With cancel_bulk, the running bulk job takes no new pdf either, and stops once the pdfs and batches it
+        started are done, its Future gets the number parsed so far. With a manifest, submitting it again resumes it.
+        """
+        if cancel_bulk:
+            self._stopping.set()
+        while True:
+            try:
+                _, _, job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[0].cancel()
+                self.metrics.add('bulk_jobs', -1)
+        for _ in range(self.reserved):
+            self._requests.put((_STOP, next(self._seq), None))
+        self._jobs.put((_STOP, next(self._seq), None))
+        for thread in self._threads:
+            thread.join()
+        for parser in list(self.interactive.values()) + list(self.bulk.values()):
+            parser.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,277 @@
+import os
+import re
+import time
+import zlib
+import struct
+import sqlite3
+import zipfile
+import logging
+import argparse
+import threading
+
+from .utils import remove_path
+
+logger = logging.getLogger(__name__)
+
+# already compressed, deflating them again only costs cpu
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.gz', '.zip'}
+
+_SHARD_RE = re.compile(r'shard-(\d+)\.zip$')
+
+# local file header of a zip member (APPNOTE 4.3.7): signature, version, flags, method, time, date, crc-32,
+# compressed size, uncompressed size, file name length, extra field length
+_LOCAL_HEADER = struct.Struct('<4s5H3L2H')
+_LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+
+def doc_id(input_file):
+    """Id of a pdf in the store, the file name without extension as in the output dir layout"""
+    return os.path.splitext(os.path.basename(input_file))[0]
+
+
+class ResultStore:
+    """Parse results appended into a few large zip shards instead of millions of small files.
+
+    Every artifact of the output dir layout, e.g. `paper.grobid.xml` or
+    `paper.pdffigures.figure/figure-data.json`, is a member of the shard being written, which is
+    closed and replaced by a new one once it holds `shard_bytes`. A SQLite index maps each pdf id
+    to the offsets of its members, so that a document is read with one seek into its shard, also
+    while the shard is still being written. Shards are plain zip files, and `export` writes them
+    back out as the usual output dir layout.
+
+        store = ResultStore('/path/to/store')
+        parser = Parser('pdffigures2', store=store)
+        parser.parse('figure', '/path/to/pdf_dir', '/path/to/scratch')
+        store.get('paper')  # {'.pdffigures2.figure': {'figure-data.json': b'...', 'Figure1.png': b'...'}}
+    """
+
+    INDEX = 'index.sqlite'
+
+    def __init__(self, store_dir, shard_bytes=1 << 30, commit_every=100):
+        self.store_dir = store_dir
+        self.shard_bytes = shard_bytes
+        self.commit_every = commit_every
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(os.path.join(self.store_dir, self.INDEX), check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS members (
+                doc_id TEXT NOT NULL,
+                member TEXT NOT NULL,
+                suffix TEXT NOT NULL,
+                shard INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                compress_type INTEGER NOT NULL,
+                compress_size INTEGER NOT NULL,
+                file_size INTEGER NOT NULL,
+                updated REAL,
+                PRIMARY KEY (doc_id, member)
+            )''')
+        self._conn.commit()
+
+        # a shard left open by a crash has no central directory, but its members are still readable
+        # through the index, so writing always goes on in a new shard
+        shards = [int(m.group(1)) for m in map(_SHARD_RE.match, os.listdir(self.store_dir)) if m]
+        self._shard = max(shards, default=-1)
+        self._zip = None
+        self._readers = {}  # shard -> file object, kept open for random access
+
+    def _shard_path(self, shard):
+        return os.path.join(self.store_dir, f'shard-{shard:05d}.zip')
+
+    def _writer(self):
+        # caller must hold self._lock
+        if self._zip is not None and self._zip.fp.tell() >= self.shard_bytes:
+            self._close_shard()
+        if self._zip is None:
+            self._shard += 1
+            self._zip = zipfile.ZipFile(open(self._shard_path(self._shard), 'w+b'), 'w')
+            logger.debug(f'Start shard {self._shard_path(self._shard)}')
+        return self._zip
+
+    def _close_shard(self):
+        # caller must hold self._lock
+        fp = self._zip.fp
+        self._zip.close()
+        fp.close()
+        self._zip = None
+        reader = self._readers.pop(self._shard, None)
+        if reader is not None:
+            reader.close()
+
+    def _write(self, doc, suffix, members):
+        """Append the members ({member: bytes}) of one result of a pdf, replacing its previous ones"""
+        now = time.time()
+        with self._lock:
+            writer = self._writer()
+            rows = []
+            for member, data in members.items():
+                info = zipfile.ZipInfo(member, time.localtime(now)[:6])
+                stored = os.path.splitext(member)[1].lower() in STORED_EXTENSIONS
+                info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+                writer.writestr(info, data)
+                rows.append((doc, member, suffix, self._shard, info.header_offset, info.compress_type,
+                             info.compress_size, info.file_size, now))
+            writer.fp.flush()
+            self._conn.execute('DELETE FROM members WHERE doc_id = ? AND suffix = ?', (doc, suffix))
+            self._conn.executemany('INSERT OR REPLACE INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def put(self, doc, results):
+        """Store results as returned by Parser.parse_bytes, {suffix: bytes} or {suffix: {file name: bytes}}"""
+        for suffix, data in results.items():
+            if isinstance(data, dict):
+                self._write(doc, suffix, {f'{doc}{suffix}/{name}': value for name, value in data.items()})
+            else:
+                self._write(doc, suffix, {doc + suffix: data})
+
+    def add(self, input_file, result_paths, remove=True):
+        """Move the existing ones of `result_paths` ({suffix: path}) of a parsed pdf into the store"""
+        doc = doc_id(input_file)
+        added = False
+        for suffix, path in result_paths.items():
+            members = {}
+            name = os.path.basename(path)
+            if os.path.isfile(path):
+                with open(path, 'rb') as fp:
+                    members[name] = fp.read()
+            elif os.path.isdir(path):
+                for entry in os.scandir(path):
+                    with open(entry.path, 'rb') as fp:
+                        members[f'{name}/{entry.name}'] = fp.read()
+            else:
+                continue
+            self._write(doc, suffix, members)
+            added = True
+            if remove:
+                remove_path(path)
+        return added
+
+    def copy(self, src, dst):
+        """Index the results of pdf `src` also under `dst`, e.g. a duplicate, without writing them again"""
+        with self._lock:
+            rows = self._conn.execute('SELECT * FROM members WHERE doc_id = ?', (src,)).fetchall()
+            if not rows:
+                return False
+            now = time.time()
+            self._conn.execute('DELETE FROM members WHERE doc_id = ?', (dst,))
+            self._conn.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+                (dst, dst + member[len(src):] if member.startswith(src) else member, *location, now)
+                for _, member, *location, _ in rows])
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every:
+                self._conn.commit()
+                self._uncommitted = 0
+        return True
+
+    def _rows(self, doc, suffixes=None):
+        query = 'SELECT member, suffix, shard, offset, compress_type, compress_size FROM members WHERE doc_id = ?'
+        with self._lock:
+            rows = self._conn.execute(query, (doc,)).fetchall()
+        return [row for row in rows if suffixes is None or row[1] in suffixes]
+
+    def has(self, doc, suffixes=None):
+        """Whether the store holds results of a pdf, or any of its results with one of `suffixes`"""
+        return bool(self._rows(doc, suffixes))
+
+    def __contains__(self, doc):
+        return self.has(doc)
+
+    def _read(self, shard, offset, compress_type, compress_size):
+        with self._lock:
+            fp = self._readers.get(shard)
+            if fp is None:
+                fp = self._readers[shard] = open(self._shard_path(shard), 'rb')
+            fp.seek(offset)
+            header = _LOCAL_HEADER.unpack(fp.read(_LOCAL_HEADER.size))
+            if header[0] != _LOCAL_HEADER_SIGNATURE:
+                raise ValueError(f'no zip member at offset {offset} of {self._shard_path(shard)}')
+            # the data follows the local header, its name and its extra field
+            fp.seek(header[-2] + header[-1], os.SEEK_CUR)
+            data = fp.read(compress_size)
+        if compress_type == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(data, -zlib.MAX_WBITS)
+        return data
+
+    def read(self, doc, member):
+        """Content of one member of a pdf, e.g. read('paper', 'paper.pdffigures.figure/figure-data.json')"""
+        for row in self._rows(doc):
+            if row[0] == member:
+                return self._read(*row[2:])
+        raise KeyError(f'{doc}: {member}')
+
+    def get(self, doc, suffixes=None):
+        """Results of a pdf in the shape of Parser.parse_bytes, {} if the store has none"""
+        results = {}
+        for member, suffix, *location in self._rows(doc, suffixes):
+            data = self._read(*location)
+            if '/' in member:
+                results.setdefault(suffix, {})[member.split('/', 1)[1]] = data
+            else:
+                results[suffix] = data
+        return results
+
+    def ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT DISTINCT doc_id FROM members ORDER BY doc_id')]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(DISTINCT doc_id) FROM members').fetchone()[0]
+
+    def export(self, output_dir, docs=None):
+        """Write the results of `docs` (default: all) back out in the output dir layout, return the pdf count"""
+        count = 0
+        for doc in (self.ids() if docs is None else docs):
+            rows = self._rows(doc)
+            for member, _, *location in rows:
+                path = os.path.join(output_dir, *member.split('/'))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as fp:
+                    fp.write(self._read(*location))
+            count += bool(rows)
+        return count
+
+    def flush(self):
+        with self._lock:
+            if self._zip is not None:
+                self._zip.fp.flush()
+            self._conn.commit()
+            self._uncommitted = 0
+
+    def close(self):
+        with self._lock:
+            if self._zip is not None:
+                self._close_shard()
+            for fp in self._readers.values():
+                fp.close()
+            self._readers.clear()
+            self._conn.commit()
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def main(argv=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m pdf_parser export',
+                                         description='Write the results in a result store out as an output directory.')
+    arg_parser.add_argument('store', help='Directory of the result store')
+    arg_parser.add_argument('output_path', help='Output directory')
+    arg_parser.add_argument('ids', nargs='*', help='Ids of the PDF files to export, i.e. their names without '
+                                                   'extension. (Default: all)')
+
+    args = arg_parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    with ResultStore(args.store) as store:
+        count = store.export(args.output_path, args.ids or None)
+    logger.info(f'Results of {count} PDF files exported to {args.output_path}.')
@@ -0,0 +1,274 @@
+import os
+import re
+import errno
+import shutil
+import hashlib
+import logging
+import tempfile
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, wait, as_completed
+
+try:
+    import fcntl
+except ImportError:  # not available on windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+FICLONE = 0x40049409  # ioctl of linux to clone a file on copy-on-write filesystems (btrfs, xfs)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_PAGES_COUNT_RE = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+_PAGE_RE = re.compile(rb'/Type\s*/Page\b')
+BYTES_PER_PAGE = 100 * 1024  # rough size of one page, used when the page count cannot be read
+
+
+def pdf_page_count(path, window=1 << 20):
+    """Cheap page count from the page tree, reading at most the first and last `window` bytes, or None"""
+    try:
+        with open(path, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size <= 2 * window:
+                data = fp.read()
+            else:
+                data = fp.read(window)
+                fp.seek(-window, os.SEEK_END)
+                data += fp.read(window)
+    except OSError:
+        return None
+    return page_count(data)
+
+
+def page_count(data):
+    """Page count from the page tree found in some bytes of a pdf, or None"""
+    counts = [int(a or b) for a, b in _PAGES_COUNT_RE.findall(data)]
+    if counts:
+        return max(counts)  # the root of the page tree counts all pages
+    n_pages = len(_PAGE_RE.findall(data))
+    return n_pages or None
+
+
+def estimate_pages(path):
+    """Page count of a pdf, estimated from its size if the page tree is not readable (e.g. object streams)"""
+    n_pages = pdf_page_count(path)
+    if n_pages is None:
+        try:
+            n_pages = max(1, os.path.getsize(path) // BYTES_PER_PAGE)
+        except OSError:
+            n_pages = 1
+    return n_pages
+
+
+def pdf_cost(path, schedule='size'):
+    """Estimated cost of a pdf in pages, from the file size only ('size') or from the page tree ('pages')"""
+    if schedule == 'pages':
+        return estimate_pages(path)
+    try:
+        return max(1, os.path.getsize(path) // BYTES_PER_PAGE)
+    except OSError:
+        return 1
+
+
+def longest_first(pdf_files, schedule='size', window=10000):
+    """Yield (pdf, cost) with the costliest pdfs first, so that giant documents do not start last.
+
+    Pdfs are sorted within consecutive windows of `window` files, so that a lazy scan stays bounded,
+    or all at once if window is None. Nothing is yielded before the first window is read, so the window
+    should only be a few times the number of workers. With schedule None, pdfs keep their order and their
+    cost is None. 'pages' reads up to 2 MB of every pdf, which is slow on a cold or network filesystem,
+    where 'size' takes one stat per pdf.
+    """
+    if schedule is None:
+        for input_file in pdf_files:
+            yield input_file, None
+        return
+    if schedule not in ('size', 'pages'):
+        raise ValueError(f'schedule is not valid: {schedule}')
+
+    pdf_files = iter(pdf_files)
+    while True:
+        chunk = [(input_file, pdf_cost(input_file, schedule)) for input_file in islice(pdf_files, window)]
+        if not chunk:
+            return
+        chunk.sort(key=lambda item: item[1], reverse=True)
+        yield from chunk
+        if window is None:
+            return
+
+
+def pack_batches(scheduled_files, batch_size, batch_pages=None):
+    """Group (pdf, cost) pairs into batches of at most batch_size files and about batch_pages pages.
+
+    A pdf which alone reaches batch_pages is run in a batch of its own, so that one huge document
+    does not hold back a whole batch of small ones. A cost of None is estimated from the page tree.
+    """
+    batch, n_batch_pages = [], 0
+    for input_file, n_pages in scheduled_files:
+        if batch_pages is not None:
+            if n_pages is None:
+                n_pages = estimate_pages(input_file)
+            if n_pages >= batch_pages:
+                yield [input_file]
+                continue
+            if batch and n_batch_pages + n_pages > batch_pages:
+                yield batch
+                batch, n_batch_pages = [], 0
+            n_batch_pages += n_pages
+        batch.append(input_file)
+        if len(batch) >= batch_size:
+            yield batch
+            batch, n_batch_pages = [], 0
+    if batch:
+        yield batch
+
+
+def _clone_file(src, dst):
+    """Copy src to dst, by a copy-on-write reflink or an in-kernel copy_file_range when supported.
+
+    An existing dst is never written through, it may be a hardlink to an input pdf: FileExistsError is raised.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'xb') as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        if hasattr(os, 'copy_file_range'):
+            try:
+                remaining = os.fstat(fsrc.fileno()).st_size
+                while remaining > 0:
+                    n_copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                    if n_copied == 0:
+                        break
+                    remaining -= n_copied
+                return
+            except OSError:
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+def link_or_copy(src, dst, symlink=False):
+    """Hardlink src to dst, fall back to a symlink if allowed, then to a reflink or in-kernel copy, then a plain copy.
+    dst must not exist."""
+    try:
+        os.link(src, dst)
+        return
+    except OSError:
+        pass
+    if symlink:
+        try:
+            os.symlink(os.path.abspath(src), dst)
+            return
+        except OSError:
+            pass
+    _clone_file(src, dst)
+
+
+def replace_path(src, dst):
+    """Move src to dst, atomically by rename when both are on the same device, replacing an existing dst"""
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
+def write_file(path, data):
+    """Write data (bytes) to path by a rename of a sibling temp file, so that a reader never sees half of it, and an
+    existing path, which may be a hardlink into the result cache, is replaced rather than written through"""
+    fd, tmp_path = tempfile.mkstemp(prefix='.%s.' % os.path.basename(path), suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        remove_path(tmp_path)
+        raise
+
+
+def link_or_copy_tree(src, dst):
+    if os.path.isdir(src):
+        shutil.copytree(src, dst, copy_function=link_or_copy)
+    else:
+        link_or_copy(src, dst)
+
+
+def path_size(path):
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            size += os.path.getsize(os.path.join(root, name))
+    return size
+
+
+def remove_path(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def iter_pdf_files(input_dir, recursive=False):
+    """Lazily yield the pdf files in input_dir, optionally descending into sub directories"""
+    dirs = [input_dir]
+    while dirs:
+        try:
+            it = os.scandir(dirs.pop())
+        except OSError as e:
+            logger.warning('Could not scan directory: %s', str(e))
+            continue
+        with it:
+            for entry in it:
+                if entry.name.endswith('.pdf') and entry.is_file():
+                    yield entry.path
+                elif recursive and entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.pdf_parser-tmp-'):
+                    dirs.append(entry.path)
+
+
+def batched(iterable, size):
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+def bounded_as_completed(executor, fn, iterable, max_pending, metrics=None):
+    """Submit fn(item) for each item while keeping at most max_pending futures in flight, yield them as completed.
+
+    If metrics is given, its 'queue_depth' gauge follows the number of submitted and unfinished items.
+    """
+    pending = set()
+    for item in iterable:
+        if len(pending) >= max_pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if metrics is not None:
+                metrics.set('queue_depth', len(pending))
+            yield from done
+        pending.add(executor.submit(fn, item))
+        if metrics is not None:
+            metrics.set('queue_depth', len(pending))
+    for future in as_completed(pending):
+        if metrics is not None:
+            metrics.add('queue_depth', -1)
+        yield future
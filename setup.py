@@ -29,11 +29,14 @@ setup(
             "bin/pdffigures",
             "jar/cermine-1.13.jar",
             "jar/pdffigures2-0.1.0.jar",
+            "java/PdfParserWorker.java",
         ],
     },
     install_requires=[
         'requests>=2.23.0',
-        'science-parse-api>=1.0.1'
     ],
+    extras_require={
+        'async': ['aiohttp>=3.6.0'],
+    },
     cmdclass={'install': OverrideInstall}
 )
@@ -0,0 +1,88 @@
+import os
+import json
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from pdf_parser import parser as parser_module
+from pdf_parser.backends.pdffigures import PDFFigures
+
+
+class FakeBackend(PDFFigures):
+    """Backend 'fake', type 'figure': writes <name>.pdffigures.figure/figure-data.json, one figure captioned with
+    the pdf name"""
+
+    healthy = True
+    created = 0
+    parsed = []
+    sources = []  # the paths the pdfs were read from
+    fail = set()
+
+    def _check_bin(self):
+        FakeBackend.created += 1
+        self.health = FakeBackend.healthy
+
+    def _process_pdf(self, input_file, output_dir, services, **kwargs):
+        start = time.time()
+        name = os.path.basename(input_file)
+        FakeBackend.parsed.append(name)
+        FakeBackend.sources.append(self._source(input_file))
+        if name in FakeBackend.fail:
+            self._report(input_file, False, start, 'failed')
+            return 0
+        result_dir = os.path.join(output_dir, os.path.splitext(name)[0] + '.pdffigures.figure')
+        os.makedirs(result_dir, exist_ok=True)
+        with open(os.path.join(result_dir, 'figure-data.json'), 'w') as fp:
+            json.dump([{'Type': 'Figure', 'Number': 1, 'Caption': name}], fp)
+        self._report(input_file, True, start)
+        return 1
+
+
+@pytest.fixture
+def fake_backend(monkeypatch):
+    monkeypatch.setitem(parser_module.parser_backend, 'fake', FakeBackend)
+    monkeypatch.setattr(FakeBackend, 'healthy', True)
+    monkeypatch.setattr(FakeBackend, 'created', 0)
+    monkeypatch.setattr(FakeBackend, 'parsed', [])
+    monkeypatch.setattr(FakeBackend, 'sources', [])
+    monkeypatch.setattr(FakeBackend, 'fail', set())
+    return FakeBackend
+
+
+class _CrashingHandler(BaseHTTPRequestHandler):
+    """Reads the pdf, then drops the connection without an answer, as a server which crashed on it"""
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.close_connection = True
+
+
+@pytest.fixture
+def crashing_server():
+    """Port of a local server which drops every request once it has read the pdf"""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), _CrashingHandler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield httpd.server_port
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def closed_port():
+    """A local port which refuses connections"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
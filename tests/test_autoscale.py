@@ -0,0 +1,56 @@
+import pytest
+
+from pdf_parser import autoscale
+from pdf_parser.autoscale import GB, AutoScaler
+from pdf_parser.metrics import Metrics
+
+
+@pytest.fixture
+def host(monkeypatch):
+    """A host of 4 cpus, whose cpu times, memory and child RSS are set by the test"""
+    state = {'cpu': (0, 0), 'available': 100 * GB, 'rss': 0}
+    monkeypatch.setattr(autoscale, 'cpu_count', lambda: 4)
+    monkeypatch.setattr(autoscale, 'mem_available', lambda: state['available'])
+    monkeypatch.setattr(autoscale, 'child_rss', lambda pid=None: state['rss'])
+    monkeypatch.setattr(autoscale, '_cpu_times', lambda: state['cpu'])
+    return state
+
+
+def test_processes_follow_the_cpus(host):
+    scaler = AutoScaler.for_processes(cpu_per_worker=1, mem_per_worker=GB)
+    assert (scaler.maximum, scaler.limit) == (8, 4)
+
+    host['cpu'] = (100, 50)  # half busy
+    assert scaler.adjust() == 4  # not grown while the workers do not use all slots
+    scaler.active = 4
+    host['cpu'] = (200, 100)
+    assert scaler.adjust() == 5
+    host['cpu'] = (300, 100)  # saturated
+    assert scaler.adjust() == 4
+
+
+def test_processes_fit_in_the_memory(host):
+    scaler = AutoScaler.for_processes(cpu_per_worker=1, mem_per_worker=GB // 2, options={'initial': 8})
+    assert scaler.limit == 8
+    scaler.active = 4
+    host['rss'] = 4 * GB  # 1 GB per running worker, measured
+    host['available'] = 2 * GB  # room for one more above the 1 GB reserve
+    assert scaler.adjust() == 5
+    host['available'] = GB // 2  # under the reserve, fewer than the running ones fit
+    assert scaler.adjust() == 3
+
+
+def test_requests_back_off_once_the_server_queues(host):
+    metrics = Metrics('Grobid')
+    scaler = AutoScaler.for_requests(metrics, maximum=64)
+    assert scaler.limit == 16
+    scaler.active = 16
+    metrics.observe('http', 1.0)
+    assert scaler.adjust() == 16  # the first sample only sets the mark
+    metrics.observe('http', 1.0)
+    assert scaler.adjust() == 18
+    metrics.observe('http', 1.5)
+    assert scaler.adjust() == 18  # slower, yet not queueing
+    metrics.observe('http', 3.0)
+    assert scaler.adjust() == 14
+    assert metrics.snapshot()['gauges']['concurrency_limit'] == 14
@@ -0,0 +1,59 @@
+import pytest
+
+from pdf_parser.backends.balancer import EndpointBalancer
+from pdf_parser.benchmark import StubServer
+
+
+def _balancer(policy, latencies):
+    balancer = EndpointBalancer([f'http://server{i}' for i in range(len(latencies))], policy=policy)
+    for endpoint, latency in zip(balancer.endpoints, latencies):
+        endpoint.healthy = True
+        endpoint.latency = latency
+    return balancer
+
+
+def _urls(endpoints):
+    return [endpoint.url for endpoint in endpoints]
+
+
+def test_least_outstanding_spreads_requests():
+    balancer = _balancer('least_outstanding', [2.0, 1.0])
+    # ties are broken by latency, then the fewest requests in flight win
+    assert _urls(balancer.acquire() for _ in range(4)) == ['http://server1', 'http://server0'] * 2
+
+
+def test_latency_policy_weighs_the_queue_by_the_latency():
+    balancer = _balancer('latency', [3.0, 1.0])
+    # expected waits of server1 then server0: 1 < 3, 2 < 3, 3 = 3 won by fewer in flight, 3 < 6
+    assert _urls(balancer.acquire() for _ in range(4)) == ['http://server1'] * 2 + ['http://server0', 'http://server1']
+
+
+def test_latency_is_a_moving_average():
+    balancer = _balancer('least_outstanding', [None])
+    endpoint = balancer.acquire()
+    balancer.release(endpoint, 1.0)
+    assert endpoint.latency == 1.0
+    balancer.release(balancer.acquire(), 2.0)
+    assert endpoint.latency == pytest.approx(1.2) and endpoint.outstanding == 0
+
+
+def test_failed_endpoint_leaves_rotation():
+    balancer = _balancer('least_outstanding', [1.0, 2.0])
+    balancer.release(balancer.acquire(), failed=True)
+    assert [endpoint.healthy for endpoint in balancer.endpoints] == [False, True]
+    assert _urls(balancer.acquire() for _ in range(2)) == ['http://server1'] * 2
+    balancer.release(balancer.endpoints[1], failed=True)
+    assert balancer.acquire() is None and not balancer.healthy()
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        EndpointBalancer(['http://server0'], policy='round_robin')
+
+
+def test_health_check_puts_a_server_back_in_rotation():
+    with StubServer() as server:
+        balancer = EndpointBalancer([f'http://127.0.0.1:{server.port}', 'http://127.0.0.1:1'])
+        balancer.endpoints[0].healthy = False
+        assert balancer.check()
+        assert [endpoint.healthy for endpoint in balancer.endpoints] == [True, False]
@@ -0,0 +1,34 @@
+import os
+
+from pdf_parser import Parser
+
+
+def _pdfs(tmp_path, stems):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for stem in stems:
+        (input_dir / f'{stem}.pdf').write_bytes(b'%PDF-1.4\n' + stem.encode() * 100)
+    return [str(input_dir / f'{stem}.pdf') for stem in stems]
+
+
+def test_default_process_files_reports_every_pdf(tmp_path, fake_backend, monkeypatch):
+    pdf_files = _pdfs(tmp_path, 'abcde')
+    fake_backend.fail = {'b.pdf'}
+    process_pdf = fake_backend._process_pdf
+
+    def crashing(self, input_file, *args, **kwargs):
+        if input_file.endswith('c.pdf'):
+            raise RuntimeError('bug')
+        return process_pdf(self, input_file, *args, **kwargs)
+    monkeypatch.setattr(fake_backend, '_process_pdf', crashing)
+
+    parser = Parser('fake')
+    results = []
+    parser.handler.listeners.append(lambda input_file, ok, duration, error: results.append((input_file, ok, error)))
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    assert parser.parse_files('figure', iter(pdf_files), str(output_dir), 2) == 3
+
+    assert sorted(results) == [(pdf_files[0], True, None), (pdf_files[1], False, 'failed'),
+                               (pdf_files[2], False, 'bug'), (pdf_files[3], True, None), (pdf_files[4], True, None)]
+    assert sorted(os.listdir(output_dir)) == [f'{stem}.pdffigures.figure' for stem in 'ade']
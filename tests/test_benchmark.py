@@ -0,0 +1,18 @@
+from pdf_parser.benchmark import StubServer, make_corpus, peak_rss_mb, run_benchmark
+
+
+def test_each_row_reports_its_own_peak_rss(tmp_path):
+    corpus_dir = make_corpus(str(tmp_path / 'corpus'), 4, max_pages=3)
+    ballast = bytearray(300 << 20)  # a peak of this process before the rows run
+    ballast[::4096] = b'x' * len(ballast[::4096])
+    del ballast
+    lifetime_peak, _ = peak_rss_mb()
+
+    with StubServer() as server:
+        results = [run_benchmark(backend, 'text', corpus_dir, 2, {'host': server.host, 'port': server.port})
+                   for backend in ('grobid', 'scienceparse')]
+    for result in results:
+        assert 'error' not in result
+        assert result['failure_rate'] == 0
+        assert 0 < result['peak_rss_mb'] < lifetime_peak - 200
+        assert result['peak_child_rss_mb'] is not None
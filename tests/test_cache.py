@@ -0,0 +1,43 @@
+from pdf_parser import Parser, ResultCache
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+from pdf_parser.utils import write_file
+
+
+def test_forced_parse_does_not_write_through_into_the_cache(tmp_path, monkeypatch):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    result = output_dir / 'paper.grobid.xml'
+    cache = ResultCache(str(tmp_path / 'cache'))
+    with StubServer() as server:
+        parser = Parser('grobid', cache=cache, endpoints=[f'127.0.0.1:{server.port}'])
+        posts = []
+
+        def post(content, filename, service, **kwargs):
+            posts.append(kwargs)
+            return b'<TEI consolidated/>' if kwargs.get('consolidate_header') else b'<TEI/>'
+
+        monkeypatch.setattr(parser.handler, '_post', post)
+        parser.parse('text', str(pdf), str(output_dir))
+        assert parser.parse('text', str(pdf), str(output_dir)) == 1  # a cache hit, linked into the output dir
+        assert len(posts) == 1 and result.read_bytes() == b'<TEI/>'
+
+        parser.parse('text', str(pdf), str(output_dir), force=True, consolidate_header=True)
+        assert len(posts) == 2 and result.read_bytes() == b'<TEI consolidated/>'
+
+        parser.parse('text', str(pdf), str(output_dir))
+        parser.close()
+
+    assert len(posts) == 2 and result.read_bytes() == b'<TEI/>'
+    assert len(cache) == 2
+
+
+def test_write_file_replaces_a_hardlink(tmp_path):
+    linked = tmp_path / 'linked'
+    linked.write_bytes(b'cached')
+    path = tmp_path / 'result'
+    path.hardlink_to(linked)
+    write_file(str(path), b'new')
+    assert path.read_bytes() == b'new' and linked.read_bytes() == b'cached'
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['linked', 'result']
@@ -0,0 +1,99 @@
+import os
+
+from pdf_parser.backends.base import BackendTimeout, QUARANTINE_FILENAME
+from pdf_parser.backends.cermine import Cermine
+from pdf_parser.benchmark import make_synthetic_pdf
+
+PNG_END = b'IEND\xaeB`\x82'
+
+
+def _cermine(monkeypatch, write):
+    """A Cermine whose runs write the results of `write(staging_dir, tmp_id)` per pdf, and are killed on a pdf
+    for which write returns False"""
+    monkeypatch.setattr(Cermine, '_check_java', lambda self: setattr(self, 'health', True))
+    cermine = Cermine()
+    runs = []
+
+    def run_extractor(dirname, service, n_docs, timeout=None):
+        tmp_ids = sorted((name[:-4] for name in os.listdir(dirname) if name.endswith('.pdf')), key=int)
+        runs.append(n_docs)
+        for tmp_id in tmp_ids:
+            if write(dirname, tmp_id, n_docs) is False:
+                raise BackendTimeout(f'Cermine killed after {timeout:.0f} seconds')
+        return None
+
+    monkeypatch.setattr(cermine, '_run_extractor', run_extractor)
+    return cermine, runs
+
+
+def _inputs(tmp_path, n):
+    files = []
+    for i in range(n):
+        path = tmp_path / f'paper{i}.pdf'
+        path.write_bytes(b'%PDF')
+        files.append(str(path))
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    return files, output_dir
+
+
+def test_results_cut_off_by_a_timeout_are_parsed_again(tmp_path, monkeypatch):
+    def write(dirname, tmp_id, n_docs):
+        with open(os.path.join(dirname, tmp_id + '.cermxml'), 'w') as fp:
+            if n_docs > 1 and tmp_id == '1':
+                fp.write('<article><front><article-meta><title-group>')  # being written at the kill
+                return False
+            fp.write(f'<article>{n_docs}</article>')
+
+    cermine, runs = _cermine(monkeypatch, write)
+    files, output_dir = _inputs(tmp_path, 3)
+    cermine._process_batch(files, str(output_dir), 'jats', batch_timeout=10)
+
+    # paper0 kept from the first run, paper1 and paper2 parsed again, alone as each half of the bisection
+    assert runs == [3, 1, 1]
+    assert (output_dir / 'paper0.cermine.xml').read_text() == '<article>3</article>'
+    assert (output_dir / 'paper1.cermine.xml').read_text() == '<article>1</article>'
+    assert (output_dir / 'paper2.cermine.xml').read_text() == '<article>1</article>'
+    assert not os.path.exists(output_dir / QUARANTINE_FILENAME)
+
+
+def test_truncated_images_are_not_kept(tmp_path, monkeypatch):
+    def write(dirname, tmp_id, n_docs):
+        images = os.path.join(dirname, tmp_id + '.images')
+        os.mkdir(images)
+        with open(os.path.join(images, 'img_0.png'), 'wb') as fp:
+            if n_docs > 1 and tmp_id == '0':
+                fp.write(b'\x89PNG\r\n\x1a\n partial')
+                return False
+            fp.write(b'\x89PNG\r\n\x1a\n' + PNG_END)
+
+    cermine, runs = _cermine(monkeypatch, write)
+    files, output_dir = _inputs(tmp_path, 2)
+    cermine._process_batch(files, str(output_dir), 'images', batch_timeout=10)
+
+    assert runs == [2, 1, 1]
+    for i in range(2):
+        assert (output_dir / f'paper{i}.cermine.figure' / 'img_0.png').read_bytes().endswith(PNG_END)
+
+
+def test_batches_are_packed_by_pages_and_count_produced_results(tmp_path, monkeypatch):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for i, n_pages in enumerate([12, 2, 2, 2, 2]):
+        make_synthetic_pdf(str(input_dir / f'paper{i}.pdf'), n_pages=n_pages, seed=i)
+
+    def write(dirname, tmp_id, n_docs):
+        if os.path.samefile(os.path.join(dirname, tmp_id + '.pdf'), input_dir / 'paper3.pdf'):
+            return  # cermine gave up on it, without a result
+        with open(os.path.join(dirname, tmp_id + '.cermxml'), 'w') as fp:
+            fp.write('<article/>')
+
+    cermine, runs = _cermine(monkeypatch, write)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    files = sorted(str(path) for path in input_dir.iterdir())
+    assert cermine.parse_files('text', iter(files), str(output_dir), 1, batch_pages=10, schedule='pages') == 4
+
+    # the 12 pages pdf alone, then at most 10 pages and ceil(5 pdfs / 1 thread / 2) pdfs per batch
+    assert runs == [1, 3, 1]
+    assert sorted(os.listdir(output_dir)) == [f'paper{i}.cermine.xml' for i in (0, 1, 2, 4)]
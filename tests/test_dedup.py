@@ -0,0 +1,159 @@
+import os
+import sys
+import json
+import shutil
+
+import pytest
+
+from pdf_parser import Parser, ResultStore
+from pdf_parser.benchmark import make_synthetic_pdf
+from pdf_parser.dedup import DUPLICATES_FILENAME, Deduplicator, pdf_id
+
+ID_A = '0123456789abcdef0123456789abcdef'
+ID_B = 'fedcba9876543210fedcba9876543210'
+
+# stands in for poppler: prints the text shown by the Tj operators of the pages
+FAKE_PDFTOTEXT = '''#!{python}
+import re, sys
+data = open(sys.argv[-2], 'rb').read()
+print(b' '.join(re.findall(rb'\\(([^)]*)\\) Tj', data)).decode())
+'''
+
+
+def _pdf(tmp_path, name, n_pages=2, seed=1, doc_id=None):
+    path = tmp_path / 'in' / name
+    os.makedirs(path.parent, exist_ok=True)
+    make_synthetic_pdf(str(path), n_pages, seed=seed, doc_id=doc_id)
+    return str(path)
+
+
+@pytest.fixture
+def fake_pdftotext(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    script = bin_dir / 'pdftotext'
+    script.write_text(FAKE_PDFTOTEXT.format(python=sys.executable))
+    script.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+
+
+def test_byte_identical_copies_match_by_hash(tmp_path):
+    first = _pdf(tmp_path, 'a.pdf')
+    copy = str(tmp_path / 'in' / 'b.pdf')
+    shutil.copy(first, copy)
+    other = _pdf(tmp_path, 'c.pdf', seed=2)
+    dedup = Deduplicator(methods=('hash',))
+    assert dedup.match(first) == (None, None)
+    assert dedup.match(other) == (None, None)
+    assert dedup.match(copy) == (first, 'hash')
+
+
+def test_same_id_and_page_count_match_by_id(tmp_path):
+    first = _pdf(tmp_path, 'a.pdf', seed=1, doc_id=ID_A)
+    restamped = _pdf(tmp_path, 'b.pdf', seed=2, doc_id=ID_A)  # other bytes, same /ID and pages
+    longer = _pdf(tmp_path, 'c.pdf', n_pages=3, seed=3, doc_id=ID_A)
+    other = _pdf(tmp_path, 'd.pdf', seed=4, doc_id=ID_B)
+    assert pdf_id(first) == ID_A
+    dedup = Deduplicator(methods=('hash', 'id'))
+    assert dedup.match(first) == (None, None)
+    assert dedup.match(restamped) == (first, 'id')
+    assert dedup.match(longer) == (None, None)
+    assert dedup.match(other) == (None, None)
+    assert dedup.counts == {'hash': 0, 'id': 1}
+
+
+def test_constant_ids_do_not_collapse_papers(tmp_path):
+    constant = '0' * 32
+    first = _pdf(tmp_path, 'a.pdf', seed=1, doc_id=constant)
+    second = _pdf(tmp_path, 'b.pdf', seed=2, doc_id=constant)
+    assert pdf_id(first) is None
+    dedup = Deduplicator(methods=('id',))
+    assert dedup.match(first) == (None, None)
+    assert dedup.match(second) == (None, None)
+
+
+def test_same_text_matches_by_simhash(tmp_path, fake_pdftotext):
+    first = _pdf(tmp_path, 'a.pdf', seed=1, doc_id=ID_A)
+    reproduced = _pdf(tmp_path, 'b.pdf', seed=1, doc_id=ID_B)  # same text, produced again
+    other = _pdf(tmp_path, 'c.pdf', seed=2, doc_id='ab' * 16)
+    dedup = Deduplicator(methods=('hash', 'id', 'text'))
+    assert dedup.methods == ('hash', 'id', 'text')
+    assert dedup.match(first) == (None, None)
+    assert dedup.match(other) == (None, None)
+    assert dedup.match(reproduced) == (first, 'text')
+
+
+def test_parser_shares_results_with_duplicates(tmp_path, fake_backend):
+    first = _pdf(tmp_path, 'a.pdf', seed=1, doc_id=ID_A)
+    shutil.copy(first, tmp_path / 'in' / 'b.pdf')
+    _pdf(tmp_path, 'c.pdf', seed=2, doc_id=ID_A)
+    _pdf(tmp_path, 'd.pdf', seed=3, doc_id=ID_B)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+
+    Parser('fake', dedup=('hash', 'id')).parse('figure', str(tmp_path / 'in'), str(output_dir), 2)
+
+    # a, b and c are one paper, parsed once as whichever of them was scanned first
+    assert len(fake_backend.parsed) == 2 and 'd.pdf' in fake_backend.parsed
+    [representative] = set(fake_backend.parsed) - {'d.pdf'}
+    for stem in 'abcd':
+        [figure] = json.loads((output_dir / f'{stem}.pdffigures.figure' / 'figure-data.json').read_text())
+        assert figure['Caption'] == ('d.pdf' if stem == 'd' else representative)
+    records = [json.loads(line) for line in (output_dir / DUPLICATES_FILENAME).read_text().splitlines()]
+    assert sorted(os.path.basename(record['path']) for record in records) == \
+        sorted({'a.pdf', 'b.pdf', 'c.pdf'} - {representative})
+    assert all(record['ok'] for record in records)
+
+
+def test_duplicates_of_a_failed_pdf_fail(tmp_path, fake_backend):
+    first = _pdf(tmp_path, 'a.pdf')
+    shutil.copy(first, tmp_path / 'in' / 'b.pdf')
+    fake_backend.fail = {'a.pdf', 'b.pdf'}
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+
+    Parser('fake', dedup=('hash',)).parse('figure', str(tmp_path / 'in'), str(output_dir), 1)
+
+    assert len(fake_backend.parsed) == 1
+    [record] = [json.loads(line) for line in (output_dir / DUPLICATES_FILENAME).read_text().splitlines()]
+    assert record['ok'] is False and record['method'] == 'hash'
+    assert [name for name in os.listdir(output_dir) if not name.startswith('.')] == []
+
+
+def test_duplicates_are_copied_in_the_result_store(tmp_path, fake_backend):
+    first = _pdf(tmp_path, 'a.pdf')
+    shutil.copy(first, tmp_path / 'in' / 'b.pdf')
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    with ResultStore(str(tmp_path / 'store')) as store:
+        Parser('fake', store=store, dedup=('hash',)).parse('figure', str(tmp_path / 'in'), str(output_dir), 1)
+        assert store.ids() == ['a', 'b']
+        assert store.get('a')['.pdffigures.figure'] == store.get('b')['.pdffigures.figure']
+    assert len(fake_backend.parsed) == 1
+
+
+def test_a_file_seen_again_is_not_its_own_duplicate(tmp_path):
+    first = _pdf(tmp_path, 'a.pdf', doc_id=ID_A)
+    copy = str(tmp_path / 'in' / 'b.pdf')
+    shutil.copy(first, copy)
+    dedup = Deduplicator(methods=('hash', 'id'))
+    assert dedup.match(first) == (None, None)
+    assert dedup.match(copy) == (first, 'hash')
+    assert dedup.match(first) == (None, None)
+    assert dedup.counts == {'hash': 1, 'id': 0}
+
+
+def test_one_deduplicator_serves_several_jobs(tmp_path, fake_backend):
+    first = _pdf(tmp_path, 'a.pdf')
+    shutil.copy(first, tmp_path / 'in' / 'b.pdf')
+    dedup = Deduplicator(methods=('hash',))
+    parser = Parser('fake', dedup=dedup)
+
+    for job in ('out1', 'out2'):
+        output_dir = tmp_path / job
+        output_dir.mkdir()
+        parser.parse('figure', str(tmp_path / 'in'), str(output_dir), 1)
+        for stem in 'ab':
+            assert (output_dir / f'{stem}.pdffigures.figure' / 'figure-data.json').exists()
+    assert len(fake_backend.parsed) == 2
+    assert dedup.counts == {'hash': 0}  # the instance only holds the configuration
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+
+import pytest
+
+from pdf_parser.distributed import DONE, FAILED, LEASED, QUEUED, WorkQueue, Worker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return WorkQueue(str(tmp_path / 'queue.sqlite'), max_attempts=2)
+
+
+def _pdfs(tmp_path, n):
+    files = []
+    for i in range(n):
+        path = tmp_path / f'paper{i}.pdf'
+        path.write_bytes(b'%PDF')
+        files.append(str(path))
+    return files
+
+
+def test_finished_jobs_are_done(tmp_path, queue):
+    assert queue.enqueue(_pdfs(tmp_path, 3), str(tmp_path / 'out'), 'grobid', 'text') == 3
+    assert queue.enqueue(_pdfs(tmp_path, 3), str(tmp_path / 'out'), 'grobid', 'text') == 0  # already queued
+    group, jobs = queue.claim('w1', limit=10)
+    assert group[:2] == ('grobid', 'text') and len(jobs) == 3
+    assert queue.claim('w2', limit=10) == (None, [])  # leased to w1
+
+    queue.finish([(jobs[0][0], True, 0.1, None), (jobs[1][0], False, 0.1, 'bad pdf')], 'w1')
+    queue.release([jobs[2][0]], 'w1', 'not reported')
+    assert queue.counts() == {DONE: 1, FAILED: 1, QUEUED: 1}
+
+
+def test_expired_lease_is_delivered_again_until_max_attempts(tmp_path, queue):
+    queue.enqueue(_pdfs(tmp_path, 1), str(tmp_path / 'out'), 'grobid', 'text')
+    _, jobs = queue.claim('w1', lease=0.05)
+    assert queue.claim('w2', lease=0.05) == (None, [])
+    time.sleep(0.1)
+    _, again = queue.claim('w2', lease=0.05)
+    assert again == jobs
+
+    # the worker which lost the lease can not finish the job any more
+    queue.finish([(jobs[0][0], True, 0.1, None)], 'w1')
+    assert queue.counts() == {LEASED: 1}
+
+    time.sleep(0.1)
+    assert queue.claim('w3', lease=0.05) == (None, [])  # 2 attempts used
+    assert queue.counts() == {FAILED: 1}
+    assert queue.retry_failed() == 1
+    assert queue.counts() == {QUEUED: 1}
+
+
+def test_extended_lease_is_kept(tmp_path, queue):
+    queue.enqueue(_pdfs(tmp_path, 1), str(tmp_path / 'out'), 'grobid', 'text')
+    queue.claim('w1', lease=0.1)
+    time.sleep(0.06)
+    queue.extend('w1', lease=10)
+    time.sleep(0.06)
+    assert queue.claim('w2') == (None, [])
+
+
+def test_worker_parses_the_queue(tmp_path, queue, fake_backend):
+    output_dir = tmp_path / 'out'
+    queue.enqueue(_pdfs(tmp_path, 5), str(output_dir), 'fake', 'figure')
+    assert Worker(queue, batch_size=2, poll=0.01).run() == 5
+    assert queue.counts() == {DONE: 5}
+    assert os.path.isdir(output_dir)
+
+
+def test_unavailable_backend_is_tried_again_after_a_backoff(tmp_path, queue, fake_backend):
+    queue.enqueue(_pdfs(tmp_path, 1), str(tmp_path / 'out'), 'fake', 'figure')
+    worker = Worker(queue, unavailable_backoff=0.05, max_backoff=0.08, poll=0.01)
+
+    fake_backend.healthy = False
+    group, jobs = queue.claim(worker.name)
+    worker.run_batch(group, jobs)
+    assert worker._excluded() == ['fake']
+    assert queue.counts() == {QUEUED: 1}
+
+    time.sleep(0.06)
+    assert worker._excluded() == []
+    group, jobs = queue.claim(worker.name)
+    worker.run_batch(group, jobs)  # still not healthy, with a new parser
+    assert fake_backend.created == 2
+    assert worker._backoffs['fake'] == 0.08
+
+    queue.retry_failed()
+    fake_backend.healthy = True
+    time.sleep(0.09)
+    worker.forever = False
+    assert worker.run() == 1
+    assert queue.counts() == {DONE: 1}
+    assert 'fake' not in worker._backoffs
+
+
+def test_jobs_of_a_dead_worker_are_reclaimed(tmp_path, queue, fake_backend):
+    output_dir = tmp_path / 'out'
+    queue.enqueue(_pdfs(tmp_path, 3), str(output_dir), 'fake', 'figure')
+    _, dead = queue.claim('dead', limit=2, lease=0.2)  # then the node goes away, without a heartbeat
+
+    start = time.time()
+    assert Worker(queue, batch_size=10, poll=0.02, lease=10).run() == 3
+    assert time.time() - start >= 0.2  # waited for the lease to run out, rather than parsing leased jobs
+    assert queue.counts() == {DONE: 3}
+    assert sorted(fake_backend.parsed) == ['paper0.pdf', 'paper1.pdf', 'paper2.pdf']
+
+    queue.finish([(job_id, False, 0.1, 'late') for job_id, _ in dead], 'dead')  # ignored, it lost the lease
+    assert queue.counts() == {DONE: 3}
+
+
+def test_heartbeat_keeps_the_lease_of_a_long_batch(tmp_path, queue, fake_backend, monkeypatch):
+    queue.enqueue(_pdfs(tmp_path, 1), str(tmp_path / 'out'), 'fake', 'figure')
+    process_pdf = fake_backend._process_pdf
+
+    def slow(self, *args, **kwargs):
+        time.sleep(0.3)
+        return process_pdf(self, *args, **kwargs)
+    monkeypatch.setattr(fake_backend, '_process_pdf', slow)
+
+    worker = Worker(queue, lease=0.1, heartbeat=0.03, poll=0.01)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    time.sleep(0.2)
+    assert queue.claim('other') == (None, [])  # past the first lease, still held by the heartbeat
+    thread.join()
+    assert queue.counts() == {DONE: 1} and fake_backend.parsed == ['paper0.pdf']
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from pdf_parser import Parser
+from pdf_parser.backends import grobid as grobid_module
+from pdf_parser.backends.base import QUARANTINE_FILENAME
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+
+
+def _grobid(endpoints, **kwargs):
+    parser = Parser('grobid', endpoints=endpoints, check_interval=None, **kwargs)
+    for endpoint in parser.handler.balancer.endpoints:
+        endpoint.healthy = True  # as if the servers went away after the last health check
+    return parser
+
+
+def _recording(monkeypatch, session):
+    urls = []
+    post = session.post
+
+    def recording_post(url, **kwargs):
+        urls.append(url.split('/api/')[0])
+        return post(url, **kwargs)
+    monkeypatch.setattr(session, 'post', recording_post)
+    return urls
+
+
+def test_connect_timeout_fails_over_instead_of_quarantining(tmp_path, monkeypatch):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    with StubServer() as server:
+        parser = Parser('grobid', endpoints=[f'127.0.0.1:{server.port}', f'localhost:{server.port}'])
+        session = parser.handler.session
+        post = session.post
+        urls = []
+
+        def slow_connect_once(url, **kwargs):
+            urls.append(url)
+            if len(urls) == 1:
+                raise requests.ConnectTimeout('connect timed out')
+            return post(url, **kwargs)
+
+        monkeypatch.setattr(session, 'post', slow_connect_once)
+        parser.parse('text', str(pdf), str(output_dir), doc_timeout=5)
+        parser.close()
+
+    assert len(urls) == 2 and urls[0].split('/api/')[0] != urls[1].split('/api/')[0]
+    assert os.path.exists(output_dir / 'paper.grobid.xml')
+    assert not os.path.exists(output_dir / QUARANTINE_FILENAME)
+    assert parser.metrics.snapshot()['counters'].get('timeouts', 0) == 0
+
+
+def test_refused_connection_fails_over(tmp_path, monkeypatch, closed_port):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    refused = f'http://127.0.0.1:{closed_port}'
+    with StubServer() as server:
+        parser = _grobid([refused, f'127.0.0.1:{server.port}'])
+        urls = _recording(monkeypatch, parser.handler.session)
+        parser.parse('text', str(pdf), str(output_dir))
+        parser.close()
+
+    assert urls == [refused, f'http://127.0.0.1:{server.port}']
+    assert os.path.exists(output_dir / 'paper.grobid.xml')
+    assert [endpoint.healthy for endpoint in parser.handler.balancer.endpoints] == [False, True]
+
+
+def test_connection_lost_after_the_upload_quarantines_the_pdf(tmp_path, monkeypatch, crashing_server):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    crashing = f'http://127.0.0.1:{crashing_server}'
+    with StubServer() as server:
+        parser = _grobid([crashing, f'127.0.0.1:{server.port}'])
+        urls = _recording(monkeypatch, parser.handler.session)
+        parser.parse('text', str(pdf), str(output_dir))
+        parser.close()
+
+    # not replayed against the other server, and neither server is taken out of rotation for it
+    assert urls == [crashing]
+    assert all(endpoint.healthy for endpoint in parser.handler.balancer.endpoints)
+    assert not os.path.exists(output_dir / 'paper.grobid.xml')
+    [record] = [json.loads(line) for line in (output_dir / QUARANTINE_FILENAME).read_text().splitlines()]
+    assert record['reason'].startswith('connection lost while parsing')
+
+
+def test_overloaded_server_is_retried_with_a_jittered_bounded_backoff(tmp_path, monkeypatch):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    sleeps = []
+    monkeypatch.setattr(grobid_module, 'time', SimpleNamespace(time=time.time, monotonic=time.monotonic,
+                                                              sleep=sleeps.append))
+    with StubServer() as server:
+        parser = _grobid([f'127.0.0.1:{server.port}'], sleep_time=1, max_backoff=4)
+        session = parser.handler.session
+        post = session.post
+
+        def overloaded(url, **kwargs):
+            if len(sleeps) < 5:
+                response = requests.Response()
+                response.status_code = 503
+                return response
+            return post(url, **kwargs)
+        monkeypatch.setattr(session, 'post', overloaded)
+        parser.parse('text', str(pdf), str(output_dir))
+        parser.close()
+
+    assert os.path.exists(output_dir / 'paper.grobid.xml')
+    bounds = [(0.5, 1), (1, 2), (2, 4), (2, 4), (2, 4)]
+    assert len(sleeps) == 5 and all(low <= delay <= high for delay, (low, high) in zip(sleeps, bounds))
+    assert len(set(sleeps)) > 1
+
+
+def test_concurrent_jobs_share_one_connection_pool(tmp_path):
+    input_dirs = []
+    for index in range(2):
+        input_dir = tmp_path / f'in{index}'
+        input_dir.mkdir()
+        for seed in range(4):
+            make_synthetic_pdf(str(input_dir / f'{index}-{seed}.pdf'), seed=seed)
+        input_dirs.append(input_dir)
+    output_dir = tmp_path / 'out'
+    with StubServer(delay=0.05) as server:
+        parser = _grobid([f'127.0.0.1:{server.port}'])
+        session = parser.handler.session
+        adapter = session.get_adapter(parser.handler.url)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            jobs = [executor.submit(parser.parse, 'text', str(input_dir), str(output_dir), 2)
+                    for input_dir in input_dirs]
+            assert [job.result() for job in jobs] == [4, 4]
+        parser.close()
+
+    assert session.get_adapter(parser.handler.url) is adapter
+    assert adapter._pool_maxsize == 256
+    assert parser.metrics.snapshot()['counters'].get('connection_errors', 0) == 0
@@ -0,0 +1,77 @@
+import os
+import json
+
+import pytest
+
+from pdf_parser import Parser
+from pdf_parser.backends.base import QUARANTINE_FILENAME
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+
+pytest.importorskip('aiohttp')
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(path), seed=1)
+    return path
+
+
+def _grobid(endpoints, **kwargs):
+    parser = Parser('grobid', endpoints=endpoints, asynchronous=True, check_interval=None, **kwargs)
+    for endpoint in parser.handler.balancer.endpoints:
+        endpoint.healthy = True  # as if the servers went away after the last health check
+    return parser
+
+
+def _quarantined(output_dir):
+    path = output_dir / QUARANTINE_FILENAME
+    return [json.loads(line)['reason'] for line in path.read_text().splitlines()] if path.exists() else []
+
+
+def test_refused_connection_fails_over(tmp_path, pdf, closed_port):
+    output_dir = tmp_path / 'out'
+    with StubServer() as server:
+        parser = _grobid([f'127.0.0.1:{closed_port}', f'127.0.0.1:{server.port}'])
+        parser.parse('text', str(pdf.parent), str(output_dir), doc_timeout=5)
+        parser.close()
+
+    assert os.path.exists(output_dir / 'paper.grobid.xml')
+    assert _quarantined(output_dir) == []
+    assert [endpoint.healthy for endpoint in parser.handler.balancer.endpoints] == [False, True]
+
+
+def test_connection_lost_after_the_upload_quarantines_the_pdf(tmp_path, pdf, crashing_server):
+    output_dir = tmp_path / 'out'
+    with StubServer() as server:
+        parser = _grobid([f'127.0.0.1:{crashing_server}', f'127.0.0.1:{server.port}'])
+        parser.parse('text', str(pdf.parent), str(output_dir))
+        parser.close()
+
+    assert not os.path.exists(output_dir / 'paper.grobid.xml')
+    [reason] = _quarantined(output_dir)
+    assert reason.startswith('connection lost while parsing')
+    assert all(endpoint.healthy for endpoint in parser.handler.balancer.endpoints)
+
+
+def test_no_response_in_time_quarantines_the_pdf(tmp_path, pdf):
+    output_dir = tmp_path / 'out'
+    with StubServer(delay=2) as server:
+        parser = _grobid([f'127.0.0.1:{server.port}'])
+        parser.parse('text', str(pdf.parent), str(output_dir), doc_timeout=0.5)
+        parser.close()
+
+    assert _quarantined(output_dir) == ['no response in 0.5 seconds']
+    assert parser.handler.balancer.endpoints[0].healthy
+
+
+def test_pdfs_are_reported_without_any_server(tmp_path, pdf, closed_port):
+    output_dir = tmp_path / 'out'
+    parser = Parser('grobid', endpoints=[f'127.0.0.1:{closed_port}'], asynchronous=True, check_interval=None)
+    results = []
+    parser.handler.listeners.append(lambda input_file, ok, duration, error: results.append((input_file, ok, error)))
+    parser.parse('text', str(pdf.parent), str(output_dir))
+    parser.close()
+
+    assert results == [(str(pdf), False, 'no GROBID server available')]
+    assert parser.metrics.snapshot()['counters']['documents_failed'] == 1
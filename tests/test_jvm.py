@@ -0,0 +1,71 @@
+import os
+import sys
+import stat
+import tempfile
+import threading
+
+import pytest
+
+from pdf_parser.backends import jvm
+from pdf_parser.backends.jvm import JvmWorkerError, JvmWorkerPool, parse_java_version
+
+# speaks the protocol of PdfParserWorker, the task "exit" exits like a parser calling System.exit
+FAKE_WORKER = '''
+import sys
+print('READY', flush=True)
+for line in sys.stdin:
+    if line.strip() == 'exit':
+        print('parser gave up', file=sys.stderr, flush=True)
+        sys.exit(3)
+    print('OK', flush=True)
+'''
+
+FAKE_JAVAC = '''#!/bin/sh
+sleep 0.2
+out=$3
+printf 'class' > "$out/PdfParserWorker.class"
+'''
+
+
+def test_parse_java_version():
+    assert parse_java_version('java version "1.8.0_392"') == 8
+    assert parse_java_version('openjdk version "17.0.2" 2022-01-18') == 17
+    assert parse_java_version('openjdk version "21" 2023-09-19') == 21
+    assert parse_java_version('command not found') is None
+
+
+def test_dead_worker_is_respawned_with_its_stderr(tmp_path, caplog):
+    script = tmp_path / 'worker.py'
+    script.write_text(FAKE_WORKER)
+    pool = JvmWorkerPool('parser.jar', 'Main', size=1)
+    pool.cmd = [sys.executable, str(script)]
+
+    pool.run(['ok'])
+    with pytest.raises(JvmWorkerError, match='parser gave up'):
+        pool.run(['exit'])
+    pool.run(['ok'])
+    pool.close()
+    assert pool.respawns == 1
+    assert 'respawn' in caplog.text
+
+
+@pytest.mark.skipif(os.name != 'posix', reason='fake javac is a shell script')
+def test_concurrent_compiles_rename_one_complete_class_dir(tmp_path, monkeypatch):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    javac = bin_dir / 'javac'
+    javac.write_text(FAKE_JAVAC)
+    javac.chmod(javac.stat().st_mode | stat.S_IXUSR)
+    monkeypatch.setenv('PATH', f'{bin_dir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+
+    class_dirs = []
+    threads = [threading.Thread(target=lambda: class_dirs.append(jvm._compile_worker())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(class_dirs)) == 1 and class_dirs[0] is not None
+    assert os.listdir(class_dirs[0]) == ['PdfParserWorker.class']
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.pdf_parser-jvm-')]
@@ -0,0 +1,51 @@
+import os
+
+from pdf_parser import Parser
+from pdf_parser.manifest import JobManifest
+
+
+def _write_pdfs(input_dir, stems):
+    for stem in stems:
+        (input_dir / f'{stem}.pdf').write_bytes(b'%PDF-1.4\n' + stem.encode())
+
+
+def test_rerun_parses_only_new_changed_and_failed_pdfs(tmp_path, fake_backend):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    _write_pdfs(input_dir, 'abcd')
+    output_dir = tmp_path / 'out'
+    fake_backend.fail = {'b.pdf'}
+    parser = Parser('fake', manifest=True)
+    assert parser.parse('figure', str(input_dir), str(output_dir), 2) == 3
+
+    manifest = JobManifest(str(output_dir), 'fake', 'figure')
+    assert manifest.counts() == {'done': 3, 'failed': 1}
+    assert manifest.failed() == [(os.path.abspath(input_dir / 'b.pdf'), 'failed')]
+    manifest.close()
+
+    del fake_backend.parsed[:]
+    fake_backend.fail = set()
+    (input_dir / 'c.pdf').write_bytes(b'%PDF-1.4\nchanged')
+    _write_pdfs(input_dir, 'e')
+    parser.parse('figure', str(input_dir), str(output_dir), 2)
+    assert sorted(fake_backend.parsed) == ['b.pdf', 'c.pdf', 'e.pdf']
+
+    del fake_backend.parsed[:]
+    parser.parse('figure', str(input_dir), str(output_dir), 2)
+    assert fake_backend.parsed == []
+
+    parser.parse('figure', str(input_dir), str(output_dir), 2, force=True)
+    assert sorted(fake_backend.parsed) == ['a.pdf', 'b.pdf', 'c.pdf', 'd.pdf', 'e.pdf']
+
+
+def test_pending_pdfs_are_not_done(tmp_path):
+    pdf = tmp_path / 'a.pdf'
+    pdf.write_bytes(b'%PDF-1.4\n')
+    manifest = JobManifest(str(tmp_path), 'fake', 'figure')
+    manifest.mark_pending(str(pdf))
+    manifest.close()
+    manifest = JobManifest(str(tmp_path), 'fake', 'figure')
+    assert manifest.counts() == {'pending': 1} and not manifest.is_done(str(pdf))
+    manifest.record(str(pdf), True, 0.5)
+    assert manifest.is_done(str(pdf))
+    manifest.close()
@@ -0,0 +1,37 @@
+import json
+
+from pdf_parser import Parser
+from pdf_parser.metrics import Metrics, MetricsReporter
+
+
+def test_backend_run_is_counted_and_exported(tmp_path, fake_backend):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for stem in 'abc':
+        (input_dir / f'{stem}.pdf').write_bytes(b'%PDF-1.4\n')
+    fake_backend.fail = {'b.pdf'}
+    parser = Parser('fake')
+    jsonl = tmp_path / 'metrics.jsonl'
+    prometheus = tmp_path / 'metrics.prom'
+    with MetricsReporter(parser.metrics, str(jsonl), str(prometheus), interval=60):
+        parser.parse('figure', str(input_dir), str(tmp_path / 'out'), 2)
+
+    [snapshot] = map(json.loads, jsonl.read_text().splitlines())  # exported once more on stop
+    assert snapshot['backend'] == 'FakeBackend'
+    assert snapshot['counters'] == {'documents_ok': 2, 'documents_failed': 1}
+    assert snapshot['stages']['document']['runs'] == 3
+    assert snapshot['gauges']['queue_depth'] == 0
+    text = prometheus.read_text()
+    assert 'pdf_parser_documents_failed_total{backend="FakeBackend"} 1\n' in text
+    assert 'pdf_parser_stage_seconds_count{backend="FakeBackend",stage="document"} 3\n' in text
+
+
+def test_batched_stage_counts_docs_per_run():
+    metrics = Metrics('Cermine')
+    metrics.observe('subprocess', 4.0, n_docs=100)
+    metrics.observe('subprocess', 1.0, n_docs=50)
+    with metrics.track('in_flight', 8):
+        assert metrics.snapshot()['gauges'] == {'in_flight': 8}
+    assert metrics.snapshot()['gauges'] == {'in_flight': 0}
+    assert metrics.snapshot()['stages']['subprocess'] == {'runs': 2, 'docs': 150, 'seconds': 5.0, 'max_seconds': 4.0}
+    assert 'pdf_parser_stage_documents_total{backend="Cermine",stage="subprocess"} 150\n' in metrics.to_prometheus()
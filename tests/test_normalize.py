@@ -0,0 +1,45 @@
+import json
+
+from pdf_parser.normalize import iter_output_dir, normalize
+
+TEI = b'''<TEI xmlns="http://www.tei-c.org/ns/1.0"><teiHeader><fileDesc>
+<titleStmt><title>From GROBID</title></titleStmt>
+<sourceDesc><biblStruct><analytic><author><persName><forename>Ada</forename><surname>Lovelace</surname></persName>
+</author></analytic><monogr><imprint><date when="1843"/></imprint></monogr></biblStruct></sourceDesc>
+</fileDesc><profileDesc><abstract><p>Notes.</p></abstract></profileDesc></teiHeader>
+<text><body><div><head>Intro</head><p>One.</p><p>Two.</p></div></body>
+<back><listBibl><biblStruct><analytic><title>Sketch</title></analytic><monogr><imprint><date when="1842"/></imprint>
+</monogr></biblStruct></listBibl></back></text></TEI>'''
+
+SCIENCEPARSE = json.dumps({'title': 'From ScienceParse', 'abstractText': None, 'year': 1843,
+                           'sections': [{'heading': 'Extra', 'text': 'Three.'}]}).encode()
+
+PDFFIGURES = {'figure-data.json': json.dumps([{'Type': 'Figure', 'Number': 1, 'Caption': 'Engine', 'Page': 2,
+                                               'DPI': 144, 'ImageBB': [144, 288, 288, 432]}]).encode(),
+              'figure-1.png': b'png'}
+
+
+def test_results_of_several_backends_merge_into_one_document():
+    document = normalize('paper', {'.grobid.xml': TEI, '.scienceparse.json': SCIENCEPARSE,
+                                   '.pdffigures.figure': PDFFIGURES, '.cermine.xml': b'<article>cut'})
+    record = document.to_dict()
+
+    assert record['sources'] == ['.grobid.xml', '.scienceparse.json', '.pdffigures.figure']  # broken JATS skipped
+    assert (record['title'], record['abstract'], record['year']) == ('From GROBID', 'Notes.', '1843')
+    assert record['authors'] == [{'name': 'Ada Lovelace'}]
+    assert record['sections'] == [{'heading': 'Intro', 'text': 'One.\nTwo.'}, {'heading': 'Extra', 'text': 'Three.'}]
+    assert record['references'] == [{'title': 'Sketch', 'year': '1842'}]
+    assert record['figures'] == [{'name': '1', 'type': 'figure', 'caption': 'Engine', 'page': 2, 'image': 'figure-1.png',
+                                  'bbox': {'page': 2, 'x1': 72.0, 'y1': 144.0, 'x2': 144.0, 'y2': 216.0}}]
+
+
+def test_output_dir_is_grouped_by_pdf(tmp_path):
+    (tmp_path / 'paper.grobid.xml').write_bytes(TEI)
+    (tmp_path / 'paper.pdf.scienceparse.json').write_bytes(SCIENCEPARSE)
+    (tmp_path / 'other.pdffigures.figure').mkdir()
+    (tmp_path / 'notes.txt').write_text('')
+
+    docs = {doc: sorted(results) for doc, results in iter_output_dir(str(tmp_path))}
+    assert docs == {'other': ['.pdffigures.figure'], 'paper': ['.grobid.xml', '.scienceparse.json']}
+    document = normalize('paper', dict(iter_output_dir(str(tmp_path)))['paper'])
+    assert document.title == 'From GROBID' and sorted(document.sources) == ['.grobid.xml', '.scienceparse.json']
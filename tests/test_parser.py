@@ -0,0 +1,34 @@
+import io
+import json
+
+from pdf_parser import Parser
+from pdf_parser.benchmark import make_synthetic_pdf
+
+
+def _caption(results):
+    return json.loads(results['.pdffigures.figure']['figure-data.json'])[0]['Caption']
+
+
+def test_parse_bytes_returns_the_results_in_memory(tmp_path, fake_backend):
+    path = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(path), seed=1)
+    parser = Parser('fake', preflight=True)
+    assert _caption(parser.parse_bytes('figure', path.read_bytes(), 'paper')) == 'paper.pdf'
+    with open(path, 'rb') as fp:
+        assert _caption(parser.parse_bytes('figure', fp)) == 'paper.pdf'
+
+    assert parser.parse_bytes('figure', b'<html>not found</html>', 'junk.pdf') == {}
+    assert fake_backend.parsed == ['paper.pdf', 'paper.pdf']
+    assert parser.metrics.snapshot()['counters']['rejected'] == 1
+
+
+def test_parse_stream_names_every_document(tmp_path, fake_backend):
+    path = tmp_path / 'c.pdf'
+    make_synthetic_pdf(str(path), seed=1)
+    data = path.read_bytes()
+    with open(path, 'rb') as fp:
+        documents = [('a.pdf', data), data, fp, ('d.pdf', io.BytesIO(data))]
+        results = dict(Parser('fake').parse_stream('figure', documents, num_threads=2))
+
+    assert {name: _caption(result) for name, result in results.items()} == {
+        'a.pdf': 'a.pdf', 'document-1.pdf': 'document-1.pdf', str(path): 'c.pdf', 'd.pdf': 'd.pdf'}
@@ -0,0 +1,139 @@
+import os
+import json
+import time
+
+from pdf_parser.backends.pdffigures2 import PDFFigures2
+from pdf_parser.backends.base import BackendTimeout, QUARANTINE_FILENAME
+
+
+class FakePDFFigures2(PDFFigures2):
+    """Writes the outputs of PDFFigures2 into the staging dir, with `write(staging_dir, tmp_id)` per pdf"""
+
+    def __init__(self, write, **kwargs):
+        self.write = write
+        super(FakePDFFigures2, self).__init__(**kwargs)
+
+    def _check_java(self):
+        self.health = True
+
+    def _run_extractor(self, args, n_docs, timeout=None):
+        staging_dir = args[-1]
+        for tmp_id in sorted((name[:-4] for name in os.listdir(staging_dir) if name.endswith('.pdf')), key=int):
+            self.write(staging_dir, tmp_id)
+        return None
+
+
+def _figure_data(staging_dir, tmp_id, n_figures):
+    return json.dumps([{'name': str(k), 'renderURL': f'{staging_dir}{tmp_id}-Figure{k}-1.png'}
+                       for k in range(n_figures)])
+
+
+def _inputs(tmp_path, n):
+    files = []
+    for i in range(n):
+        path = tmp_path / f'paper{i}.pdf'
+        path.write_bytes(b'%PDF')
+        files.append(str(path))
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    return files, output_dir
+
+
+def test_figures_written_after_the_json_are_still_moved(tmp_path):
+    def write(staging_dir, tmp_id):
+        with open(f'{staging_dir}{tmp_id}.json', 'w') as fp:
+            fp.write(_figure_data(staging_dir, tmp_id, 2))
+        time.sleep(0.15)  # polled in between, with a stable json and a figure missing
+        for k in range(2):
+            with open(f'{staging_dir}{tmp_id}-Figure{k}-1.png', 'wb') as fp:
+                fp.write(b'png')
+        time.sleep(0.15)
+
+    files, output_dir = _inputs(tmp_path, 3)
+    backend = FakePDFFigures2(write, collect_interval=0.05)
+    backend._process_batch(files, str(output_dir), ['-d', '-m'])
+
+    for i in range(3):
+        figure_dir = output_dir / f'paper{i}.pdffigures2.figure'
+        assert sorted(os.listdir(figure_dir)) == ['Figure0-1.png', 'Figure1-1.png', 'figure-data.json']
+        assert [item['renderURL'] for item in json.loads((figure_dir / 'figure-data.json').read_text())] == \
+            ['Figure0-1.png', 'Figure1-1.png']
+    assert backend.metrics.snapshot()['counters']['collected_early'] >= 1
+
+
+def test_half_written_json_is_not_collected_early(tmp_path):
+    def write(staging_dir, tmp_id):
+        data = _figure_data(staging_dir, tmp_id, 0 if tmp_id == '0' else 1)
+        for k in range(int(tmp_id != '0')):
+            open(f'{staging_dir}{tmp_id}-Figure{k}-1.png', 'wb').close()
+        with open(f'{staging_dir}{tmp_id}.json', 'w') as fp:
+            fp.write(data[:3])
+            fp.flush()
+            time.sleep(0.2)  # seen half done, with a stable size, by several polls
+            fp.write(data[3:])
+
+    files, output_dir = _inputs(tmp_path, 2)
+    FakePDFFigures2(write, collect_interval=0.05)._process_batch(files, str(output_dir), ['-d', '-m'])
+    assert json.loads((output_dir / 'paper1.pdffigures2.figure' / 'figure-data.json').read_text())[0]['name'] == '0'
+
+
+def test_files_moved_while_indexing_are_skipped(tmp_path, monkeypatch):
+    class Vanished:
+        name = '3.json'
+
+        def stat(self):
+            raise FileNotFoundError(self.name)
+
+    class Entries(list):
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(os, 'scandir', lambda path: Entries([Vanished()]))
+    assert PDFFigures2._index_staging(str(tmp_path), sizes=True) == {}
+
+
+def test_timeout_keeps_finished_and_quarantines_the_straggler(tmp_path):
+    files, output_dir = _inputs(tmp_path, 5)
+
+    def write(staging_dir, tmp_id):
+        if os.path.samefile(f'{staging_dir}{tmp_id}.pdf', files[4]):
+            with open(f'{staging_dir}{tmp_id}.json', 'w') as fp:
+                fp.write('[{"renderURL": "x-')  # cut off by the kill
+            raise BackendTimeout('killed')
+        with open(f'{staging_dir}{tmp_id}.json', 'w') as fp:
+            fp.write(_figure_data(staging_dir, tmp_id, 0))
+
+    backend = FakePDFFigures2(write, collect_interval=0.05)
+    backend._process_batch(files, str(output_dir), ['-d', '-m'])
+
+    quarantined = [json.loads(line)['path'] for line in (output_dir / QUARANTINE_FILENAME).read_text().splitlines()]
+    assert [os.path.basename(path) for path in quarantined] == ['paper4.pdf']
+    assert backend.metrics.snapshot()['counters']['retries'] == 1
+
+
+def test_first_batch_goes_out_before_the_input_is_read(tmp_path, monkeypatch):
+    def no_page_count(path, window=None):
+        raise AssertionError(f'page tree of {path} read by default')
+    monkeypatch.setattr('pdf_parser.utils.pdf_page_count', no_page_count)
+    pulled = []
+
+    def pdf_files():
+        for i in range(20000):
+            pulled.append(i)
+            yield str(tmp_path / f'paper{i}.pdf')
+
+    dispatched = []
+
+    def process_batch(batch_input_files, output_dir, services, n_threads, **kwargs):
+        dispatched.append(len(pulled))
+    backend = FakePDFFigures2(write=None)
+    monkeypatch.setattr(backend, '_process_batch', process_batch)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+
+    assert backend.parse_files('figure', pdf_files(), str(output_dir), 4, batch_size=100) == 20000
+    assert dispatched[0] <= 2 * 100  # within the batches in flight, not the whole input
+    assert len(dispatched) == 200
@@ -0,0 +1,84 @@
+import os
+import json
+
+import pytest
+
+from pdf_parser import DocumentWriter, Pipeline
+from pdf_parser import pipeline as pipeline_module
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for seed, stem in enumerate('abc'):
+        make_synthetic_pdf(str(input_dir / f'{stem}.pdf'), seed=seed)
+    return input_dir
+
+
+@pytest.fixture
+def staged(monkeypatch):
+    """The input pdfs staged by the pipelines of a test"""
+    calls = []
+    link_or_copy = pipeline_module.link_or_copy
+
+    def counting(src, dst, **kwargs):
+        calls.append(os.path.basename(src))
+        link_or_copy(src, dst, **kwargs)
+    monkeypatch.setattr(pipeline_module, 'link_or_copy', counting)
+    return calls
+
+
+def _pipeline(server, **kwargs):
+    return Pipeline([('grobid', 'text'), ('fake', 'figure', {'num_threads': 2})],
+                    backend_kwargs={'grobid': {'endpoints': [f'127.0.0.1:{server.port}']}}, **kwargs)
+
+
+def _documents(path):
+    return {doc['id']: doc for doc in map(json.loads, path.read_text().splitlines())}
+
+
+def test_pdfs_are_staged_once_for_all_stages(tmp_path, corpus, staged, fake_backend):
+    output_dir = tmp_path / 'out'
+    with StubServer() as server:
+        pipeline = _pipeline(server)
+        results = pipeline.parse(str(corpus), str(output_dir), 4)
+        pipeline.close()
+
+    assert results == {('grobid', 'text'): 3, ('fake', 'figure'): 3}
+    assert sorted(staged) == ['a.pdf', 'b.pdf', 'c.pdf']
+    # the stages read the staged copies, which are gone once all stages are done
+    assert all(os.path.basename(os.path.dirname(source)).startswith('.pdf_parser-tmp-')
+               for source in fake_backend.sources)
+    assert sorted(os.listdir(output_dir)) == sorted(f'{stem}{suffix}' for stem in 'abc'
+                                                    for suffix in ('.grobid.xml', '.pdffigures.figure'))
+
+
+def test_one_merged_document_per_pdf(tmp_path, corpus, staged, fake_backend):
+    (corpus / 'junk.pdf').write_bytes(b'<html>not found</html>')
+    fake_backend.fail = {'b.pdf'}
+    output_dir = tmp_path / 'out'
+    with StubServer() as server, DocumentWriter(str(tmp_path / 'documents.jsonl')) as writer:
+        pipeline = _pipeline(server, normalize=writer, preflight=True)
+        pipeline.parse(str(corpus), str(output_dir))
+        pipeline.close()
+
+    documents = _documents(tmp_path / 'documents.jsonl')
+    assert sorted(documents) == ['a', 'b', 'c']  # junk rejected in the scan, before any stage
+    assert documents['a']['sources'] == ['.grobid.xml', '.pdffigures.figure']
+    assert documents['a']['figures'][0]['caption'] == 'a.pdf'
+    assert documents['b']['sources'] == ['.grobid.xml']
+    assert 'junk.pdf' not in staged + fake_backend.parsed
+
+
+def test_resumed_pipeline_stages_nothing(tmp_path, corpus, staged, fake_backend):
+    output_dir = tmp_path / 'out'
+    with StubServer() as server:
+        pipeline = _pipeline(server, manifest=True)
+        pipeline.parse(str(corpus), str(output_dir))
+        del staged[:], fake_backend.parsed[:]
+        pipeline.parse(str(corpus), str(output_dir))
+        pipeline.close()
+
+    assert staged == [] and fake_backend.parsed == []
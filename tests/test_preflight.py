@@ -0,0 +1,66 @@
+import os
+import json
+
+import pytest
+
+from pdf_parser import Parser
+from pdf_parser.benchmark import make_synthetic_pdf
+from pdf_parser.manifest import JobManifest
+from pdf_parser.preflight import REJECTS_FILENAME, Preflight
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(path), n_pages=3, seed=1)
+    return path.read_bytes()
+
+
+def test_rejection_reasons(pdf):
+    check = Preflight().check_bytes
+    assert check(pdf) is None
+    assert check(b'') == 'empty file'
+    assert check(b'  <!DOCTYPE html><html>403</html>') == 'html, not a pdf'
+    assert check(pdf.replace(b'%PDF-', b'%PS-A', 1)) == 'no pdf header'
+    assert check(pdf[:len(pdf) // 2]) == 'no %%EOF marker, truncated'
+    assert check(b'%PDF-1.4\n1 0 obj\n<< >>\nendobj\n%%EOF\n') == 'no trailer'
+    assert check(pdf.replace(b'/Root 1 0 R', b'/Root 1 0 R /Encrypt 9 0 R')) == 'encrypted'
+    assert Preflight(reject_encrypted=False).check_bytes(pdf.replace(b'/Root 1 0 R', b'/Encrypt 9 0 R')) is None
+    assert check(pdf.replace(b'/Count 3', b'/Count 0')) == 'no pages'
+    assert Preflight(max_pages=2).check_bytes(pdf) == '3 pages, more than 2'
+
+    scanned = pdf.replace(b'/Type /Font', b'/Type /XObject /Subtype /Image').replace(b'/Font', b'/XObject')
+    assert check(scanned) is None
+    assert Preflight(reject_image_only=True).check_bytes(scanned) == 'images only, no text layer'
+    assert Preflight(reject_image_only=True).check_bytes(pdf) is None
+
+
+def test_only_the_ends_of_a_large_pdf_are_read(tmp_path, pdf):
+    path = tmp_path / 'large.pdf'
+    # the page tree is out of the windows, so the page count is unknown, and the pdf passes
+    path.write_bytes(pdf[:9] + b'%' + b' ' * (1 << 16) + b'\n' + pdf[9:])
+    preflight = Preflight(max_pages=2, window=4096)
+    assert preflight.check(str(path)) is None
+    path.write_bytes(pdf[:9] + b'%' + b' ' * (1 << 16) + b'\n')
+    assert preflight.check(str(path)) == 'no %%EOF marker, truncated'
+    assert preflight.check(str(tmp_path / 'missing.pdf')).startswith('unreadable')
+
+
+def test_rejected_pdfs_never_reach_the_backend(tmp_path, pdf, fake_backend):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    (input_dir / 'paper.pdf').write_bytes(pdf)
+    (input_dir / 'empty.pdf').write_bytes(b'')
+    (input_dir / 'long.pdf').write_bytes(pdf)
+    output_dir = tmp_path / 'out'
+    parser = Parser('fake', manifest=True, preflight=Preflight(max_pages=2))
+    assert parser.parse('figure', str(input_dir), str(output_dir), 2) == 0
+
+    assert fake_backend.parsed == []
+    rejects = [json.loads(line) for line in (output_dir / REJECTS_FILENAME).read_text().splitlines()]
+    assert sorted((os.path.basename(record['path']), record['reason']) for record in rejects) == [
+        ('empty.pdf', 'empty file'), ('long.pdf', '3 pages, more than 2'), ('paper.pdf', '3 pages, more than 2')]
+    manifest = JobManifest(str(output_dir), 'fake', 'figure')
+    assert manifest.counts() == {'failed': 3}
+    manifest.close()
+    assert parser.metrics.snapshot()['counters']['rejected'] == 3
@@ -0,0 +1,18 @@
+import json
+
+from pdf_parser import Parser
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+
+
+def test_scienceparse_posts_the_raw_pdf(tmp_path):
+    pdf = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(pdf), n_pages=2, seed=1)
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    with StubServer() as server:
+        parser = Parser('scienceparse', host=server.host, port=server.port, retry=1)
+        results = parser.parse_bytes('text', pdf.read_bytes(), 'paper.pdf')
+        parser.parse('text', str(pdf), str(output_dir))
+    assert json.loads(results['.scienceparse.json'])['title'] == 'stub'
+    assert json.loads((output_dir / 'paper.pdf.scienceparse.json').read_bytes())['title'] == 'stub'
+    assert parser.metrics.snapshot()['counters'].get('documents_failed', 0) == 0
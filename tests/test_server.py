@@ -0,0 +1,134 @@
+import io
+import os
+import json
+import time
+import zipfile
+import threading
+import urllib.error
+import urllib.request
+
+import pytest
+
+from pdf_parser.benchmark import StubServer, make_synthetic_pdf
+from pdf_parser.server import ParserServer
+from pdf_parser.service import ParserService
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / 'paper.pdf'
+    make_synthetic_pdf(str(path), seed=1)
+    return path.read_bytes()
+
+
+@pytest.fixture
+def server(fake_backend):
+    with StubServer() as stub:
+        service = ParserService({'fake': {}, 'scienceparse': {'host': stub.host, 'port': stub.port}}, reserved=2)
+        server = ParserServer(('127.0.0.1', 0), service, allow_paths=True, max_upload=1 << 20)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def request(server, method, path, data=None):
+    url = f'http://127.0.0.1:{server.server_port}{path}'
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method), timeout=30) as r:
+            return r.status, r.headers, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def test_health(server):
+    status, _, body = request(server, 'GET', '/health')
+    assert status == 200
+    assert json.loads(body)['backends'] == {'fake': {'interactive': True, 'bulk': True},
+                                            'scienceparse': {'interactive': True, 'bulk': True}}
+
+    server.service.bulk['fake'].handler.health = False
+    status, _, body = request(server, 'GET', '/health')
+    assert status == 503 and json.loads(body)['ok'] is False
+
+
+def test_parse_streams_a_zip_of_the_results(server, pdf):
+    status, headers, body = request(server, 'POST', '/parse?backend=fake&type=figure&name=paper.pdf', pdf)
+    assert status == 200
+    assert headers['Transfer-Encoding'] == 'chunked' and headers['Content-Type'] == 'application/zip'
+    results = zipfile.ZipFile(io.BytesIO(body))
+    assert results.namelist() == ['paper.pdffigures.figure/figure-data.json']
+
+
+def test_parse_sends_one_result_file_by_suffix(server, pdf):
+    status, headers, body = request(server, 'POST', '/parse?backend=scienceparse&type=text&name=paper.pdf'
+                                                    '&suffix=.scienceparse.json', pdf)
+    assert status == 200 and headers['Content-Type'] == 'application/octet-stream'
+    assert json.loads(body)['title'] == 'stub'
+
+    status, _, body = request(server, 'POST', '/parse?backend=scienceparse&type=text&suffix=.grobid.xml', pdf)
+    assert status == 404 and '.scienceparse.json' in json.loads(body)['error']
+
+
+def test_job_is_polled_then_fetched(server, pdf):
+    status, headers, body = request(server, 'POST', '/jobs?backend=fake&type=figure&name=paper.pdf', pdf)
+    job = json.loads(body)
+    assert status == 202 and headers['Location'] == f'/jobs/{job["id"]}'
+    assert job['status'] in ('queued', 'running', 'done')
+
+    status, _, body = request(server, 'GET', f'/jobs/{job["id"]}/result?wait=10')
+    assert status == 200
+    assert zipfile.ZipFile(io.BytesIO(body)).namelist() == ['paper.pdffigures.figure/figure-data.json']
+    status, _, body = request(server, 'GET', f'/jobs/{job["id"]}')
+    assert json.loads(body)['status'] == 'done' and json.loads(body)['results'] == ['.pdffigures.figure']
+    assert job['id'] in [other['id'] for other in json.loads(request(server, 'GET', '/jobs')[2])['jobs']]
+
+    assert request(server, 'DELETE', f'/jobs/{job["id"]}')[0] == 200
+    assert request(server, 'GET', f'/jobs/{job["id"]}')[0] == 404
+
+
+def test_bulk_job_of_a_directory(server, tmp_path, fake_backend):
+    os.makedirs(tmp_path / 'in')
+    for i in range(3):
+        make_synthetic_pdf(str(tmp_path / 'in' / f'paper{i}.pdf'), seed=i)
+    output_dir = tmp_path / 'out'
+    status, _, body = request(server, 'POST', f'/jobs?backend=fake&type=figure&path={tmp_path / "in"}'
+                                              f'&output={output_dir}', b'')
+    job = json.loads(body)
+    assert status == 202 and job['kind'] == 'bulk'
+
+    deadline = time.time() + 10
+    while json.loads(request(server, 'GET', f'/jobs/{job["id"]}')[2])['status'] != 'done':
+        assert time.time() < deadline
+        time.sleep(0.05)
+    assert json.loads(request(server, 'GET', f'/jobs/{job["id"]}')[2])['count'] == 3
+    assert sorted(name for name in os.listdir(output_dir) if not name.startswith('.')) == \
+        ['paper0.pdffigures.figure', 'paper1.pdffigures.figure', 'paper2.pdffigures.figure']
+    assert request(server, 'GET', f'/jobs/{job["id"]}/result')[0] == 409
+
+    server.allow_paths = False
+    assert request(server, 'POST', f'/jobs?backend=fake&type=figure&path={tmp_path / "in"}', b'')[0] == 403
+
+
+def test_bad_requests(server, pdf):
+    status, _, body = request(server, 'POST', '/parse?backend=grobid&type=text', pdf)
+    assert status == 400 and 'not served' in json.loads(body)['error']
+    status, _, body = request(server, 'POST', '/parse?backend=fake&type=text', pdf)
+    assert status == 400 and 'could not parse for type' in json.loads(body)['error']
+    assert request(server, 'POST', '/parse?backend=fake&type=figure', b'')[0] == 400
+    assert request(server, 'POST', '/parse?backend=fake&type=figure', b'x' * (2 << 20))[0] == 413
+    assert request(server, 'GET', '/jobs/missing')[0] == 404
+    assert request(server, 'GET', '/nowhere')[0] == 404
+
+
+def test_parse_rejects_a_bulk_job_without_queueing_it(server, tmp_path, fake_backend):
+    os.makedirs(tmp_path / 'in')
+    make_synthetic_pdf(str(tmp_path / 'in' / 'paper.pdf'), seed=1)
+    status, _, body = request(server, 'POST', f'/parse?backend=fake&type=figure&path={tmp_path / "in"}'
+                                              f'&output={tmp_path / "out"}', b'')
+    assert status == 400 and 'POST /jobs' in json.loads(body)['error']
+    assert server.jobs() == [] and server.service.metrics.snapshot()['gauges'].get('bulk_jobs', 0) == 0
+    time.sleep(0.2)
+    assert fake_backend.parsed == [] and not os.path.exists(tmp_path / 'out')
@@ -0,0 +1,32 @@
+import time
+
+from pdf_parser.service import ParserService
+
+
+def test_cancelled_bulk_job_stops_and_resumes(tmp_path, fake_backend, monkeypatch):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for i in range(40):
+        (input_dir / f'paper{i}.pdf').write_bytes(b'%PDF-1.4\n')
+    output_dir = tmp_path / 'out'
+    process_pdf = fake_backend._process_pdf
+
+    def slow(self, *args, **kwargs):
+        time.sleep(0.05)
+        return process_pdf(self, *args, **kwargs)
+    monkeypatch.setattr(fake_backend, '_process_pdf', slow)
+
+    service = ParserService({'fake': {}}, reserved=1, parser_options={'manifest': True})
+    job = service.submit_bulk('fake', 'figure', str(input_dir), str(output_dir), num_threads=1)
+    while not fake_backend.parsed:
+        time.sleep(0.01)
+    start = time.time()
+    service.close(cancel_bulk=True)
+    assert time.time() - start < 1
+    parsed = job.result(0)
+    assert 0 < parsed < 40
+
+    service = ParserService({'fake': {}}, reserved=1, parser_options={'manifest': True})
+    assert service.submit_bulk('fake', 'figure', str(input_dir), str(output_dir), num_threads=1).result(10) == 40 - parsed
+    service.close()
+    assert sorted(fake_backend.parsed) == sorted(f'paper{i}.pdf' for i in range(40))
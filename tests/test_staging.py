@@ -0,0 +1,50 @@
+import os
+
+import pytest
+
+from pdf_parser.backends.cermine import Cermine
+from pdf_parser.utils import link_or_copy
+
+
+def test_link_or_copy_never_writes_through_existing_dst(tmp_path, monkeypatch):
+    src, other = tmp_path / 'a.pdf', tmp_path / 'b.pdf'
+    src.write_bytes(b'%PDF-a')
+    other.write_bytes(b'%PDF-b')
+    dst = tmp_path / 'staged.pdf'
+    link_or_copy(str(src), str(dst))
+
+    # no link possible, so the copy fallback is taken while dst is a hardlink to src
+    monkeypatch.setattr(os, 'link', lambda *args: (_ for _ in ()).throw(OSError('no links')))
+    with pytest.raises(FileExistsError):
+        link_or_copy(str(other), str(dst))
+    assert src.read_bytes() == b'%PDF-a'
+
+
+def test_cermine_stages_inputs_with_the_same_name_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(Cermine, '_check_java', lambda self: setattr(self, 'health', True))
+    cermine = Cermine()
+    inputs = []
+    for sub in ('a', 'b'):
+        os.makedirs(tmp_path / sub)
+        path = tmp_path / sub / 'x.pdf'
+        path.write_bytes(b'%PDF-' + sub.encode())
+        inputs.append(str(path))
+    inputs.append(inputs[0])  # listed twice
+    staged = []
+
+    def run_extractor(dirname, service, n_docs, timeout=None):
+        for name in sorted(os.listdir(dirname)):
+            with open(os.path.join(dirname, name), 'rb') as fp:
+                staged.append(fp.read())
+            with open(os.path.join(dirname, os.path.splitext(name)[0] + '.cermxml'), 'w') as fp:
+                fp.write('<article/>')
+
+    monkeypatch.setattr(cermine, '_run_extractor', run_extractor)
+    output_dir = tmp_path / 'out'
+    os.makedirs(output_dir)
+    cermine._process_batch(inputs, str(output_dir), 'jats')
+
+    assert staged == [b'%PDF-a', b'%PDF-b', b'%PDF-a']
+    assert (tmp_path / 'a' / 'x.pdf').read_bytes() == b'%PDF-a'
+    assert (tmp_path / 'b' / 'x.pdf').read_bytes() == b'%PDF-b'
+    assert 'x.cermine.xml' in os.listdir(output_dir)
@@ -0,0 +1,120 @@
+import os
+import json
+import zipfile
+
+import pytest
+
+from pdf_parser import Parser
+from pdf_parser.store import ResultStore
+
+TEI = b'<TEI>' + b'text ' * 1000 + b'</TEI>'
+FIGURES = {'figure-data.json': b'[{"name": "1"}]', 'Figure1-1.png': os.urandom(2000)}
+
+
+def test_read_while_the_shard_is_written(tmp_path):
+    store = ResultStore(str(tmp_path / 'store'))
+    store.put('paper1', {'.grobid.xml': TEI})
+    assert store.get('paper1') == {'.grobid.xml': TEI}  # shard still open, no central directory yet
+    store.put('paper2', {'.pdffigures2.figure': FIGURES})
+    assert store.read('paper2', 'paper2.pdffigures2.figure/Figure1-1.png') == FIGURES['Figure1-1.png']
+    assert store.get('paper1') == {'.grobid.xml': TEI}
+    store.close()
+
+
+def test_shards_roll_over_and_stay_readable_after_reopening(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    store = ResultStore(store_dir, shard_bytes=4096)
+    for i in range(6):
+        store.put(f'paper{i}', {'.grobid.xml': TEI + str(i).encode(), '.pdffigures2.figure': FIGURES})
+    store.close()
+    shards = sorted(name for name in os.listdir(store_dir) if name.endswith('.zip'))
+    assert len(shards) > 1
+    for shard in shards:  # closed shards are plain zip files
+        assert zipfile.ZipFile(os.path.join(store_dir, shard)).testzip() is None
+
+    store = ResultStore(store_dir, shard_bytes=4096)
+    store.put('paper6', {'.grobid.xml': TEI})
+    assert len(store) == 7
+    for i in range(6):
+        assert store.get(f'paper{i}') == {'.grobid.xml': TEI + str(i).encode(), '.pdffigures2.figure': FIGURES}
+    assert len([name for name in os.listdir(store_dir) if name.endswith('.zip')]) == len(shards) + 1
+    store.close()
+
+
+@pytest.mark.filterwarnings('ignore:Duplicate name')  # the index points at the newest member
+def test_a_new_result_replaces_the_old_one(tmp_path):
+    with ResultStore(str(tmp_path / 'store')) as store:
+        store.put('paper', {'.pdffigures2.figure': FIGURES})
+        store.put('paper', {'.pdffigures2.figure': {'figure-data.json': b'[]'}})
+        assert store.get('paper') == {'.pdffigures2.figure': {'figure-data.json': b'[]'}}
+
+
+def test_add_moves_result_files_into_the_store(tmp_path):
+    output_dir = tmp_path / 'out'
+    figure_dir = output_dir / 'paper.pdffigures2.figure'
+    os.makedirs(figure_dir)
+    for name, data in FIGURES.items():
+        (figure_dir / name).write_bytes(data)
+    (output_dir / 'paper.grobid.xml').write_bytes(TEI)
+    with ResultStore(str(tmp_path / 'store')) as store:
+        assert store.add('/in/paper.pdf', {'.grobid.xml': str(output_dir / 'paper.grobid.xml'),
+                                           '.pdffigures2.figure': str(figure_dir),
+                                           '.cermine.xml': str(output_dir / 'paper.cermine.xml')})
+        assert store.get('paper') == {'.grobid.xml': TEI, '.pdffigures2.figure': FIGURES}
+    assert os.listdir(output_dir) == []
+
+
+def test_copy_indexes_a_duplicate_without_writing_again(tmp_path):
+    store_dir = str(tmp_path / 'store')
+    with ResultStore(store_dir) as store:
+        store.put('paper', {'.grobid.xml': TEI, '.pdffigures2.figure': FIGURES})
+        size = sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir)
+                   if name.endswith('.zip'))
+        assert store.copy('paper', 'paper-copy')
+        assert not store.copy('missing', 'other')
+        assert store.get('paper-copy') == store.get('paper')
+        assert store.read('paper-copy', 'paper-copy.grobid.xml') == TEI
+        assert sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir)
+                   if name.endswith('.zip')) == size
+        assert store.ids() == ['paper', 'paper-copy']
+
+
+def test_export_writes_the_output_dir_layout(tmp_path):
+    with ResultStore(str(tmp_path / 'store'), shard_bytes=4096) as store:
+        store.put('paper1', {'.grobid.xml': TEI})
+        store.put('paper2', {'.pdffigures2.figure': FIGURES})
+        store.copy('paper1', 'paper3')
+        assert store.export(str(tmp_path / 'out')) == 3
+        assert store.export(str(tmp_path / 'some'), ['paper2', 'missing']) == 1
+    out = tmp_path / 'out'
+    assert sorted(os.listdir(out)) == ['paper1.grobid.xml', 'paper2.pdffigures2.figure', 'paper3.grobid.xml']
+    assert (out / 'paper3.grobid.xml').read_bytes() == TEI
+    assert {name: (out / 'paper2.pdffigures2.figure' / name).read_bytes() for name in FIGURES} == FIGURES
+    assert os.listdir(tmp_path / 'some') == ['paper2.pdffigures2.figure']
+
+
+def test_parsed_results_round_trip_through_the_store(tmp_path, fake_backend):
+    input_dir = tmp_path / 'in'
+    input_dir.mkdir()
+    for stem in 'ab':
+        (input_dir / f'{stem}.pdf').write_bytes(b'%PDF-1.4\n' + stem.encode())
+    (input_dir / 'a-copy.pdf').write_bytes(b'%PDF-1.4\na')
+    output_dir = tmp_path / 'out'
+    with ResultStore(str(tmp_path / 'store')) as store:
+        parser = Parser('fake', store=store, dedup=('hash',))
+        assert parser.parse('figure', str(input_dir), str(output_dir), 2) == 2  # the copy is shared, not parsed
+        assert sorted(os.path.splitext(name)[0] for name in fake_backend.parsed) in (['a', 'b'], ['a-copy', 'b'])
+        assert [name for name in os.listdir(output_dir) if not name.startswith('.')] == []  # all moved into the store
+        assert store.ids() == ['a', 'a-copy', 'b']
+
+        del fake_backend.parsed[:]
+        parser.parse('figure', str(input_dir), str(output_dir), 2)
+        assert fake_backend.parsed == []  # all in the store already
+        assert store.export(str(tmp_path / 'layout')) == 3
+
+    layout = tmp_path / 'layout'
+    assert sorted(os.listdir(layout)) == ['a-copy.pdffigures.figure', 'a.pdffigures.figure', 'b.pdffigures.figure']
+    captions = {path.name: json.loads((path / 'figure-data.json').read_bytes())[0]['Caption']
+                for path in layout.iterdir()}
+    assert captions['b.pdffigures.figure'] == 'b.pdf'
+    assert captions['a.pdffigures.figure'] == captions['a-copy.pdffigures.figure']
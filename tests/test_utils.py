@@ -0,0 +1,44 @@
+from pdf_parser.benchmark import make_synthetic_pdf
+from pdf_parser.utils import BYTES_PER_PAGE, longest_first, pack_batches
+
+
+def _sized(tmp_path, n_pages):
+    files = []
+    for i, n in enumerate(n_pages):
+        path = tmp_path / f'{i}.pdf'
+        path.write_bytes(b'%PDF' + b' ' * (n * BYTES_PER_PAGE))
+        files.append(str(path))
+    return files
+
+
+def test_longest_first_sorts_within_windows(tmp_path):
+    files = _sized(tmp_path, [1, 3, 2, 9, 5, 7])
+    assert [cost for _, cost in longest_first(files, window=3)] == [3, 2, 1, 9, 7, 5]
+    assert [cost for _, cost in longest_first(files, window=None)] == [9, 7, 5, 3, 2, 1]
+    assert list(longest_first(files, schedule=None)) == [(file, None) for file in files]
+
+
+def test_longest_first_by_pages_reads_the_page_tree(tmp_path):
+    short, long = str(tmp_path / 'short.pdf'), str(tmp_path / 'long.pdf')
+    make_synthetic_pdf(short, 2)
+    make_synthetic_pdf(long, 7)
+    assert list(longest_first([short, long], schedule='pages')) == [(long, 7), (short, 2)]
+
+
+def test_longest_first_is_lazy(tmp_path):
+    pulled = []
+
+    def pdf_files():
+        for i in range(100000):
+            pulled.append(i)
+            yield str(tmp_path / f'{i}.pdf')
+
+    scheduled = longest_first(pdf_files(), window=8)
+    next(scheduled)
+    assert len(pulled) == 8
+
+
+def test_pack_batches_by_pages():
+    scheduled = [('huge', 50), ('a', 6), ('b', 5), ('c', 4), ('d', 1)]
+    assert list(pack_batches(scheduled, batch_size=10, batch_pages=10)) == [['huge'], ['a'], ['b', 'c', 'd']]
+    assert list(pack_batches(scheduled, batch_size=2)) == [['huge', 'a'], ['b', 'c'], ['d']]